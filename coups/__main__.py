@@ -14,23 +14,30 @@ import click
 import pathlib
 from collections import namedtuple
 
-import coups.manifest
-import coups.scisoft
 from coups.util import versionify
 
 @click.group()
 @click.option('--url',
               default='https://scisoft.fnal.gov/scisoft/',
               envvar='COUPS_URL',
-              help="Base URL for scisoft collection")
+              help="Base URL for scisoft collection, a mirror URL or a local mirror directory")
 @click.option("-s", "--store", 
               type=click.Path(dir_okay=False, file_okay=True,
                               resolve_path=True),
               envvar='COUPS_STORE',
               default="coups.db",
               help="The coups store")
+@click.option("--pragmas", default="default",
+              envvar='COUPS_PRAGMAS',
+              help="SQLite pragma profile name and/or comma-separated key=value pairs")
+@click.option("--cache-ttl", default=3600, type=int,
+              envvar='COUPS_CACHE_TTL',
+              help="Seconds a cached scisoft index page is used before revalidating")
+@click.option("--offline/--no-offline", default=False,
+              envvar='COUPS_OFFLINE',
+              help="Use only cached scisoft index pages")
 @click.pass_context
-def cli(ctx, url, store):
+def cli(ctx, url, store, pragmas, cache_ttl, offline):
     '''
     coups pecks at containers for UPS products
 
@@ -39,7 +46,11 @@ def cli(ctx, url, store):
     available at https://github.com/brettviren/coups
     '''
     import coups.main
-    ctx.obj = coups.main.Coups(store, url)
+    import coups.scisoft
+    import coups.webcache
+    coups.scisoft.set_base(url)
+    coups.webcache.configure(ttl=cache_ttl, offline=offline)
+    ctx.obj = coups.main.Coups(store, url, pragmas=pragmas)
 
 
 @cli.command("bundles")
@@ -53,6 +64,7 @@ def bundles(ctx, online, missing):
     List known bundles
     '''
     if online or missing:
+        import coups.scisoft
         there = set(list(coups.scisoft.bundles(False)))
 
     if not online or missing:
@@ -79,6 +91,7 @@ def packages(ctx, online, missing):
     List known packages
     '''
     if online or missing:
+        import coups.scisoft
         there = set(list(coups.scisoft.packages(False)))
 
     if not online or missing:
@@ -131,8 +144,17 @@ def get_manifest(ctx, output, quals, flavor, version, name):
             fp.write(render_meth(prod) + "\n")
 
 
-def load_one_manifest(main, mtp, refresh):
-    from coups.store import Manifest, Product
+def load_one_manifest(main, mtp, refresh, ptps=None, text=None):
+    '''
+    Load one manifest, return true if loaded or changed.
+
+    The manifest text is fetched unless text or ptps is given and
+    product tuples are parsed from the text unless ptps is given.  On
+    refresh, a manifest with unchanged text is left as-is and
+    otherwise only the product links which differ are changed.
+    '''
+    import coups.manifest
+    from datetime import datetime
 
     mobj, existing = main.manifest(mtp, True)
 
@@ -140,19 +162,58 @@ def load_one_manifest(main, mtp, refresh):
         click.echo(f'have {mobj}')
         return False
 
-    mobj.products.clear() # correct?
-    main.session.add(mobj)
-                
-    for ptp in coups.manifest.load(mtp):
-        pobj, existing = main.product(ptp, True)
+    if text is None and ptps is None:
+        text = coups.manifest.load_text(mtp)
+    digest = None
+    if text is not None:
+        digest = main.manifest_body(text)
+        if existing and digest == mobj.digest:
+            mobj.fetched = datetime.now()
+            main.commit(mobj)
+            click.echo(f'same {mobj}')
+            return False
+    if ptps is None:
+        ptps = coups.manifest.parse_body(text)
+
+    want = dict()
+    for ptp in ptps:
+        want.setdefault(ptp.filename, ptp)
+    for pobj in list(mobj.products):
+        if want.pop(pobj.filename, None) is None:
+            mobj.products.remove(pobj)
+    for ptp in want.values():
+        pobj, _ = main.product(ptp, True)
         mobj.products.append(pobj)
-    main.session.commit()
-    click.echo(f'load {mobj}')    
+    if digest is not None:
+        mobj.digest = digest
+    mobj.fetched = datetime.now()
+    main.commit(mobj)
+    main.update_overlaps(mobj)
+    click.echo(f'{"diff" if existing else "load"} {mobj}')
     return True
 
+def bulk_load_manifests(main, mtps, refresh):
+    '''
+    Bulk load manifests, each as it is read, return list of those
+    already loaded.
+
+    With refresh, none are considered already loaded.
+    '''
+    have = list()
+    for mtp in mtps:
+        if not refresh and main.has_manifest(mtp):
+            click.echo(f'have {mtp.filename}')
+            have.append(mtp)
+            continue
+        stats = main.stream_manifest(mtp, refresh)
+        click.echo(f'bulk {mtp.filename}: {stats}')
+    return have
+
 @cli.command("load-manifest")
 @click.option("--refresh/--no-refresh", default=False,
               help="If refresh, then will re-read existing")
+@click.option("--bulk/--no-bulk", default=False,
+              help="Use set-based bulk loading")
 @click.option("-q", "--quals", default=None,
               help="Colon-separate list of qualifiers")
 @click.option("-f", "--flavor", default=None,
@@ -161,36 +222,88 @@ def load_one_manifest(main, mtp, refresh):
               help="Version")
 @click.argument("name")
 @click.pass_context
-def load_manifest(ctx, refresh, quals, flavor, version, name):
+def load_manifest(ctx, refresh, bulk, quals, flavor, version, name):
     '''
     Load a manifest (file or URL) into db
 
     Name can be a bundle or a manifest file name or url.
     '''
+    import coups.manifest
     mtp = coups.manifest.make(name, version, flavor, quals)
+    if bulk:
+        bulk_load_manifests(ctx.obj, [mtp], refresh)
+        return
     load_one_manifest(ctx.obj, mtp, refresh)
 
 
-def load_one_bundle(main, bundle, versions=(), newer=None, refresh=False):
-    for ver in coups.scisoft.bundle_versions(bundle, full=False):
+def write_bundle(main, walk, refresh=False, bulk=False):
+    '''
+    Write manifests found by a crawl.Walk over a bundle to the DB.
 
-        if versions and ver not in versions:
-            continue
+    This is the single DB writer for a crawl.  It returns when the
+    walk ends or reaches a manifest already loaded.  With bulk, each
+    manifest is loaded by coups.bulk.load_stream() as its products
+    are read, from a walk made with crawl.bundle(stream=True) or one
+    giving lists of products.
 
-        if newer and ver < newer:
-            print(f'reach old {ver} < {newer}')
-            break
+    Return list of file names of manifests loaded.
+    '''
+    from coups import crawl
+    loaded = list()
+
+    for found in walk:
+        if found.status == "old":
+            print(f'reach old {found.version} < {walk.newer}')
+        elif found.status == "broken":
+            click.echo(f"broken bundle: {found.name} {found.version}")
+            click.echo(found.data)
+        elif found.status == "have":
+            click.echo(f'have {found.filename}')
+        elif bulk:
+            mtp, ptps = found.data[:2]
+            body = found.data[2] if len(found.data) > 2 else None
+            try:
+                stats = main.stream_manifest(mtp, refresh, ptps, body)
+            except crawl.broken_errors as err:
+                # the body failed part way through
+                main.session.rollback()
+                click.echo(f"broken bundle: {found.name} {found.version}")
+                click.echo(err)
+                continue
+            click.echo(f'bulk {mtp.filename}: {stats}')
+            loaded.append(mtp.filename)
+        else:
+            mtp, ptps = found.data[:2]
+            text = found.data[2] if len(found.data) > 2 else None
+            if load_one_manifest(main, mtp, refresh, ptps, text):
+                loaded.append(mtp.filename)
+            elif not refresh:
+                return loaded
+    return loaded
 
-        try:
-            for mfname in coups.scisoft.bundle_manifests(bundle, ver, False):
-                mtp = coups.manifest.parse_filename(mfname)
-                loaded = load_one_manifest(main, mtp, refresh)
-                if not refresh and not loaded:
-                    return
-        except ValueError as err:
-            click.echo(f"broken bundle: {bundle} {ver}")
-            click.echo(err)
-            continue
+
+def load_one_bundle(main, bundle, versions=(), newer=None, refresh=False, bulk=False,
+                    crawler=None, known=None):
+    '''
+    Crawl scisoft for manifests of a bundle and load them, return
+    list of file names of manifests loaded.
+
+    A crawl.Crawler may be given to share with other crawls, else one
+    is made.  The known manifest file names are read from the DB if
+    not given.  What the crawl saw is journaled.
+    '''
+    from coups import crawl
+    from coups.store import Manifest
+    if known is None:
+        known = main.filenames(Manifest)
+    if crawler is None:
+        with crawl.Crawler() as crawler:
+            return load_one_bundle(main, bundle, versions, newer, refresh, bulk,
+                                   crawler, known)
+    walk = crawl.bundle(crawler, bundle, versions, newer, refresh, known, stream=bulk)
+    loaded = write_bundle(main, walk, refresh, bulk)
+    main.journal("bundle", walk)
+    return loaded
 
 @cli.command("load-bundle")
 @click.option("--refresh/--no-refresh", default=False,
@@ -199,67 +312,120 @@ def load_one_bundle(main, bundle, versions=(), newer=None, refresh=False):
               help="Only load those with versions lexically greater or equal than")
 @click.option("--versions", default=None,
               help="Comma-separated list of versions to consider")
+@click.option("--bulk/--no-bulk", default=False,
+              help="Use set-based bulk loading")
+@click.option("-j", "--jobs", default=4,
+              help="Number of concurrent requests to scisoft")
 @click.argument("bundle")
 @click.pass_context
-def load_bundle(ctx, refresh, newer, versions, bundle):
+def load_bundle(ctx, refresh, newer, versions, bulk, jobs, bundle):
     '''
     Load a bundle of manifests into DB.
 
     Otherwise, if a bundle name or an unqualifed URL is given, scisoft
     will be scraped and the "newer" and "refresh" options apply.
     '''
+    from coups.crawl import Crawler
     if versions:
         versions = set([v for v in versions.split(',') if v])
-    load_one_bundle(ctx.obj, bundle, versions, newer, refresh)
-
+    with Crawler(jobs, jobs) as crawler:
+        load_one_bundle(ctx.obj, bundle, versions, newer, refresh, bulk, crawler)
 
-def load_one_package(main, package, versions=(), newer=None, refresh=False):
-    from coups.store import Product, Flavor, Qual
 
-    for ver in coups.scisoft.package_versions(package, full=False):
+def write_package(main, walk, refresh=False, batch=500):
+    '''
+    Write products found by a crawl.Walk over a package to the DB.
 
-        if versions and ver not in versions:
+    Products are committed batch at a time along with the progress of
+    the walk so that an interrupted load resumes from the last commit.
+    '''
+    import coups.product
+    from coups.store import Product, Flavor, Qual, qualkey
+
+    flavors = dict()
+    quals = dict()
+    def lookup(Type, cache, name):
+        obj = cache.get(name)
+        if obj is None:
+            obj = cache[name] = main.lookup(Type, name=name)
+        return obj
+
+    pending = 0
+    for found in walk:
+        if found.status == "old":
+            print(f'reach old {found.version} < {walk.newer}')
+            continue
+        if found.status == "broken":
+            click.echo(f"broken package: {found.name} {found.version}")
+            click.echo(found.data)
+            continue
+        if found.status == "have":
+            click.echo(f'have {found.filename}')
             continue
 
-        if newer and ver < newer:
-            print(f'reach old {ver} < {newer}')
-            break
-
+        pfname = found.filename
         try:
-            for pfname in coups.scisoft.package_products(package, ver, False):
-                pobj = main.qfirst(Product, filename=pfname)
-
-                if pobj and not refresh:
-                    click.echo(f'have {pobj}')
-                    return
-
-                try:
-                    ptp = coups.product.parse_filename(pfname)
-                except ValueError as err:
-                    sys.stderr.write(str(err) + '\n')
-                    continue
-
-                if not pobj:
-                    pobj = Product(filename=ptp.filename)
-                    main.session.add(pobj)
-                pobj.name = ptp.name
-                pobj.version = ptp.version
-                if ptp.flavor:
-                    pobj.flavor = main.lookup(Flavor, name=ptp.flavor)
-                else:
-                    pobj.flavor = main.lookup(Flavor, name="NULL")
-                pobj.quals = []
-                if ptp.quals:
-                    pobj.quals = [ main.lookup(Qual, name=q) for q in ptp.quals.split(":") ]
-                main.commit(pobj)
-                print(pobj)
-            main.commit()
-
+            ptp = coups.product.parse_filename(pfname)
         except ValueError as err:
-            click.echo(f"broken package: {package} {ver}")
-            click.echo(err)
+            sys.stderr.write(str(err) + '\n')
             continue
 
+        # look up before a new product is in the session to autoflush
+        flavor = lookup(Flavor, flavors, ptp.flavor or "NULL")
+        qobjs = []
+        if ptp.quals:
+            qobjs = [lookup(Qual, quals, q) for q in ptp.quals.split(":")]
+
+        # the walk passes over known products unless refreshing
+        pobj = None
+        if refresh:
+            pobj = main.qfirst(Product, filename=pfname)
+        if not pobj:
+            pobj = Product(filename=ptp.filename)
+            main.session.add(pobj)
+        pobj.name = ptp.name
+        pobj.version = ptp.version
+        pobj.flavor = flavor
+        pobj.quals = qobjs
+        pobj.qualkey = qualkey(ptp.quals)
+        print(pobj)
+
+        pending += 1
+        if pending >= batch:
+            # the products are committed along with the walk's progress
+            main.journal("package", walk, complete=False)
+            main.commit()
+            pending = 0
+    main.commit()
+
+
+def load_one_package(main, package, versions=(), newer=None, refresh=False,
+                     crawler=None, batch=500):
+    '''
+    Crawl scisoft for products of a package and load them.  What the
+    crawl saw is journaled.
+
+    Once a load over all versions has completed, only versions not
+    yet seen and the newest seen version are crawled and known
+    products are skipped instead of ending the crawl.  This is also
+    the case when resuming an interrupted load.  See
+    CrawlState.walk_seen.
+    '''
+    from coups import crawl
+    from coups.store import Product
+    known = main.filenames(Product)
+    if crawler is None:
+        with crawl.Crawler() as crawler:
+            return load_one_package(main, package, versions, newer, refresh,
+                                    crawler, batch)
+    state = main.crawl_state("package", package)
+    seen = state.walk_seen if state else None
+    backfill = state.backfill if state else False
+    walk = crawl.package(crawler, package, versions, newer, refresh, known,
+                         seen, backfill)
+    write_package(main, walk, refresh, batch)
+    main.journal("package", walk)
+
 
 @cli.command("load-package")
 @click.option("--newer", default=None,
@@ -268,15 +434,25 @@ def load_one_package(main, package, versions=(), newer=None, refresh=False):
               help="Comma-separated list of versions to consider")
 @click.option("--refresh/--no-refresh", default=False,
               help="If refresh, then will re-read existing")
+@click.option("-j", "--jobs", default=4,
+              help="Number of concurrent requests to scisoft")
+@click.option("--batch", default=500, type=click.IntRange(min=1),
+              help="Number of products to load per transaction")
 @click.argument("package")
 @click.pass_context
-def load_package(ctx, newer, versions, package, refresh):
+def load_package(ctx, newer, versions, package, refresh, jobs, batch):
     '''
     Load a package of products into DB.
+
+    Once a load has fully seen some versions, later loads crawl only
+    new versions and the newest seen one.  An interrupted load resumes
+    from its last committed batch.
     '''
+    from coups.crawl import Crawler
     if versions:
         versions = set([v for v in versions.split(',') if v])
-    load_one_package(ctx.obj, package, versions, newer, refresh)
+    with Crawler(jobs, jobs) as crawler:
+        load_one_package(ctx.obj, package, versions, newer, refresh, crawler, batch)
 
 @cli.command("load-product")
 @click.argument("product")
@@ -294,13 +470,171 @@ def load_product(ctx, product):
 
 
 @cli.command("update")
+@click.option("-j", "--jobs", default=4,
+              help="Number of concurrent requests to scisoft")
+@click.option("--fresh", default=3600, type=int,
+              envvar='COUPS_UPDATE_FRESH',
+              help="Skip bundles crawled within this many seconds")
 @click.pass_context
-def update(ctx):
+def update(ctx, jobs, fresh):
     '''
     Load any new manifests from known bundles.
+
+    Bundles crawled before are only checked for versions not yet seen
+    and for new manifests in their newest seen version.  All bundles
+    are crawled concurrently and written in turn.
+    '''
+    from datetime import datetime, timedelta
+    from coups import crawl
+    from coups.store import Manifest
+    main = ctx.obj
+    known = main.filenames(Manifest)
+    since = datetime.now() - timedelta(seconds=fresh)
+
+    todo = list()
+    skipped = 0
+    for bundle in main.names("manifest"):
+        state = main.crawl_state("bundle", bundle)
+        if state and state.checked and state.checked > since:
+            skipped += 1
+            continue
+        todo.append((bundle, state))
+
+    loaded = list()
+    changed = 0
+    with crawl.Crawler(jobs, jobs) as crawler:
+        walks = [(crawl.bundle(crawler, bundle, known=known,
+                               seen=state.walk_seen if state else None,
+                               backfill=state.backfill if state else False,
+                               stream=True),
+                  state and state.fingerprint)
+                 for bundle, state in todo]
+        for walk, before in walks:
+            loaded += write_bundle(main, walk, bulk=True)
+            main.journal("bundle", walk)
+            if before and walk.fingerprint != before:
+                changed += 1
+
+    click.echo(f'update: {len(walks)} bundles checked, {skipped} fresh, '
+               f'{changed} with new versions, {len(loaded)} new manifests')
+    for fname in loaded:
+        click.echo(f'new {fname}')
+
+
+@cli.command("cache")
+@click.option("--clear/--no-clear", default=False,
+              help="Remove all cached scisoft index pages and parsed UPS files")
+@click.pass_context
+def cache(ctx, clear):
+    '''
+    Show or clear the caches of scisoft index pages and parsed UPS files.
+    '''
+    import coups.webcache
+    import coups.upscache
+    click.echo(f'cache: {coups.webcache.directory()}')
+    count, nbytes = coups.upscache.info()
+    click.echo(f'ups cache: {coups.upscache.db_path()} {count} files {nbytes} bytes')
+    if clear:
+        click.echo(f'removed {coups.webcache.clear()} listings')
+        click.echo(f'removed {coups.upscache.clear()} parsed UPS files')
+
+
+@cli.command("platforms")
+@click.pass_context
+def platforms(ctx):
+    '''
+    List known platforms as: flavor cpu oses
     '''
-    for bundle in ctx.obj.names("manifest"):
-        load_one_bundle(ctx.obj, bundle)
+    from coups.platform import registry
+    ctx.obj.session             # loads any extra platforms
+    for plat in registry.platforms:
+        click.echo(' '.join([plat.flavor, plat.cpu or '-'] + list(plat.oses)))
+
+
+@cli.command("add-platform")
+@click.argument("flavor")
+@click.argument("cpu", default="")
+@click.argument("oses", nargs=-1)
+@click.pass_context
+def add_platform(ctx, flavor, cpu, oses):
+    '''
+    Add a platform to the DB.
+
+    The first OS is used when making product file names.
+    '''
+    from coups.platform import Platform
+    ctx.obj.session
+    plat = ctx.obj.add_platform(Platform(flavor, cpu, oses))
+    click.echo(f'added {plat.flavor}')
+
+
+@cli.command("mirror")
+@click.option("-o", "--outdir", default="scisoft-mirror",
+              type=click.Path(file_okay=False),
+              help="Top directory of the mirror")
+@click.option("--newer", default=None,
+              help="Only mirror those with versions lexically greater or equal than")
+@click.option("--versions", default=None,
+              help="Comma-separated list of versions to consider")
+@click.option("--refresh/--no-refresh", default=False,
+              help="If refresh, then will re-copy manifests already mirrored")
+@click.option("--products/--no-products", default=False,
+              help="Also copy the product tar files listed in the manifests")
+@click.option("-j", "--jobs", default=4,
+              help="Number of concurrent requests to scisoft")
+@click.argument("bundles", nargs=-1)
+@click.pass_context
+def mirror(ctx, outdir, newer, versions, refresh, products, jobs, bundles):
+    '''
+    Copy listings and manifests of bundles into a local mirror.
+
+    The mirror directory may then be given as --url or be served by a
+    web server, as each directory holds its listing as index.html.
+    '''
+    import coups.manifest
+    import coups.scisoft
+    from coups import crawl, mirror, download
+    if versions:
+        versions = set([v for v in versions.split(',') if v])
+
+    ptps = dict()
+    with crawl.Crawler(jobs, jobs) as crawler:
+        walks = [mirror.bundle(crawler, outdir, b, versions, newer, refresh)
+                 for b in bundles]
+        for walk in walks:
+            for found in walk:
+                if found.status == "old":
+                    click.echo(f'reach old {found.version} < {newer}')
+                elif found.status == "broken":
+                    click.echo(f"broken bundle: {found.name} {found.version}")
+                    click.echo(found.data)
+                elif found.status == "have":
+                    click.echo(f'have {found.filename}')
+                else:
+                    mtp, text = found.data
+                    path = mirror.write_manifest(outdir, mtp, text)
+                    click.echo(f'copy {path}')
+                    if products:
+                        for ptp in coups.manifest.parse_body(text):
+                            ptps[ptp.filename] = ptp
+    if ptps:
+        transfers = list()
+        for ptp in ptps.values():
+            path = mirror.product_path(outdir, ptp)
+            if path.exists():
+                continue
+            url = os.path.join(coups.scisoft.product_url(ptp.name, ptp.version), ptp.filename)
+            transfers.append(download.Transfer(url, path))
+
+        def report(res):
+            if res.error:
+                click.echo(f'fail {res.transfer.path}: {res.error}')
+            else:
+                click.echo(f'copy {res.transfer.path}')
+        results, summary = download.Downloader(jobs, report=report).run(transfers)
+        click.echo(str(summary))
+    if os.path.isdir(outdir):
+        click.echo(f'index {mirror.write_indexes(outdir)} directories')
 
 
 @cli.command("remove")
@@ -317,6 +651,38 @@ def remove(ctx, manifests):
         ctx.obj.remove_manifest(man)
 
         
+@cli.command("overlaps")
+@click.option("--rebuild/--no-rebuild", default=False,
+              help="Recalculate all materialized manifest overlaps")
+@click.argument("manifests", nargs=-1)
+@click.pass_context
+def overlaps(ctx, rebuild, manifests):
+    '''
+    Maintain or show materialized manifest overlaps.
+
+    With --rebuild, recalculate the table for the whole DB.  Any
+    manifest file names given have their overlaps shown as
+    (only this, both, only other) and the other manifest.
+    '''
+    import coups.overlap
+    from coups.store import Manifest
+    from coups.bulk import chunks
+    ses = ctx.obj.session
+    if rebuild:
+        count = coups.overlap.rebuild(ses)
+        click.echo(f'rebuilt overlaps of {count} manifests')
+    for manifest in manifests:
+        man = ctx.obj.has_manifest(manifest)
+        if not man:
+            click.echo(f'missing: {manifest}')
+            continue
+        click.echo(man.filename)
+        trios = coups.overlap.overlaps(ses, man)
+        for chunk in chunks(trios):
+            for other in ses.query(Manifest).filter(Manifest.id.in_(chunk)):
+                click.echo(f'\t{trios[other.id]} {other.filename}')
+
+
 @cli.command("compare")
 @click.argument("manifest1")
 @click.argument("manifest2")
@@ -325,6 +691,7 @@ def compare(ctx, manifest1, manifest2):
     '''
     Compare the set of products of two manifests
     '''
+    import coups.manifest
     if manifest1 == manifest2:
         return
 
@@ -359,20 +726,37 @@ def compare_bundles(ctx, bundle1, bundle2):
     '''
     Compare bundles
     '''
+    import coups.store
+    import coups.overlap
+    ses = ctx.obj.session
+    pairs = list()
     missing = 0
-    have = 0
-    for man1 in ctx.obj.session.query(coups.store.Manifest).filter_by(name=bundle1).all():
-        have += 1
+    for man1 in ses.query(coups.store.Manifest).filter_by(name=bundle1).all():
         fname2 = bundle2 + man1.filename[len(bundle1):]
         man2 = ctx.obj.has_manifest(fname2)
         if not man2:
             #click.echo(f'missing {fname2}')
             missing += 1
             continue
-        pbc = coups.manifest.cmp(man1, man2)
+        pairs.append((man1, man2))
+    for man1, man2 in pairs:
+        pbc = coups.overlap.cmp(ses, man1, man2)
         click.echo(f'{pbc} {man1.filename} {man2.filename}')
     if missing:
-        click.echo(f'have {have} {bundle1}, missing {missing} {bundle2}')
+        click.echo(f'have {len(pairs) + missing} {bundle1}, missing {missing} {bundle2}')
+
+
+def parse_extras(extras):
+    '''
+    Parse comma-separated list of bundle:number to dict.
+    '''
+    ret = dict()
+    for extra in (extras or "").split(","):
+        if not extra:
+            continue
+        mname,mnum = extra.split(":")
+        ret[mname] = int(mnum)
+    return ret
 
 
 @cli.command("container")
@@ -422,6 +806,8 @@ def container_scisoft(ctx, quals, flavor, version, subsets, number,
     name.  If the latter then specifying version, flavor and quals is
     optional.
     '''
+    import coups.manifest
+    import coups.queries
     from coups.store import Manifest
     from coups.render import dockerfile_base, dockerfile_manifest
     from coups.render import product_manifest as render_meth
@@ -440,24 +826,12 @@ def container_scisoft(ctx, quals, flavor, version, subsets, number,
     if not theman:
         sys.stderr.write(f'Unknown manifest: {mtp}')
         return -1
-    submans = coups.queries.subsets(ctx.obj.session, theman, number)
+    subs = coups.queries.subsets_within(ctx.obj.session, theman, number,
+                                        parse_extras(extras))
+    ctx.obj.commit()            # keep any overlaps materialized
 
-    if extras:
-        for extra in extras.split(","):
-            mname,mnum = extra.split(":")
-            mnum = int(mnum)
-            more = coups.queries.subsets(ctx.obj.session, theman, mnum)
-            submans += [m for m in more if m.name == mname]
-
-    submans = coups.manifest.sort_submans(theman, submans)
-    
-    keep=list()
-    for sm in submans:
-        l,m,r = coups.manifest.cmp_objects(theman, sm)
-        if len(m) == 0:
-            continue
-        keep.append(sm)
-    submans = keep
+    # in order of increasing number of products in common
+    submans = [m for m in sorted(subs, key=lambda m: subs[m][1]) if subs[m][1]]
 
     layers = list()
     layers.append(dockerfile_base(prefix, operating_system))
@@ -545,11 +919,14 @@ def products(ctx, render, quals, flavor, version, name):
     '''
     List matching products
     '''
+    import coups.queries
+    import coups.store
     import coups.render
     render_meth = getattr(coups.render, f'product_{render}')
 
+    opts = coups.queries.loaders(coups.store.Product)
     for p in coups.queries.products(ctx.obj.session,
-                                    name, version, flavor, quals):
+                                    name, version, flavor, quals, opts):
         print(render_meth(p))
 
 @cli.command("contains")
@@ -565,8 +942,11 @@ def contains(ctx, quals, flavor, version, name):
     '''
     List all manifests which contain matching products.
     '''
+    import coups.queries
+    import coups.store
+    opts = coups.queries.loaders(coups.store.Product, manifests=True)
     for p in coups.queries.products(ctx.obj.session,
-                                    name, version, flavor, quals):
+                                    name, version, flavor, quals, opts):
         print (str(p.filename))
         for m in p.manifests:
             print('\t'+m.filename)
@@ -587,6 +967,7 @@ def manifests(ctx, render, quals, flavor, version, name):
     '''
     List matching manifests
     '''
+    import coups.queries
     import coups.render
     from coups.manifest import wash_name
     from coups.store import Manifest
@@ -600,7 +981,8 @@ def manifests(ctx, render, quals, flavor, version, name):
         kwds["flavor"] = flavor
     if quals:
         kwds["quals"] = quals
-    mans = ctx.obj.qall(Manifest, **kwds)
+    mans = ctx.obj.qall(Manifest, options=coups.queries.loaders(Manifest, products=True),
+                        **kwds)
 
     for man in mans:
         print (man.filename)
@@ -625,6 +1007,8 @@ def subsets(ctx, quals, flavor, version, name, number, extras):
     '''
     Output subset manifest of matching manifests
     '''
+    import coups.overlap
+    import coups.queries
     from coups.manifest import wash_name
     from coups.store import Manifest
 
@@ -637,32 +1021,25 @@ def subsets(ctx, quals, flavor, version, name, number, extras):
     if quals:
         kwds["quals"] = quals
     mans = ctx.obj.qall(Manifest, **kwds)
+    extras = parse_extras(extras)
 
     for man in mans:
         print(man.filename)
 
-        submans = coups.queries.subsets(ctx.obj.session, man, number)
+        subs = coups.queries.subsets_within(ctx.obj.session, man, number, extras)
+        ctx.obj.commit()        # keep any overlaps materialized
 
-        if extras:
-            for extra in extras.split(","):
-                mname,mnum = extra.split(":")
-                mnum = int(mnum)
-                more = coups.queries.subsets(ctx.obj.session, man, mnum)
-                submans += [m for m in more if m.name == mname]
-
-        submans = coups.manifest.sort_submans(man, set(submans))
-
-        for sm in submans:
-            l,m,r = coups.manifest.cmp_objects(man, sm)
-            if len(m) == 0:
+        # in order of increasing number of products in common
+        for sm in sorted(subs, key=lambda m: subs[m][1]):
+            l,common,adds = subs[sm]
+            if common == 0:
                 continue
             report = '\t' + sm.filename
 
-            common = len(m)
-            adds = len(r)
             report += '\n\t\t'
             report += f'common:{common} adds:{adds}'
-            if len(r):
+            if adds:
+                r = coups.overlap.only(ctx.obj.session, man, sm)
                 report += ' = ' + ', '.join([p.name for p in r])
             print(report)
 
@@ -682,11 +1059,14 @@ def manifest(ctx, output, quals, flavor, version, name):
     '''
     Output a manifest file from DB
     '''
+    import coups.manifest
+    import coups.queries
     from coups.store import Manifest
     from coups.render import product_manifest as render_meth
     mtp = coups.manifest.make(name, version, flavor, quals)
 
-    man = ctx.obj.qfirst(Manifest, **mtp._asdict())
+    man = ctx.obj.qfirst(Manifest, options=coups.queries.loaders(Manifest, products=True),
+                         **mtp._asdict())
     if not man:
         sys.stderr.write(f'No such manifest: {mtp}\n')
 
@@ -725,6 +1105,7 @@ def dotify(ctx, output, quals, flavor, version, type, distance, name):
     '''
     Emit a GraphViz dot file for a graph centered around a product.
     '''
+    import coups.queries
     import matplotlib.pyplot as plt
     import networkx as nx
 
@@ -922,15 +1303,17 @@ def depend_graph(ctx, dfile):
               help="Platform flavor")
 @click.option("-v", "--version", default=None,
               help="Set the version")
+@click.option("-j", "--jobs", default=4,
+              help="Number of concurrent downloads")
 @click.argument("name")
 @click.pass_context
-def get_products(ctx, outdir, quals, flavor, version, name):
+def get_products(ctx, outdir, quals, flavor, version, jobs, name):
     '''
     Product product tar files for matching products from Scisoft
     '''
     from coups.store import Product
     from coups.product import parse_filename
-    from coups.scisoft import download_product
+    from coups.download import Downloader, product_transfers
 
     if name.endswith(".tar.bz2"):
         ptp = parse_filename(name)
@@ -941,11 +1324,23 @@ def get_products(ctx, outdir, quals, flavor, version, name):
             Product, name=name, version=version,
             flavor=flavor, quals=quals)
     for prod in pobjs:
-        if os.path.exists(prod.filename):
+        if os.path.exists(os.path.join(outdir, prod.filename)):
             sys.stderr.write(f"have {prod.filename}\n")
-            continue
-        fname = download_product(prod, outdir)
-        sys.stderr.write(f"save {fname}\n")
+
+    def report(res):
+        name = pathlib.Path(res.transfer.path).name
+        if res.error:
+            sys.stderr.write(f"fail {name}: {res.error}\n")
+            return
+        resumed = f", resumed at {res.resumed}" if res.resumed else ""
+        sys.stderr.write(f"save {res.transfer.path} ({res.nbytes/1e6:.1f} MB "
+                         f"in {res.seconds:.1f} s{resumed})\n")
+
+    results, summary = Downloader(jobs, report=report).run(
+        product_transfers(pobjs, outdir))
+    sys.stderr.write(f"{summary}\n")
+    if summary.failed:
+        sys.exit(1)
         
 
 def main():
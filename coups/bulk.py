@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+'''
+Bulk (set-based) loading of manifests and their products.
+
+The per-object path in coups.inserts costs several SELECTs for every
+line of every manifest.  Here, a batch of manifests is resolved with a
+few IN-queries and missing rows are added with executemany, all in
+one transaction.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import time
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import select, insert, update, delete, bindparam
+from coups.store import Flavor, Qual, Product, Manifest, ManifestBody
+from coups.store import qualkey, digest
+from coups.store import ProductManifest, ProductQual, ManifestQual
+
+# SQLite limits the number of bound parameters in one statement.
+chunk_size = 500
+
+
+class Stats(namedtuple("Stats", "manifests products links seconds")):
+    '''
+    Count of rows added by a bulk load and the time it took.
+    '''
+    @property
+    def rows(self):
+        return self.manifests + self.products + self.links
+
+    @property
+    def rate(self):
+        if self.seconds <= 0:
+            return 0.0
+        return self.rows / self.seconds
+
+    def __str__(self):
+        return (f'{self.manifests} manifests, {self.products} products, '
+                f'{self.links} links in {self.seconds:.3f} s '
+                f'({self.rate:.0f} rows/s)')
+
+
+def chunks(seq, size=None):
+    '''
+    Yield successive lists of at most size elements from seq.
+    '''
+    size = size or chunk_size
+    seq = list(seq)
+    for ind in range(0, len(seq), size):
+        yield seq[ind:ind+size]
+
+
+def batches(items, size=None):
+    '''
+    Yield successive lists of at most size elements from any iterable,
+    consuming it lazily.
+    '''
+    size = size or chunk_size
+    batch = list()
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = list()
+    if batch:
+        yield batch
+
+
+def split_quals(quals):
+    '''
+    Return list of unique, non-empty quals from a :-separated string.
+    '''
+    if not quals:
+        return []
+    ret = list()
+    for q in quals.split(":"):
+        if q and q not in ret:
+            ret.append(q)
+    return ret
+
+
+def ids(ses, column, keys):
+    '''
+    Return dict mapping values of column found in keys to row id.
+    '''
+    table = column.table
+    ret = dict()
+    for chunk in chunks(set(keys)):
+        for key, rid in ses.execute(select(column, table.c.id).where(column.in_(chunk))):
+            ret[key] = rid
+    return ret
+
+
+def assure_names(ses, Type, names):
+    '''
+    Return dict mapping name to id for Type in (Flavor, Qual),
+    inserting any names that are missing.
+    '''
+    names = set(names)
+    have = ids(ses, Type.name, names)
+    missing = [dict(name=n) for n in names if n not in have]
+    if missing:
+        ses.execute(insert(Type.__table__), missing)
+        have.update(ids(ses, Type.name, [m['name'] for m in missing]))
+    return have
+
+
+def assure_products(ses, ptps, fids, qids):
+    '''
+    Return (dict mapping file name to id, number inserted) for the
+    product.Product tuples ptps, inserting any that are missing.
+
+    The fids and qids are as from assure_names() and must cover the
+    flavors and quals of ptps.
+    '''
+    byname = dict()
+    for ptp in ptps:
+        byname.setdefault(ptp.filename, ptp)
+    pids = ids(ses, Product.filename, byname)
+    new_prods = [ptp for fname, ptp in byname.items() if fname not in pids]
+    if new_prods:
+        ses.execute(insert(Product.__table__), [
+            dict(name=ptp.name, version=ptp.version,
+                 flavor_id=fids[ptp.flavor], filename=ptp.filename,
+                 qualkey=qualkey(ptp.quals))
+            for ptp in new_prods])
+        got = ids(ses, Product.filename, [ptp.filename for ptp in new_prods])
+        rows = [dict(product_id=got[ptp.filename], qual_id=qids[q])
+                for ptp in new_prods for q in split_quals(ptp.quals)]
+        if rows:
+            ses.execute(insert(ProductQual), rows)
+        pids.update(got)
+    return pids, len(new_prods)
+
+
+def load(ses, items, refresh=False, commit=True):
+    '''
+    Bulk load manifests and their products, return a Stats.
+
+    The items is a sequence of (mtp, ptps) pairs where mtp is a
+    manifest.Manifest tuple and ptps a sequence of product.Product
+    tuples, or of (mtp, ptps, text) which also give the manifest text
+    to store in ManifestBody.
+
+    A manifest already in the DB (by file name) is skipped unless
+    refresh is true.  On refresh, a manifest with text of unchanged
+    digest is only marked as fetched, otherwise only its product links
+    which differ are changed.  Products are shared across manifests
+    by file name.
+    '''
+    start = time.perf_counter()
+    now = datetime.now()
+    ses.flush()
+
+    items = [(it[0], list(it[1]), it[2] if len(it) > 2 else None) for it in items]
+
+    have_mans = ids(ses, Manifest.filename, [mtp.filename for mtp,_,_ in items])
+    old_digests = dict()
+    if refresh:
+        for chunk in chunks(have_mans.values()):
+            old_digests.update(ses.execute(select(Manifest.id, Manifest.digest)
+                                           .where(Manifest.id.in_(chunk))).all())
+    keep = list()
+    same = list()
+    seen = set()
+    for mtp, ptps, text in items:
+        if mtp.filename in seen:
+            continue
+        seen.add(mtp.filename)
+        dig = None if text is None else digest(text)
+        mid = have_mans.get(mtp.filename)
+        if mid is not None:
+            if not refresh:
+                continue
+            if dig and old_digests.get(mid) == dig:
+                same.append(mid)
+                continue
+        keep.append((mtp, ptps, text, dig))
+
+    flavors = set()
+    quals = set()
+    for mtp, ptps, _, _ in keep:
+        flavors.add(mtp.flavor)
+        quals.update(split_quals(mtp.quals))
+        for ptp in ptps:
+            flavors.add(ptp.flavor)
+            quals.update(split_quals(ptp.quals))
+    fids = assure_names(ses, Flavor, flavors)
+    qids = assure_names(ses, Qual, quals)
+
+    # bodies
+    bodies = {dig: text for _, _, text, dig in keep if dig}
+    have_bodies = set()
+    for chunk in chunks(bodies):
+        have_bodies.update(ses.execute(select(ManifestBody.digest)
+                                       .where(ManifestBody.digest.in_(chunk))).scalars())
+    rows = [dict(digest=dig, text=text) for dig, text in bodies.items()
+            if dig not in have_bodies]
+    if rows:
+        ses.execute(insert(ManifestBody.__table__), rows)
+
+    # manifests
+    pm = ProductManifest
+    stale = [have_mans[mtp.filename] for mtp,_,_,_ in keep if mtp.filename in have_mans]
+    current = {mid: set() for mid in stale}
+    for chunk in chunks(stale):
+        for mid, pid in ses.execute(select(pm.c.manifest_id, pm.c.product_id)
+                                    .where(pm.c.manifest_id.in_(chunk))):
+            current[mid].add(pid)
+    marks = [dict(mid=have_mans[mtp.filename], digest=dig, fetched=now)
+             for mtp,_,_,dig in keep if mtp.filename in have_mans]
+    marks += [dict(mid=mid, digest=old_digests[mid], fetched=now) for mid in same]
+    if marks:
+        table = Manifest.__table__
+        ses.execute(update(table).where(table.c.id == bindparam('mid')), marks)
+
+    new_mans = [(mtp, dig) for mtp,_,_,dig in keep if mtp.filename not in have_mans]
+    if new_mans:
+        ses.execute(insert(Manifest.__table__), [
+            dict(name=mtp.name, version=mtp.version,
+                 flavor_id=fids[mtp.flavor], filename=mtp.filename,
+                 qualkey=qualkey(mtp.quals), digest=dig, fetched=now)
+            for mtp, dig in new_mans])
+        mids = ids(ses, Manifest.filename, [mtp.filename for mtp,_ in new_mans])
+        rows = [dict(manifest_id=mids[mtp.filename], qual_id=qids[q])
+                for mtp,_ in new_mans for q in split_quals(mtp.quals)]
+        if rows:
+            ses.execute(insert(ManifestQual), rows)
+        have_mans.update(mids)
+
+    # products
+    pids, nnew = assure_products(ses, [ptp for _, some, _, _ in keep for ptp in some],
+                                 fids, qids)
+
+    # links, only those which differ
+    links = list()
+    unlinks = list()
+    changed = list()
+    for mtp, some, _, _ in keep:
+        mid = have_mans[mtp.filename]
+        want = {pids[ptp.filename] for ptp in some}
+        have = current.get(mid, set())
+        links += [dict(product_id=pid, manifest_id=mid) for pid in want - have]
+        unlinks += [dict(mid=mid, pid=pid) for pid in have - want]
+        if want != have or mid not in current:
+            changed.append(mid)
+    if unlinks:
+        ses.execute(delete(pm).where(pm.c.manifest_id == bindparam('mid'))
+                    .where(pm.c.product_id == bindparam('pid')), unlinks)
+    if links:
+        ses.execute(insert(pm), links)
+
+    from coups import overlap
+    overlap.update(ses, changed)
+
+    if commit:
+        ses.commit()
+    # ORM objects loaded before the bulk insert do not know of it.
+    ses.expire_all()
+    return Stats(len(keep), nnew, len(links),
+                 time.perf_counter() - start)
+
+
+def load_stream(ses, mtp, ptps, body=None, refresh=False, commit=True):
+    '''
+    Bulk load one manifest from a stream of its products, return a
+    Stats.
+
+    The ptps may be any iterable of product.Product tuples, such as
+    the generator of manifest.stream(), and is consumed chunk_size at a
+    time so that products are added as they arrive.  Only the ids of
+    the products are held until the links are made at the end.  The
+    body is a manifest.Body which the ptps were parsed through, its
+    digest and text are taken once ptps is exhausted.
+
+    As for load(), a manifest already in the DB is skipped unless
+    refresh, in which case only the links which differ are changed.
+    '''
+    start = time.perf_counter()
+    now = datetime.now()
+    ses.flush()
+
+    mid = ids(ses, Manifest.filename, [mtp.filename]).get(mtp.filename)
+    if mid is not None and not refresh:
+        return Stats(0, 0, 0, time.perf_counter() - start)
+
+    fids = assure_names(ses, Flavor, [mtp.flavor])
+    qids = assure_names(ses, Qual, split_quals(mtp.quals))
+    want = set()
+    nnew = 0
+    for some in batches(ptps):
+        fids.update(assure_names(ses, Flavor, set([p.flavor for p in some]) - set(fids)))
+        qids.update(assure_names(ses, Qual, set([q for p in some for q in split_quals(p.quals)])
+                                 - set(qids)))
+        pids, more = assure_products(ses, some, fids, qids)
+        want.update(pids.values())
+        nnew += more
+
+    dig = text = None
+    if body is not None:
+        dig, text = body.digest, body.text
+        if text is not None and ses.get(ManifestBody, dig) is None:
+            ses.execute(insert(ManifestBody.__table__), [dict(digest=dig, text=text)])
+
+    table = Manifest.__table__
+    pm = ProductManifest
+    have = set()
+    if mid is None:
+        ses.execute(insert(table), [
+            dict(name=mtp.name, version=mtp.version,
+                 flavor_id=fids[mtp.flavor], filename=mtp.filename,
+                 qualkey=qualkey(mtp.quals), digest=dig, fetched=now)])
+        mid = ids(ses, Manifest.filename, [mtp.filename])[mtp.filename]
+        rows = [dict(manifest_id=mid, qual_id=qids[q]) for q in split_quals(mtp.quals)]
+        if rows:
+            ses.execute(insert(ManifestQual), rows)
+        changed = True
+    else:
+        ses.execute(update(table).where(table.c.id == mid)
+                    .values(digest=dig, fetched=now))
+        have = set(ses.execute(select(pm.c.product_id)
+                               .where(pm.c.manifest_id == mid)).scalars())
+        changed = want != have
+
+    links = [dict(product_id=pid, manifest_id=mid) for pid in want - have]
+    unlinks = [dict(mid=mid, pid=pid) for pid in have - want]
+    if unlinks:
+        ses.execute(delete(pm).where(pm.c.manifest_id == bindparam('mid'))
+                    .where(pm.c.product_id == bindparam('pid')), unlinks)
+    for some in chunks(links):
+        ses.execute(insert(pm), some)
+    if changed:
+        from coups import overlap
+        overlap.update(ses, [mid])
+
+    if commit:
+        ses.commit()
+    ses.expire_all()
+    return Stats(int(changed), nnew, len(links), time.perf_counter() - start)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+'''
+Concurrent crawl of scisoft bundles and packages.
+
+A walk over one bundle (or package) fetches its version index, then
+the listing of each selected version and, for bundles, the body of
+each manifest.  Fetches run in a thread pool with a bound on the
+number in flight to any one host.  Results are yielded in the same
+order a serial crawl would visit them so that a single consumer may
+write them to the DB and decide when to stop.
+
+The semantics of a serial crawl are kept:
+
+    - versions are visited in the (decreasing) order of the index
+
+    - versions not in the wanted set are skipped
+
+    - the walk stops at the first version less than "newer"
+
+    - unless refreshing, the walk stops at the first file already known
+
+    - an error in a version is reported and the walk moves on
+
+Nothing here touches the DB.  The caller supplies the set of file
+names already known.
+
+A walk may also be given the versions seen by a previous crawl (see
+coups.store.CrawlState).  It then visits only versions not yet seen
+and the newest seen version, where new files may still appear, and
+known files are skipped instead of ending the walk.  As a classic walk
+stops at the first known file, such a walk stops at the oldest seen
+version unless it is to backfill, that is to resume a first crawl
+which was interrupted.  After a walk, or part way through one, its
+index fingerprint and the versions it has covered may be journaled for
+the next crawl.  As a version is only covered once all its files have
+been consumed, a crawl interrupted after journaling resumes where it
+left off.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import hashlib
+import threading
+from collections import namedtuple
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+from requests.exceptions import RequestException
+
+import coups.scisoft
+
+# What a walk yields.  The status is one of:
+#
+#   - load :: a file to load, data holds its parsed content if fetched
+#   - have :: a file already known, the walk stops after this
+#   - old :: a version older than "newer", the walk stops after this
+#   - broken :: failed to get a version, data holds the exception
+Found = namedtuple("Found", "status name version filename data")
+
+# Errors which mark one version as broken without ending the walk.
+broken_errors = (ValueError, RequestException)
+
+
+class Crawler:
+    '''
+    A thread pool with a per-host limit on concurrent fetches.
+    '''
+
+    def __init__(self, workers=8, per_host=4, lookahead=2):
+        '''
+        Run at most workers fetches and at most per_host to any one
+        host.  A walk keeps lookahead version listings in flight
+        ahead of the one being consumed.
+        '''
+        self.per_host = per_host
+        self.lookahead = lookahead
+        self.pool = ThreadPoolExecutor(max_workers=workers,
+                                       thread_name_prefix="coups-crawl")
+        self._hosts = dict()
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def semaphore(self, host):
+        with self._lock:
+            sem = self._hosts.get(host)
+            if sem is None:
+                sem = self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return sem
+
+    def submit(self, func, *args, host=None):
+        '''
+        Submit func(*args) to the pool, return its future.
+
+        The host defaults to that of the scisoft base URL.
+        '''
+        if host is None:
+            host = urlparse(coups.scisoft.base_url).netloc
+        sem = self.semaphore(host)
+
+        def limited():
+            with sem:
+                return func(*args)
+        return self.pool.submit(limited)
+
+
+def select_versions(vers, wanted=(), newer=None, seen=None, backfill=False):
+    '''
+    Return (selected, old) from versions in index order.
+
+    The old is the first version less than newer, or None.  If seen
+    is given, of the versions in it only the first is selected and,
+    unless backfill, none past the last of them.
+    '''
+    if seen and not backfill:
+        last = [ind for ind, ver in enumerate(vers) if ver in seen]
+        if last:
+            vers = vers[:last[-1]+1]
+    selected = list()
+    newest_seen = None
+    for ver in vers:
+        if wanted and ver not in wanted:
+            continue
+        if newer and ver < newer:
+            return selected, ver
+        if seen and ver in seen:
+            if newest_seen:
+                continue
+            newest_seen = ver
+        selected.append(ver)
+    return selected, None
+
+
+def fingerprint(vers):
+    '''
+    Return a digest of a version index.
+    '''
+    return hashlib.sha1("\n".join(vers).encode()).hexdigest()
+
+
+class Walk:
+    '''
+    An iterable of Found for one bundle or package.
+
+    The version index and first listing are fetched as soon as the
+    walk is made so that many walks may be started at once.
+
+    If seen is not None the walk is incremental, see module doc.
+    '''
+
+    def __init__(self, crawler, name, versions_of, listing_of, fetch=None,
+                 wanted=(), newer=None, refresh=False, known=(), seen=None,
+                 backfill=False):
+        self.crawler = crawler
+        self.name = name
+        self.versions_of = versions_of
+        self.listing_of = listing_of
+        self.fetch = fetch
+        self.wanted = wanted
+        self.newer = newer
+        self.refresh = refresh
+        self.known = known
+        self.seen = seen
+        self.backfill = backfill
+        self.index = None       # the version index, once fetched
+        self.done = list()      # versions fully visited
+        self.head = crawler.submit(self._head)
+
+    def _listing(self, ver):
+        return list(self.listing_of(self.name, ver, False))
+
+    def _head(self):
+        vers = list(self.versions_of(self.name, full=False))
+        self.index = vers
+        selected, old = select_versions(vers, self.wanted, self.newer, self.seen,
+                                        self.backfill)
+        first = None
+        if selected:
+            try:
+                first = self._listing(selected[0])
+            except broken_errors as err:
+                first = err
+        return selected, old, first
+
+    def __iter__(self):
+        selected, old, first = self.head.result()
+        submit = self.crawler.submit
+        listings = dict()
+        bodies = list()
+        try:
+            for ind, ver in enumerate(selected):
+                for nxt in selected[ind+1 : ind+1+self.crawler.lookahead]:
+                    if nxt not in listings:
+                        listings[nxt] = submit(self._listing, nxt)
+                try:
+                    if ind == 0:
+                        if isinstance(first, Exception):
+                            raise first
+                        fnames = first
+                    else:
+                        fnames = listings.pop(ver).result()
+                except broken_errors as err:
+                    yield Found("broken", self.name, ver, None, err)
+                    continue
+
+                have = None
+                cut = False     # rest of the version not visited
+                bodies = list()
+                for fname in fnames:
+                    if not self.refresh and fname in self.known:
+                        have = have or fname
+                        if self.seen is None:
+                            cut = fname != fnames[-1]
+                            break
+                        continue
+                    fut = None
+                    if self.fetch:
+                        fut = submit(self.fetch, fname)
+                    bodies.append((fname, fut))
+
+                for fname, fut in bodies:
+                    try:
+                        data = fut.result() if fut else None
+                    except broken_errors as err:
+                        yield Found("broken", self.name, ver, fname, err)
+                        break
+                    yield Found("load", self.name, ver, fname, data)
+                else:
+                    if not cut:
+                        self.done.append(ver)
+                    if have:
+                        yield Found("have", self.name, ver, have, None)
+                        if self.seen is None:
+                            return
+            if old:
+                yield Found("old", self.name, old, None, None)
+        finally:
+            for fut in listings.values():
+                fut.cancel()
+            for _, fut in bodies:
+                if fut:
+                    fut.cancel()
+
+    @property
+    def restricted(self):
+        '''
+        True if the walk was narrowed to wanted or newer versions.
+        '''
+        return bool(self.wanted or self.newer)
+
+    @property
+    def fingerprint(self):
+        '''
+        The fingerprint() of the version index or None if not fetched.
+        '''
+        if self.index is None:
+            return None
+        return fingerprint(self.index)
+
+    def covered(self):
+        '''
+        Return set of versions whose listings the walk fully visited.
+        '''
+        return set(self.done)
+
+
+def fetch_manifest(filename):
+    '''
+    Return (manifest tuple, product tuples, text) for a manifest file
+    name.
+    '''
+    import coups.manifest
+    mtp = coups.manifest.parse_filename(filename)
+    text = coups.manifest.load_text(mtp)
+    return mtp, coups.manifest.parse_body(text), text
+
+
+def open_manifest(filename):
+    '''
+    Return (manifest tuple, product tuple generator, manifest.Body)
+    for a manifest file name.
+
+    Only the first chunk of the body is read here, so that the request
+    is made and may fail in the crawl, and the rest is read as the
+    products are consumed.
+    '''
+    import itertools
+    import coups.manifest
+    mtp = coups.manifest.parse_filename(filename)
+    chunks = coups.manifest.stream_text(mtp)
+    first = next(chunks, '')
+    body = coups.manifest.Body(itertools.chain([first], chunks))
+    return mtp, coups.manifest.parse_lines(coups.manifest.lines(body)), body
+
+
+def bundle(crawler, name, wanted=(), newer=None, refresh=False, known=(),
+           seen=None, backfill=False, stream=False):
+    '''
+    Return a Walk over a bundle yielding manifest tuple, product
+    tuples and text as data for each manifest to load.
+
+    With stream, the data is as from open_manifest() and the products
+    must be consumed in the order the walk yields them.
+    '''
+    ss = coups.scisoft
+    fetch = open_manifest if stream else fetch_manifest
+    return Walk(crawler, name, ss.bundle_versions, ss.bundle_manifests,
+                fetch, wanted, newer, refresh, known, seen, backfill)
+
+
+def package(crawler, name, wanted=(), newer=None, refresh=False, known=(),
+            seen=None, backfill=False):
+    '''
+    Return a Walk over a package yielding product file names.
+    '''
+    ss = coups.scisoft
+    return Walk(crawler, name, ss.package_versions, ss.package_products,
+                None, wanted, newer, refresh, known, seen, backfill)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+'''
+Download files concurrently and resumably.
+
+A transfer writes to "<file>.part" and, if interrupted, a later
+attempt continues from where it stopped with an HTTP Range request.
+Only a complete and (optionally) verified file is renamed into place
+so a file of the final name is always whole.
+
+Reads adapt their size to the rate of the connection, from min_chunk
+to max_chunk bytes, aiming for a read every target_seconds.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import os
+import time
+import hashlib
+from pathlib import Path
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+min_chunk = 64*1024
+max_chunk = 8*1024*1024
+target_seconds = 0.25
+
+# One file to get.  The size and checksum ("algo:hexdigest") are
+# optional and checked if given.
+Transfer = namedtuple("Transfer", "url path size checksum", defaults=(None, None))
+
+# The outcome of a Transfer.  The nbytes counts only those received
+# by this attempt, resumed is the number of bytes found in a .part.
+Result = namedtuple("Result", "transfer nbytes seconds resumed error")
+
+
+class Summary(namedtuple("Summary", "files failed nbytes seconds")):
+    '''
+    Totals over a set of transfers.
+    '''
+    @property
+    def rate(self):
+        if self.seconds <= 0:
+            return 0.0
+        return self.nbytes / self.seconds
+
+    def __str__(self):
+        mb = self.nbytes / 1e6
+        return (f'{self.files} files, {self.failed} failed, {mb:.1f} MB '
+                f'in {self.seconds:.1f} s ({self.rate/1e6:.2f} MB/s)')
+
+
+def checker(checksum):
+    '''
+    Return (hash object, expected hex digest) from "algo:hexdigest".
+    '''
+    if not checksum:
+        return None, None
+    algo, want = checksum.split(":", 1)
+    return hashlib.new(algo), want.lower()
+
+
+def next_chunk(size, seconds):
+    '''
+    Return the size of the next read given how long the last took.
+    '''
+    if seconds < target_seconds / 2:
+        return min(size * 2, max_chunk)
+    if seconds > target_seconds * 2:
+        return max(size // 2, min_chunk)
+    return size
+
+
+def fetch(transfer, progress=None):
+    '''
+    Perform one Transfer, return a Result.
+
+    The progress callable, if given, is called with the transfer and
+    number of bytes after each read.  HTTP errors are raised, a size
+    or checksum mismatch raises ValueError.
+    '''
+    from coups.scisoft import get
+
+    path = Path(transfer.path)
+    part = path.with_name(path.name + ".part")
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    have = part.stat().st_size if part.exists() else 0
+    if transfer.size is not None and have > transfer.size:
+        part.unlink()
+        have = 0
+    headers = dict()
+    if have:
+        headers["Range"] = f'bytes={have}-'
+
+    hasher, want = checker(transfer.checksum)
+    t0 = time.perf_counter()
+    nbytes = 0
+    with get(transfer.url, stream=True, headers=headers) as resp:
+        if resp.status_code == 416 and have:
+            # nothing past what we have, the .part may be whole
+            total = have
+        else:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                have = 0        # server ignored the range, start over
+            total = None
+            length = resp.headers.get("Content-Length")
+            if length is not None and not resp.headers.get("Content-Encoding"):
+                total = have + int(length)
+            with part.open("ab" if have else "wb") as fp:
+                size = min_chunk
+                while True:
+                    t1 = time.perf_counter()
+                    data = resp.raw.read(size, decode_content=True)
+                    if not data:
+                        break
+                    fp.write(data)
+                    nbytes += len(data)
+                    if progress:
+                        progress(transfer, len(data))
+                    size = next_chunk(size, time.perf_counter() - t1)
+
+    got = part.stat().st_size
+    for expect in (total, transfer.size):
+        if expect is not None and got != expect:
+            raise ValueError(f'size mismatch for {path.name}: {got} != {expect}')
+    if hasher:
+        with part.open("rb") as fp:
+            for data in iter(lambda: fp.read(max_chunk), b""):
+                hasher.update(data)
+        if hasher.hexdigest() != want:
+            part.unlink()
+            raise ValueError(f'checksum mismatch for {path.name}')
+
+    os.replace(part, path)
+    return Result(transfer, nbytes, time.perf_counter() - t0, have, None)
+
+
+class Downloader:
+    '''
+    Run transfers concurrently.
+    '''
+
+    def __init__(self, jobs=4, progress=None, report=None):
+        '''
+        Run up to jobs transfers at once.  The progress callable is
+        as for fetch().  The report callable is called with each
+        Result as it completes.
+        '''
+        self.jobs = jobs
+        self.progress = progress
+        self.report = report
+
+    def _one(self, transfer):
+        try:
+            return fetch(transfer, self.progress)
+        except Exception as err:
+            return Result(transfer, 0, 0.0, 0, err)
+
+    def run(self, transfers):
+        '''
+        Perform transfers, return (list of Result, Summary).
+
+        Results are in the order the transfers were given.
+        '''
+        transfers = list(transfers)
+        t0 = time.perf_counter()
+        results = dict()
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            futs = {pool.submit(self._one, t): ind for ind, t in enumerate(transfers)}
+            for fut in as_completed(futs):
+                res = fut.result()
+                results[futs[fut]] = res
+                if self.report:
+                    self.report(res)
+        results = [results[ind] for ind in range(len(transfers))]
+        summary = Summary(len(results), len([r for r in results if r.error]),
+                          sum([r.nbytes for r in results]),
+                          time.perf_counter() - t0)
+        return results, summary
+
+
+def product_transfers(prods, todir=".", skip_existing=True):
+    '''
+    Return list of Transfer for product tar files into todir.
+    '''
+    from coups.scisoft import product_url
+    todir = Path(todir)
+    ret = list()
+    for prod in prods:
+        path = todir / prod.filename
+        if skip_existing and path.exists():
+            continue
+        url = os.path.join(product_url(prod.name, prod.version), prod.filename)
+        ret.append(Transfer(url, path))
+    return ret
@@ -7,25 +7,25 @@ Ensconce various write (insert) queries
 # This file is part of coups which is free software distributed under
 # the terms of the GNU Affero General Public License.
 
+from sqlalchemy.exc import IntegrityError
 from coups import queries
 from coups.store import *
 
-def query(ses, Type, flavor=None, quals=None, **kwds):
+def query(ses, Type, flavor=None, quals=None, options=(), **kwds):
     '''
     Return a simple query on Type in (Manifest, Product)
+
+    Any loader options (see coups.queries.loaders()) are applied.
     '''
     q = ses.query(Type).filter_by(**kwds)
+    if options:
+        q = q.options(*options)
     if flavor:
         #print(f"query filter on flavor {flavor}")
         q = q.filter(Type.flavor.has(Flavor.name==flavor))
-    if quals:
+    if quals is not None:
         #print(f"query filter on quals {quals}")
-        if isinstance(quals, str):
-            quals = quals.split(":")
-        for qual in quals:
-            qt = aliased(Qual)
-            q = q.join(Type.quals.of_type(qt))
-            q = q.filter(qt.name == qual)
+        q = q.filter(Type.qualkey == qualkey(quals))
     return q
 
 def qfirst(ses, Type, **kwds):
@@ -55,15 +55,18 @@ def lookup(ses, Type, flavor=None, quals=None, **kwds):
     obj = qfirst(ses, Type, flavor=flavor, quals=quals, **kwds)
     if obj:
         return obj
-    obj = Type(**kwds)
-    if flavor:
-        obj.flavor = lookup(ses, Flavor, name=flavor)
-    if quals:
-        if isinstance(quals, str):
-            quals = quals.split(":")
-        for qual in quals:
-            obj.quals.append(lookup(ses, Qual, name=qual))
-    ses.add(obj)
+    with ses.no_autoflush:
+        obj = Type(**kwds)
+        if flavor:
+            obj.flavor = lookup(ses, Flavor, name=flavor)
+        if quals:
+            if isinstance(quals, str):
+                quals = quals.split(":")
+            for qual in quals:
+                obj.quals.append(lookup(ses, Qual, name=qual))
+        if Type in (Product, Manifest):
+            obj.qualkey = qualkey(quals)
+        ses.add(obj)
     return obj
 
 
@@ -116,7 +119,7 @@ def manifest(ses, mtp, return_existing=False):
 
     flav = flavor(ses, mtp.flavor)
     m1 = Manifest(name=mtp.name, version=mtp.version,
-                  flavor=flav, quals=quals,
+                  flavor=flav, quals=quals, qualkey=qualkey(quals),
                   filename=mtp.filename)
     ses.add(m1)
     if return_existing:
@@ -135,13 +138,15 @@ def product(ses, ptp, return_existing=False):
             return pobj, True
         return pobj
 
-    pobj = Product(name=ptp.name, version=ptp.version, filename=ptp.filename)
-    pobj.flavor = flavor(ses, ptp.flavor)
-    if ptp.quals:
-        for q in ptp.quals.split(":"):
-            q1 = qual(ses, q)
-            pobj.quals.append(q1)
-    ses.add(pobj)
+    pobj = Product(name=ptp.name, version=ptp.version, filename=ptp.filename,
+                   qualkey=qualkey(ptp.quals))
+    with ses.no_autoflush:
+        pobj.flavor = flavor(ses, ptp.flavor)
+        if ptp.quals:
+            for q in ptp.quals.split(":"):
+                q1 = qual(ses, q)
+                pobj.quals.append(q1)
+        ses.add(pobj)
     if return_existing:
         return pobj, False
     return pobj
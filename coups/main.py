@@ -11,7 +11,7 @@ fixme: this has grown organically and needs refactoring.
 
 import os
 import sys
-from . import queries, graph
+from . import queries
 from coups.store import *
 from coups import inserts
 from sqlalchemy.exc import IntegrityError
@@ -19,18 +19,46 @@ import tarfile
 
 class Coups:
 
-    def __init__(self, store, url, force_init=False):
+    def __init__(self, store, url, force_init=False, pragmas=None):
         self.store_file = store
         self.scisoft_url = url
         self.force_init = force_init
+        self.pragmas = pragmas
 
     @property
     def session(self):
         ses = getattr(self, '_session', None)
         if ses: return ses
-        self._session = session(self.store_file, self.force_init)
+        self._session = session(self.store_file, self.force_init, self.pragmas)
+        self.load_platforms()
         return self._session    
 
+    def load_platforms(self):
+        '''
+        Add the extra platforms held in the DB to the registry.
+        '''
+        from coups.platform import registry
+        for row in self.session.query(ExtraPlatform):
+            try:
+                registry.add(row.platform)
+            except ValueError as err:
+                sys.stderr.write(f'warning: extra platform: {err}\n')
+
+    def add_platform(self, plat):
+        '''
+        Add a platform.Platform to the registry and the DB.
+        '''
+        from coups.platform import registry
+        plat = registry.add(plat)
+        row = self.session.query(ExtraPlatform).filter_by(flavor=plat.flavor).first()
+        if not row:
+            row = ExtraPlatform(flavor=plat.flavor)
+            self.session.add(row)
+        row.cpu = plat.cpu
+        row.oses = ' '.join(plat.oses)
+        self.session.commit()
+        return plat
+
 
     def query(self, Type, flavor=None, quals=None, **kwds):
         '''
@@ -175,6 +203,39 @@ class Coups:
         # if return_existing:
         #     return pobj, False
         # return pobj
+
+    def manifest_body(self, text):
+        '''
+        Store manifest text unless already stored, return its digest.
+        '''
+        dig = digest(text)
+        if self.session.get(ManifestBody, dig) is None:
+            self.session.add(ManifestBody(digest=dig, text=text))
+        return dig
+
+    def load_manifests(self, items, refresh=False):
+        '''
+        Bulk load manifests and products, return a coups.bulk.Stats.
+
+        The items is a sequence of (mtp, ptps) pairs of a
+        manifest.Manifest tuple and its product.Product tuples, or
+        (mtp, ptps, text) with the manifest text.
+        '''
+        from coups import bulk
+        return bulk.load(self.session, items, refresh)
+            
+    def stream_manifest(self, mtp, refresh=False, ptps=None, body=None):
+        '''
+        Bulk load one manifest as it is read, return a coups.bulk.Stats.
+
+        The ptps and body are as from coups.manifest.stream() which is
+        called for them if ptps is None.
+        '''
+        import coups.manifest
+        from coups import bulk
+        if ptps is None:
+            body, ptps = coups.manifest.stream(mtp)
+        return bulk.load_stream(self.session, mtp, ptps, body, refresh)
             
     def names(self, what, field="name"):
         '''
@@ -189,6 +250,48 @@ class Coups:
         ret.sort()
         return ret
 
+    def filenames(self, Type):
+        '''
+        Return set of file names of all objects of Type.
+        '''
+        from sqlalchemy import select
+        return set(self.session.execute(select(Type.filename)).scalars())
+
+    def crawl_state(self, kind, name):
+        '''
+        Return the CrawlState of a "bundle" or "package" or None.
+        '''
+        return self.session.query(CrawlState).filter_by(kind=kind, name=name).first()
+
+    def journal(self, kind, walk, complete=True):
+        '''
+        Record what a crawl.Walk has seen, return the CrawlState.
+
+        Nothing is recorded if the walk did not get its version index
+        or was narrowed to wanted or newer versions, as its versions
+        do not bound where a later crawl may stop.  The versions the
+        walk fully visited are added to those seen.  Unless complete,
+        the state is marked pending so the next crawl resumes.  A
+        complete walk stamps the index fingerprint and the time it was
+        checked.
+        '''
+        from datetime import datetime
+        state = self.crawl_state(kind, walk.name)
+        if walk.index is None or walk.restricted:
+            return state
+        if state is None:
+            state = CrawlState(kind=kind, name=walk.name)
+        seen = state.seen | walk.covered()
+        state.versions = ",".join([v for v in walk.index if v in seen])
+        if not complete:
+            state.pending = datetime.now()
+        else:
+            state.pending = None
+            state.fingerprint = walk.fingerprint
+            state.checked = datetime.now()
+        self.commit(state)
+        return state
+
     def has_manifest(self, mf):
         '''
         Return true (the db object) if this manifest is in the db, else None.
@@ -202,10 +305,32 @@ class Coups:
     def remove_manifest(self, man):
         '''
         Remove the manifest object from the DB.
+
+        Its stored text is removed too unless another manifest shares it.
         '''
+        from sqlalchemy import delete
+        from coups import overlap
+        overlap.remove(self.session, [man])
+        dig = man.digest
         self.session.delete(man)
+        if dig is not None:
+            self.session.flush()
+            shared = self.session.execute(
+                select(Manifest.id).where(Manifest.digest == dig).limit(1)).first()
+            if shared is None:
+                self.session.execute(delete(ManifestBody).where(ManifestBody.digest == dig))
         self.session.commit()
 
+    def update_overlaps(self, *mans, commit=True):
+        '''
+        Recalculate materialized overlaps after manifests change.
+        '''
+        from coups import overlap
+        self.session.flush()
+        overlap.update(self.session, mans)
+        if commit:
+            self.session.commit()
+
     def load_dependencies(self, child, parents, commit=True):
         '''
         Load product dependencies to DB from objects.
@@ -288,6 +413,7 @@ class Coups:
         for p in ps:
             edges.update(self.edges_from_p(p, distance))
 
+        from coups import graph
         return graph.from_edges(edges)
 
     def graph_manifest(self, name, version=None, flavor=None, quals=None, distance=2):
@@ -302,6 +428,7 @@ class Coups:
         for m in ms:
             edges.update(self.edges_from_m(m, distance))
 
+        from coups import graph
         return graph.from_edges(edges)
 
     def product_dependencies(self, tdat):
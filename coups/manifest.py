@@ -11,11 +11,9 @@ We *always* encode a "version" not a "vunder" but we may render to a
 # the terms of the GNU Affero General Public License.
 
 import os
-import requests
 from collections import namedtuple
 from .util import versionify, vunderify
 from .product import Product
-from .scisoft import get_manifest
 
 def Manifest(name, version, flavor, quals, filename):
     '''
@@ -100,35 +98,103 @@ def make(name, version, flavor, quals):
     filename = f'{name}-{version}-{flavor}-{dquals}_MANIFEST.txt'
     return Manifest(name, version, flavor, quals, filename)
 
+def parse_line(line):
+    '''
+    Return a Product tuple parsed from one manifest line or None if
+    the line is empty or a comment.
+    '''
+    parts = line.split()
+    if not parts:
+        # empty line
+        return None
+    if parts[0].startswith("#"):
+        # comment
+        return None
+
+    flavor=""
+    quals=""
+    try:
+        name = parts[0]
+        version = versionify(parts[1])
+        fname = parts[2]
+        flavor = parts[4]
+        quals = parts[6]
+    except IndexError as err:
+        # There is all kinds of garbage in this universe.
+        pass                
+
+    return Product(name, version, flavor, quals, fname)
+
+
+def parse_lines(lines):
+    '''
+    Generate Product tuples parsed from an iterable of manifest lines.
+    '''
+    for line in lines:
+        prod = parse_line(line)
+        if prod is not None:
+            yield prod
+
+
 def parse_body(text):
     '''
     Return list of Product tuples parsed from manifest text.
     '''
-    ret = list()
-    for line in text.split("\n"):
-        parts = line.split()
-        if not parts:
-            # empty line
-            continue
-        if parts[0].strip().startswith("#"):
-            # comment
+    return list(parse_lines(text.split("\n")))
+
+
+def lines(chunks):
+    '''
+    Generate lines, without line ends, from an iterable of text chunks.
+    '''
+    rest = ''
+    for chunk in chunks:
+        rest += chunk
+        if "\n" not in chunk:
             continue
+        *some, rest = rest.split("\n")
+        yield from some
+    if rest:
+        yield rest
+
 
-        flavor=""
-        quals=""
-        try:
-            name = parts[0]
-            version = versionify(parts[1])
-            fname = parts[2]
-            flavor = parts[4]
-            quals = parts[6]
-        except IndexError as err:
-            # There is all kinds of garbage in this universe.
-            pass                
+class Body:
+    '''
+    Pass through chunks of manifest text while taking their digest.
+
+    The text is kept, for storing as a store.ManifestBody, until it
+    grows past keep characters.  After iteration, digest is that of
+    store.digest() of the whole text and text is None if not kept.
+    '''
 
-        prod = Product(name, version, flavor, quals, fname)
-        ret.append(prod)
-    return ret
+    def __init__(self, chunks, keep=16*1024*1024):
+        import hashlib
+        self.chunks = chunks
+        self.keep = keep
+        self.hasher = hashlib.sha256()
+        self.parts = list()
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.hasher.update(chunk.encode())
+            self.size += len(chunk)
+            if self.parts is not None:
+                if self.size > self.keep:
+                    self.parts = None
+                else:
+                    self.parts.append(chunk)
+            yield chunk
+
+    @property
+    def digest(self):
+        return self.hasher.hexdigest()
+
+    @property
+    def text(self):
+        if self.parts is None:
+            return None
+        return ''.join(self.parts)
 
 
 # base_url = "https://scisoft.fnal.gov/scisoft"
@@ -158,15 +224,41 @@ def parse_body(text):
 #     return loads(mf.filename)    # assume a manifest tuple or object
 
 
+def stream_text(mtp):
+    '''
+    Generate chunks of the text of a manifest from a local file or
+    scisoft.
+    '''
+    if os.path.exists(mtp.filename):
+        with open(mtp.filename) as fp:
+            yield from iter(lambda: fp.read(64*1024), '')
+        return
+    from .scisoft import stream_manifest
+    yield from stream_manifest(mtp)
+
+
+def load_text(mtp):
+    '''
+    Return the text of a manifest from a local file or scisoft.
+    '''
+    return ''.join(stream_text(mtp))
+
+
+def stream(mtp):
+    '''
+    Return (Body, generator of product.Product tuples) for a manifest.
+
+    Nothing is read until the generator is iterated.
+    '''
+    body = Body(stream_text(mtp))
+    return body, parse_lines(lines(body))
+
+
 def load(mtp):
     '''
     Load manifest, return list of product.Product tuples
     '''
-    if os.path.exists(mtp.filename):
-        text = open(mtp.filename).read()
-    else:
-        text = get_manifest(mtp)
-    return parse_body(text)
+    return list(stream(mtp)[1])
 
 
 def cmp(man1, man2):
@@ -18,6 +18,7 @@ from networkx.algorithms.dag import topological_sort
 import coups.manifest
 import coups.scisoft
 import coups.inserts
+import coups.overlap
 import coups.render
 import coups.ups
 from coups.util import versionify
@@ -106,6 +107,8 @@ class Manipack:
             prod = self.depgraph.nodes[node]["obj"]
             pobj = coups.inserts.product(self.session, prod)
             mobj.products.append(pobj)
+        self.session.flush()
+        coups.overlap.update(self.session, [mobj])
         self.session.commit()
 
     def render(self, renderer=coups.render.product_manifest):
@@ -134,7 +137,7 @@ class Manipack:
         try:
             print(f'Downloading {prod.filename}')
             return coups.scisoft.download_product(prod, self.outdir)
-        except coups.scisoft.HTTPError:
+        except coups.scisoft.RequestException:
             pass
 
         raise ValueError(f'failed to get {prod.filename}')
@@ -251,12 +254,28 @@ class Manipack:
             self._process_one(dep)
             self.add_edge(prod, dep)
 
-    def commit(self):
+    def prefetch(self, prods, jobs=4):
+        '''
+        Download tar files of prods missing from outdir concurrently.
+
+        Failures are left for _assure_tarfile() to report.
+        '''
+        from coups.download import Downloader, product_transfers
+        transfers = product_transfers(prods, self.outdir)
+        if not transfers:
+            return
+        results, summary = Downloader(jobs).run(transfers)
+        print(f'Downloaded {summary}')
+
+    def commit(self, jobs=4):
         '''
         Process seeds, write manifest file and produce tar files.
 
         If session given, record manifest and products to coups DB.
+        Tar files of the seeds are first downloaded with jobs
+        concurrent transfers.
         '''
+        self.prefetch(self.seeds, jobs)
         for seed in self.seeds:
             print(f'processing {seed}')
             self._process_one(seed)
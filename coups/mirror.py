@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+'''
+Local mirrors of scisoft.
+
+A mirror is a directory tree laid out like scisoft:
+
+    <base>/bundles/<bundle>/<vunder>/manifest/<manifest file>
+    <base>/packages/<package>/<vunder>/<product file>
+
+It may be used directly by giving its path or a file:// URL as the
+scisoft base (coups --url) or be served by any web server which gives
+the "index.html" of a directory.  Each directory is rendered as an
+index page with entries in reverse sorted order so that versions come
+newest first as they do on scisoft.  For file:// the FileAdapter does
+so on the fly and write_indexes() saves the pages for a web server.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import os
+import html
+from pathlib import Path
+from urllib.parse import urlparse, quote, unquote
+from urllib.request import url2pathname
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+# Name of the index page written into each directory of a mirror.
+index_name = "index.html"
+
+
+def render_index(path):
+    '''
+    Return HTML bytes of an index page for directory path.
+    '''
+    names = list()
+    for one in sorted(os.listdir(path), reverse=True):
+        if one in (index_name, index_name + ".part"):
+            continue
+        if (Path(path) / one).is_dir():
+            one += "/"
+        names.append(one)
+    rows = [f'<tr><td><a href="{quote(n, safe="/+")}">{html.escape(n)}</a></td></tr>'
+            for n in names]
+    page = ['<html><body><div class="inner content-inner"><table>',
+            '<tr><th>Name</th></tr>'] + rows + ['</table></div></body></html>', '']
+    return "\n".join(page).encode()
+
+
+class _Raw:
+    '''
+    A file-like body for a response, as requests expects of .raw.
+    '''
+    def __init__(self, fp, remaining=None):
+        self.fp = fp
+        self.remaining = remaining
+
+    def read(self, amt=None, decode_content=None):
+        if self.remaining is not None:
+            if amt is None or amt > self.remaining:
+                amt = self.remaining
+            data = self.fp.read(amt)
+            self.remaining -= len(data)
+            return data
+        return self.fp.read(amt) if amt else self.fp.read()
+
+    def close(self):
+        self.fp.close()
+
+    def release_conn(self):
+        pass
+
+
+class FileAdapter(BaseAdapter):
+    '''
+    Serve file:// URLs to a requests session.
+
+    Directories are rendered by render_index().  Files support a
+    single "bytes=N-" Range.
+    '''
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        import io
+        resp = requests.Response()
+        resp.request = request
+        resp.url = request.url
+        resp.encoding = "utf-8"
+        resp.headers = CaseInsensitiveDict()
+        path = Path(url2pathname(unquote(urlparse(request.url).path)))
+
+        if request.method not in ("GET", "HEAD"):
+            resp.status_code, resp.reason = 405, "Method Not Allowed"
+            resp.raw = _Raw(io.BytesIO(b""))
+            return resp
+        if path.is_dir():
+            body = render_index(path)
+            resp.status_code, resp.reason = 200, "OK"
+            resp.headers["Content-Length"] = str(len(body))
+            resp.raw = _Raw(io.BytesIO(body))
+            return resp
+        if not path.is_file():
+            resp.status_code, resp.reason = 404, "Not Found"
+            resp.raw = _Raw(io.BytesIO(b""))
+            return resp
+
+        size = path.stat().st_size
+        start = 0
+        rng = request.headers.get("Range", "")
+        if rng.startswith("bytes=") and rng.endswith("-"):
+            start = int(rng[6:-1])
+            if start >= size:
+                resp.status_code, resp.reason = 416, "Range Not Satisfiable"
+                resp.headers["Content-Range"] = f'bytes */{size}'
+                resp.raw = _Raw(io.BytesIO(b""))
+                return resp
+            resp.status_code, resp.reason = 206, "Partial Content"
+            resp.headers["Content-Range"] = f'bytes {start}-{size-1}/{size}'
+        else:
+            resp.status_code, resp.reason = 200, "OK"
+        resp.headers["Content-Length"] = str(size - start)
+        fp = path.open("rb")
+        fp.seek(start)
+        resp.raw = _Raw(fp, size - start)
+        return resp
+
+    def close(self):
+        pass
+
+
+def manifest_path(topdir, mtp):
+    '''
+    Return path of the manifest file for mtp in a mirror.
+    '''
+    from coups.util import vunderify
+    return Path(topdir) / "bundles" / mtp.name / vunderify(mtp.version) \
+        / "manifest" / mtp.filename
+
+
+def product_path(topdir, ptp):
+    '''
+    Return path of the product tar file for ptp in a mirror.
+    '''
+    from coups.util import vunderify
+    return Path(topdir) / "packages" / ptp.name / vunderify(ptp.version) / ptp.filename
+
+
+def write_manifest(topdir, mtp, text):
+    '''
+    Write manifest text into a mirror, return its path.
+    '''
+    path = manifest_path(topdir, mtp)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".part")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+    return path
+
+
+def write_indexes(topdir):
+    '''
+    Write the render_index() page of each directory of a mirror into
+    it, return number of pages which changed.
+    '''
+    count = 0
+    for path, dirs, files in os.walk(topdir):
+        page = Path(path) / index_name
+        body = render_index(path)
+        if page.exists() and page.read_bytes() == body:
+            continue
+        tmp = page.with_name(index_name + ".part")
+        tmp.write_bytes(body)
+        os.replace(tmp, page)
+        count += 1
+    return count
+
+
+def fetch_manifest_text(filename):
+    '''
+    Return (manifest tuple, text) for a manifest file name on scisoft.
+    '''
+    import coups.manifest
+    import coups.scisoft
+    mtp = coups.manifest.parse_filename(filename)
+    return mtp, coups.scisoft.get_manifest(mtp)
+
+
+def bundle(crawler, topdir, name, wanted=(), newer=None, refresh=False):
+    '''
+    Return a crawl.Walk which copies manifests of a bundle into a
+    mirror.  It yields (manifest tuple, text) as data.
+
+    Unless refresh, manifests already in the mirror end the walk.
+    '''
+    import coups.scisoft
+    from coups.crawl import Walk
+    known = set()
+    top = Path(topdir) / "bundles" / name
+    if top.exists():
+        known = set([p.name for p in top.glob("*/manifest/*")
+                     if not p.name.endswith(".part")])
+    return Walk(crawler, name, coups.scisoft.bundle_versions,
+                coups.scisoft.bundle_manifests, fetch_manifest_text,
+                wanted, newer, refresh, known)
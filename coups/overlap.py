@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+'''
+Maintain and query the materialized manifest overlap table.
+
+Each row of store.ManifestOverlap holds the trio of set cardinalities
+
+    (a-b, a ∩ b, b-a)
+
+of the product sets of a pair of manifests.  Rows are updated as
+manifests are loaded, refreshed or removed so that subset discovery
+is an indexed lookup instead of an aggregation over the whole DB.
+
+A pair is stored once, with manifest_a < manifest_b, and only if one
+of the two supplies no more than max_extras products the other lacks.
+Manifests which merely share a few widely used products are thus not
+paired.  Questions beyond that are answered from the product links.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+from sqlalchemy import select, insert, delete, func, or_, union_all, bindparam
+from coups.store import Manifest, Product, ProductManifest, ManifestOverlap
+from coups.bulk import chunks
+
+Overlap = ManifestOverlap.__table__
+
+# The most extra products one manifest of a stored pair may supply
+# to the other.  Subset queries up to this are served by the table.
+max_extras = 10
+
+# Number of products each other manifest shares with manifest :mid.
+_mine = ProductManifest.alias("mine")
+_other = ProductManifest.alias("other")
+_shared = select(_other.c.manifest_id, func.count()) \
+    .select_from(_mine.join(_other, _other.c.product_id == _mine.c.product_id)) \
+    .where(_mine.c.manifest_id == bindparam("mid")) \
+    .group_by(_other.c.manifest_id)
+
+
+def _mid(man):
+    if isinstance(man, int):
+        return man
+    return man.id
+
+
+def sizes(ses, mids):
+    '''
+    Return dict mapping manifest id to number of its products.
+    '''
+    pm = ProductManifest
+    ret = dict()
+    for chunk in chunks(mids):
+        got = ses.execute(select(pm.c.manifest_id, func.count())
+                          .where(pm.c.manifest_id.in_(chunk))
+                          .group_by(pm.c.manifest_id))
+        ret.update(got.all())
+    return ret
+
+
+def remove(ses, mans):
+    '''
+    Remove overlap rows involving any of the manifests.
+    '''
+    mids = [_mid(m) for m in mans]
+    for chunk in chunks(mids):
+        ses.execute(delete(Overlap).where(or_(Overlap.c.manifest_a.in_(chunk),
+                                              Overlap.c.manifest_b.in_(chunk))))
+
+
+def trios(ses, man, size_of=None):
+    '''
+    Return dict mapping id of each manifest sharing products with man,
+    including man itself, to the trio (man-other, man ∩ other,
+    other-man) counted from the product links.
+
+    A dict mapping manifest id to size may be given as a cache to use
+    and fill as with sizes().
+    '''
+    mid = _mid(man)
+    both = dict(ses.execute(_shared, dict(mid=mid)).all())
+    if size_of is None:
+        size_of = dict()
+    size_of.update(sizes(ses, [oid for oid in both if oid not in size_of]))
+    size = both.get(mid, 0)
+    return {oid: (size-nboth, nboth, size_of[oid]-nboth)
+            for oid, nboth in both.items()}
+
+
+def update(ses, mans, size_of=None):
+    '''
+    Recalculate overlap rows of the manifests.
+
+    This must be called after the product set of a manifest changes.
+    The caller is responsible for committing.  The size_of cache is
+    as for trios().
+    '''
+    mids = [_mid(m) for m in mans]
+    remove(ses, mids)
+    if size_of is None:
+        size_of = dict()
+    done = set()
+    for mid in mids:
+        if mid in done:
+            continue
+        done.add(mid)
+        rows = list()
+        for oid, (only_a, both, only_b) in trios(ses, mid, size_of).items():
+            if oid in done and oid != mid:
+                # pair already written when oid was processed
+                continue
+            if min(only_a, only_b) > max_extras:
+                continue
+            if mid <= oid:
+                rows.append(dict(manifest_a=mid, manifest_b=oid, only_a=only_a,
+                                 both=both, only_b=only_b))
+            else:
+                rows.append(dict(manifest_a=oid, manifest_b=mid, only_a=only_b,
+                                 both=both, only_b=only_a))
+        if not rows:
+            # no products, still mark as materialized
+            rows.append(dict(manifest_a=mid, manifest_b=mid, only_a=0, both=0, only_b=0))
+        ses.execute(insert(Overlap), rows)
+
+
+def rebuild(ses):
+    '''
+    Recalculate the entire overlap table.  Return number of manifests.
+    '''
+    ses.execute(delete(Overlap))
+    mids = [r[0] for r in ses.execute(select(Manifest.id))]
+    pm = ProductManifest
+    size_of = dict(ses.execute(select(pm.c.manifest_id, func.count())
+                               .group_by(pm.c.manifest_id)).all())
+    update(ses, mids, size_of)
+    ses.commit()
+    return len(mids)
+
+
+def materialized(ses, man):
+    '''
+    Return true if overlaps of the manifest are materialized.
+    '''
+    mid = _mid(man)
+    got = ses.execute(select(Overlap.c.both)
+                      .where(Overlap.c.manifest_a == mid)
+                      .where(Overlap.c.manifest_b == mid)).first()
+    return got is not None
+
+
+def assure(ses, man):
+    '''
+    Materialize overlaps of the manifest if not already.
+
+    The caller is responsible for committing.
+    '''
+    if not materialized(ses, man):
+        update(ses, [man])
+
+
+def subset_extras(ses, man, most):
+    '''
+    Return dict mapping id of each manifest sharing products with man,
+    including man itself, to its trio if other-man is at most most.
+    '''
+    mid = _mid(man)
+    if most > max_extras:
+        return {oid: trio for oid, trio in trios(ses, mid).items()
+                if trio[2] <= most}
+    assure(ses, mid)
+    fwd = select(Overlap.c.manifest_b, Overlap.c.only_a,
+                 Overlap.c.both, Overlap.c.only_b) \
+        .where(Overlap.c.manifest_a == bindparam("mid")) \
+        .where(Overlap.c.only_b <= bindparam("most"))
+    rev = select(Overlap.c.manifest_a, Overlap.c.only_b,
+                 Overlap.c.both, Overlap.c.only_a) \
+        .where(Overlap.c.manifest_b == bindparam("mid")) \
+        .where(Overlap.c.manifest_a != Overlap.c.manifest_b) \
+        .where(Overlap.c.only_a <= bindparam("most"))
+    got = ses.execute(union_all(fwd, rev), dict(mid=mid, most=most))
+    return {r[0]: tuple(r[1:]) for r in got if r[2]}
+
+
+def overlaps(ses, man):
+    '''
+    Return dict mapping id of each other manifest sharing products
+    with man to the trio (man-other, man ∩ other, other-man).
+    '''
+    mid = _mid(man)
+    ret = trios(ses, mid)
+    ret.pop(mid, None)
+    return ret
+
+
+def cmp(ses, man1, man2):
+    '''
+    Return a trio of set cardinalities like coups.manifest.cmp().
+    '''
+    mid1, mid2 = _mid(man1), _mid(man2)
+    both = ses.execute(
+        select(func.count())
+        .select_from(_mine.join(_other, _other.c.product_id == _mine.c.product_id))
+        .where(_mine.c.manifest_id == mid1)
+        .where(_other.c.manifest_id == mid2)).scalar()
+    size = sizes(ses, [mid1, mid2])
+    return (size.get(mid1, 0) - both, both, size.get(mid2, 0) - both)
+
+
+def only(ses, man, other):
+    '''
+    Return list of products of other which are not in man.
+    '''
+    pm = ProductManifest
+    mine = select(pm.c.product_id).where(pm.c.manifest_id == _mid(man))
+    theirs = select(pm.c.product_id).where(pm.c.manifest_id == _mid(other))
+    return ses.query(Product).filter(Product.id.in_(theirs)) \
+                             .filter(Product.id.not_in(mine)).all()
@@ -11,6 +11,7 @@ Handle parsing
 from pyparsing import *
 assert __version__[0] == '3'
 from pyparsing.exceptions import ParseException
+from .platform import registry, flavor_pattern, os_pattern, cpu_pattern
 
 # qual_literals = ["e%d"%n for n in range(
 
@@ -31,13 +32,10 @@ build_qual = one_of("opt prof debug").set_results_name("build")
 other_qual = Combine(("py" + Word(nums)) ^ (NotAny(compiler_qual + Literal("opt") + Literal ("prof") + Literal("debug") + software_qual) + Word(alphas, alphanums + '_'))).set_results_name("other")
 
 
-# An OS qual is a few letters in a fixed set plus a version.
-os_qual = Combine(one_of("slf sl u d") + Word(nums)).set_results_name("os")
-
-# A CPU (aka "machine") qual is one in a fixed set.  There are
-# possibly others that what are listed here, but these are all that
-# are currently supported for Scisoft builds.
-cpu_qual = Literal("x86_64").set_results_name("cpu")
+# An OS qual is a few letters plus a version and a CPU (aka "machine")
+# qual is a word.  Both must be known to the platform registry.
+os_qual = Regex(os_pattern).add_condition(lambda t: t[0] in registry.oses).set_results_name("os")
+cpu_qual = Regex(cpu_pattern).add_condition(lambda t: t[0] in registry.cpus).set_results_name("cpu")
 
 # These two are often used together
 cpuos_qual = Combine(os_qual + '-' + cpu_qual).set_results_name("cpuos")
@@ -56,27 +54,8 @@ dash_quals = (
 # Same but colon-separated.
 colon_quals = (compiler_qual + Opt(":" + other_qual) + ":" + build_qual).set_results_name("quals")
 
-# An encoding of OS+CPU
-flavor = one_of("""
-Linux64bit+2.6-2.5
-Linux64bit+2.6-2.12
-Linux64bit+3.10-2.17
-Linuxppc64le64bit+3.10-2.17
-Linux64bit+3.19-2.19
-Linux64bit+4.4-2.23
-Linux64bit+4.15-2.27
-Linux64bit+5.4-2.31
-Darwin+12
-Darwin64bit+12
-Darwin64bit+13
-Darwin64bit+14
-Darwin64bit+15
-Darwin64bit+16
-Darwin64bit+17
-Darwin64bit+18
-source
-noarch
-NULL""").set_results_name("flavor")
+# An encoding of OS+CPU, one known to the platform registry.
+flavor = Regex(flavor_pattern).add_condition(lambda t: t[0] in registry).set_results_name("flavor")
 
 
 #version = delimited_list(Word(nums + 'p', alphanums), delim='.', combine=True).set_results_name("version")
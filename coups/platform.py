@@ -1,27 +1,41 @@
 #!/usr/bin/env python3
 '''
 Handle platform names
+
+The known platforms are held in a Registry.  Besides those built in,
+extra platforms may be given in files named by COUPS_PLATFORMS (an
+os.pathsep separated list) with one platform per line:
+
+    <flavor> [<cpu> [<os> ...]]
+
+Blank lines and those starting with "#" are ignored.  The coups DB
+may also hold extra platforms, see store.ExtraPlatform.
 '''
 
 # Copyright Brett Viren 2021.
 # This file is part of coups which is free software distributed under
 # the terms of the GNU Affero General Public License.
 
-from collections import namedtuple 
+import os
+import re
+import sys
+from collections import namedtuple
 
 Platform = namedtuple("Platform", "flavor cpu oses")
 
-### don't use this directly.  perhaps they belong in a db table
+### don't use this directly, use the registry.
 platforms = [
     Platform("Linux64bit+2.6-2.5",      "x86_64", ( "slf5", "sl5")),
     Platform("Linux64bit+2.6-2.12",     "x86_64", ( "slf6", "sl6")),
     Platform("Linux64bit+3.10-2.17",    "x86_64", ( "slf7", "sl7")),
+    Platform("Linuxppc64le64bit+3.10-2.17", "ppc64le", ( "slf7", "sl7")),
     # ubuntu amd64
     Platform("Linux64bit+3.19-2.19",    "x86_64", ( "u14",)),
     Platform("Linux64bit+4.4-2.23",     "x86_64", ( "u16",)),
     Platform("Linux64bit+4.15-2.27",    "x86_64", ( "u18",)),
     Platform("Linux64bit+5.4-2.31",     "x86_64", ( "u20",)),
     # mac
+    Platform("Darwin+12",               "",        ()),
     Platform("Darwin64bit+12",          "x86_64",  ( "d12",)),
     Platform("Darwin64bit+13",          "x86_64",  ( "d13",)),
     Platform("Darwin64bit+14",          "x86_64",  ( "d14",)),
@@ -35,20 +49,116 @@ platforms = [
     Platform('NULL', "", ()),
 ]
 
+# What a flavor, OS and CPU must look like.  The flavor pattern is
+# that of the "flavor" token of coups.parsing.
+flavor_pattern = r'[A-Za-z][A-Za-z0-9]*(?:\+[0-9]+(?:\.[0-9]+)*(?:-[0-9]+(?:\.[0-9]+)*)?)?'
+os_pattern = r'[a-z]+[0-9]+'
+cpu_pattern = r'[a-z][a-z0-9_]*'
+
+
+class Registry:
+    '''
+    Platforms indexed by flavor and by (OS, CPU).
+
+    Platforms may only be added.  The first platform listing an OS/CPU
+    pair is the one returned for it.  The generation counts additions
+    so that users may rebuild anything derived from the registry.
+    '''
+
+    def __init__(self, plats=()):
+        self.platforms = list()
+        self.generation = 0
+        self._flavors = dict()
+        self._oscpus = dict()
+        self.oses = set()
+        self.cpus = set()
+        for plat in plats:
+            self.add(plat)
+
+    def add(self, plat):
+        '''
+        Add a Platform.  Adding one already known is a no-op, a
+        different platform of a known flavor raises ValueError.
+        '''
+        plat = Platform(plat.flavor, plat.cpu or "", tuple(plat.oses or ()))
+        have = self._flavors.get(plat.flavor)
+        if have == plat:
+            return have
+        if have:
+            raise ValueError(f'platform {plat} conflicts with {have}')
+        if not re.fullmatch(flavor_pattern, plat.flavor):
+            raise ValueError(f'malformed flavor {plat.flavor}')
+        if plat.cpu and not re.fullmatch(cpu_pattern, plat.cpu):
+            raise ValueError(f'malformed cpu {plat.cpu}')
+        for one in plat.oses:
+            if not re.fullmatch(os_pattern, one):
+                raise ValueError(f'malformed os {one}')
+
+        self.platforms.append(plat)
+        self._flavors[plat.flavor] = plat
+        for one in plat.oses:
+            self._oscpus.setdefault((one, plat.cpu), plat)
+            self.oses.add(one)
+        if plat.oses:
+            self.cpus.add(plat.cpu)
+        self.generation += 1
+        return plat
+
+    @property
+    def flavors(self):
+        return list(self._flavors)
+
+    @property
+    def oscpus(self):
+        return list(self._oscpus)
+
+    def __contains__(self, flavor):
+        return flavor in self._flavors
+
+    def by_flavor(self, flavor):
+        try:
+            return self._flavors[flavor]
+        except (KeyError, TypeError):
+            raise ValueError(f'unknown flavor {flavor}') from None
+
+    def by_oscpu(self, OS, CPU):
+        try:
+            return self._oscpus[(OS.lower(), CPU)]
+        except KeyError:
+            raise ValueError(f"Unsupported OS:{OS}/CPU:{CPU}") from None
+
+    def load_file(self, path):
+        '''
+        Add platforms from a file, return list of them.
+        '''
+        ret = list()
+        for line in open(path):
+            parts = line.split()
+            if not parts or parts[0].startswith("#"):
+                continue
+            cpu = parts[1] if len(parts) > 1 else ""
+            ret.append(self.add(Platform(parts[0], cpu, tuple(parts[2:]))))
+        return ret
+
+
+registry = Registry(platforms)
+
+for _path in os.environ.get("COUPS_PLATFORMS", "").split(os.pathsep):
+    if not _path:
+        continue
+    try:
+        registry.load_file(_path)
+    except (OSError, ValueError) as err:
+        sys.stderr.write(f'warning: COUPS_PLATFORMS: {_path}: {err}\n')
+
 
 def by_oscpu(OS, CPU):
     '''
     Try to return the flavor corresponding to OS/CPU pair
     '''
-    for p in platforms:
-        if CPU == p.cpu and OS.lower() in p.oses:
-            return p
-    raise ValueError(f"Unsupported OS:{OS}/CPU:{CPU}")
+    return registry.by_oscpu(OS, CPU)
 
 def by_flavor(flavor):
-    for p in platforms:
-        if p.flavor == flavor:
-            return p
-    raise ValueError(f'unknown flavor {flavor}')
+    return registry.by_flavor(flavor)
 
 
@@ -11,8 +11,10 @@ We *always* encode a "version" not a "vunder" but we may render to a
 # the terms of the GNU Affero General Public License.
 
 import os
+import re
 import sys
-from .platform import by_oscpu, by_flavor
+from functools import lru_cache
+from .platform import by_oscpu, by_flavor, registry
 from .util import versionify
 from collections import namedtuple
 from .quals import dashed as dashed_quals
@@ -53,36 +55,94 @@ def make_filename(name, version, flavor='', quals=''):
     version = versionify(version)
     if not flavor or flavor in ("NULL",):
         return f'{name}-{version}-NULL.tar.bz2'
-    plat = by_flavor(flavor)
+    return _filename(name, version, by_flavor(flavor), dashed_quals(quals))
 
+
+def _filename(name, version, plat, dquals):
+    '''
+    Build canonical product filename from a platform and dashed quals.
+    '''
+    if plat.flavor == "NULL":
+        return f'{name}-{version}-NULL.tar.bz2'
     if not plat.oses:
-        prefix = f'{name}-{version}-{flavor}'
+        prefix = f'{name}-{version}-{plat.flavor}'
     else:
-        OS = plat.oses[0]
-        CPU = plat.cpu
-        prefix = f'{name}-{version}-{OS}-{CPU}'
+        prefix = f'{name}-{version}-{plat.oses[0]}-{plat.cpu}'
+    if dquals:
+        dquals = '-' + dquals
+    return f'{prefix}{dquals}.tar.bz2'
+
+
+# A fast path for the "product" grammar of coups.parsing.  It only
+# matches names which the grammar parses to the same parts, anything
+# else falls back to the grammar.  The quals alternatives are those of
+# "dash_quals" and must span up to the ".tar.bz2".  The flavor and
+# OS-CPU alternatives are those of the platform registry at the time
+# the pattern is made.
+_compiler = r'(?:[ec]+[0-9]+|gcc[0-9]+)'
+_other = r'[A-Za-z][A-Za-z0-9_]*'
+_build = r'(?:opt|prof|debug)'
+
+def _alternatives(words):
+    return '|'.join([re.escape(w) for w in sorted(words, key=len, reverse=True)])
+
+def _make_product_re():
+    return re.compile(
+        r'(?P<name>[A-Za-z][A-Za-z0-9_]*)-(?P<version>[0-9][A-Za-z0-9.]*)-'
+        r'(?:(?P<flavor>' + _alternatives(registry.flavors) + r')'
+        r'|(?P<oscpu>' + _alternatives([f'{o}-{c}' for o, c in registry.oscpus]) + r'))'
+        r'(?:-(?P<quals>' + '|'.join([f'{_compiler}-{_other}-{_build}',
+                                      f'{_other}-{_compiler}-{_build}',
+                                      f'{_compiler}-{_build}',
+                                      _other]) + r'))?'
+        r'\.tar\.bz2')
+
+# (registry generation, pattern)
+_product_re = (None, None)
+
+def product_re():
+    '''
+    Return the fast path pattern for the current platform registry.
+    '''
+    global _product_re
+    gen, pat = _product_re
+    if gen != registry.generation:
+        gen = registry.generation
+        pat = _make_product_re()
+        _product_re = (gen, pat)
+    return pat
 
-    quals = dashed_quals(quals)
-    if quals:
-        quals = '-' + quals
-    return f'{prefix}{quals}.tar.bz2'
+# Number of file names to remember in partition_filename().
+cache_size = 65536
 
 
-def partition_filename(fname):
+def fast_partition(fname):
     '''
-    Break a product filename into its parts.
+    Return (name, version, flavor, quals) of a product base file name
+    or None if the fast path does not apply.
+    '''
+    got = product_re().match(fname)
+    if not got:
+        return None
+    flavor = got["flavor"]
+    if flavor is None:
+        flavor = by_oscpu(*got["oscpu"].split('-', 1)).flavor
+    quals = (got["quals"] or '').replace('-', ':')
+    return got["name"], got["version"], flavor, quals
 
-    A product tar file name is assumed to be of the form:
 
-    <name>-<version>[-<OS>-<CPU>[-<dquals>]|-noarch].tar.bz2
+def grammar_partition(fname):
+    '''
+    Return (name, version, flavor, quals) of a product base file name
+    parsed by the full grammar.
 
+    A ValueError is raised if the name does not parse, as it is for a
+    platform (eg an OS qual) not in the registry.
     '''
-    fname = os.path.basename(fname)
     try:
         pp = parse_product.parse_string(fname).product
-    except ParseException:
-        sys.stderr.write(f'failed to parse filename: {fname}\n')
-        raise
+    except ParseException as err:
+        raise ValueError(f'failed to parse filename: {fname}') from err
     
     name = pp.package
     version = pp.version
@@ -100,7 +160,28 @@ def partition_filename(fname):
 
     return name, version, flavor, quals
 
-def make(name, version, flavor=None, quals=None, filename=None):
+
+@lru_cache(maxsize=cache_size)
+def _partition(fname):
+    return fast_partition(fname) or grammar_partition(fname)
+
+
+def partition_filename(fname):
+    '''
+    Break a product filename into its parts.
+
+    A product tar file name is assumed to be of the form:
+
+    <name>-<version>[-<OS>-<CPU>[-<dquals>]|-noarch].tar.bz2
+
+    '''
+    return _partition(os.path.basename(fname))
+
+# If true, make() runs the full check() on each product it makes.
+validating = os.environ.get("COUPS_VALIDATE", "") not in ("", "0")
+
+
+def make(name, version, flavor=None, quals=None, filename=None, validate=None):
     '''
     Create a product tuple ("ptp") with flexible args
 
@@ -108,30 +189,46 @@ def make(name, version, flavor=None, quals=None, filename=None):
     - version :: a version or vunder
     - quals :: a set of quals as :-separated string
     - filename :: the tar filename, if none it will be generated
+    - validate :: run the full check(), default is "validating"
+
+    Products are cached by their arguments.
     '''
-    version = versionify(version)
+    if quals and not isinstance(quals, str):
+        quals = ':'.join(quals)
+    if validate is None:
+        validate = validating
+    return _make(name, versionify(version), flavor or 'NULL', quals or '',
+                 filename or '', bool(validate))
 
-    if flavor:
-        plat = by_flavor(flavor) # check that we know it
-    else:
-        flavor='NULL'
+
+@lru_cache(maxsize=cache_size)
+def _make(name, version, flavor, quals, filename, validate):
+    plat = by_flavor(flavor)    # check that we know it
 
     # get into canoncial form and order
-    quals = dashed_quals(quals).replace('-', ':')
+    dquals = dashed_quals(quals)
+    quals = dquals.replace('-', ':')
 
     noisy = False
     if not filename:
-        filename = make_filename(name, version, flavor, quals)
+        filename = _filename(name, version, plat, dquals)
         noisy = True
 
     ptp = Product(name, version, flavor, quals, filename)
-    check(ptp, noisy)           # confirm consistency
+    if validate:
+        check(ptp, noisy)       # confirm consistency
     return ptp
 
 
-def parse_filename(fname):
+def parse_filename(fname, validate=None):
     '''
     Parse a product file name (or URL) into a Product tuple
+
+    The quals in the file name must be in canonical order.  See make()
+    for validate.
     '''
     name, version, flavor, quals = partition_filename(fname)
-    return make(name, version, flavor, quals, fname)
+    ptp = make(name, version, flavor, quals, fname, validate)
+    if ptp.quals != quals:
+        raise ValueError(f'product quals mismatch: have {quals} from {fname} want {ptp.quals}')
+    return ptp
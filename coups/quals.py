@@ -9,8 +9,62 @@ Handle qualifiers
 
 # Hints at https://scisoft.fnal.gov/scisoft/bundles/tools/buildFW
 
+import re
+from functools import lru_cache
 from collections import namedtuple
-from .parsing import software_qual, compiler_qual, build_qual, other_qual, ParseException
+
+# The types of a set of quals, see types().
+QualTypes = namedtuple("QualTypes", "b c s o")
+
+no_quals = QualTypes('', '', '', '')
+
+# Classes of a qual tried in order.  Each matches a prefix after any
+# white space as parse_string() of the like-named grammar elements in
+# coups.parsing does.
+qual_classes = [
+    ("b", re.compile(r'[ \t\n\r]*(?:opt|prof|debug)')),
+    ("s", re.compile(r'[ \t\n\r]*s+[0-9]+')),
+    ("c", re.compile(r'[ \t\n\r]*(?:[ec]+[0-9]+|gcc[0-9]+)')),
+    ("o", re.compile(r'[ \t\n\r]*(?:py[0-9]+|[A-Za-z])')),
+]
+
+# Number of distinct quals and qual sets to remember.
+cache_size = 4096
+
+
+@lru_cache(maxsize=cache_size)
+def classify(qual):
+    '''
+    Return the type of one qual as one of the attribute names of
+    QualTypes or None if it fits none.
+    '''
+    for name, pattern in qual_classes:
+        if pattern.match(qual):
+            return name
+    return None
+
+
+def split(quals):
+    '''
+    Return tuple of non-empty quals from a :-separated string or a
+    sequence.
+    '''
+    if not quals:
+        return ()
+    if isinstance(quals, str):
+        quals = quals.split(":")
+    return tuple([q for q in quals if q])
+
+
+@lru_cache(maxsize=cache_size)
+def _types(quals):
+    got = dict(b='', c='', s='', o='')
+    for q in quals:
+        name = classify(q)
+        if name:
+            got[name] = q
+    return QualTypes(**got)
+
 
 def types(quals):
     '''
@@ -27,48 +81,13 @@ def types(quals):
 
     This interpretation is subject to change over time as Fermilab
     blows in the wind.
+
+    Results are cached and shared, a QualTypes is immutable.
     '''
-    b=c=s=o=''
+    quals = split(quals)
     if not quals:
-        return group
-    if isinstance(quals, str):
-        quals = quals.split(":")
-    quals = [q for q in quals if q]
-
-    for q in quals:
-        try:
-            build_qual.parse_string(q)
-        except ParseException:
-            pass
-        else:
-            b = q
-            continue
-
-        try:
-            software_qual.parse_string(q)
-        except ParseException:
-            pass
-        else:
-            s = q
-            continue
-
-        try:
-            compiler_qual.parse_string(q)
-        except ParseException:
-            pass
-        else:
-            c = q
-            continue
-
-        try:
-            other_qual.parse_string(q)
-        except ParseException:
-            pass
-        else:
-            o = q
-            continue
-
-    return namedtuple("QualTypes", "b c s o")(b,c,s,o)
+        return no_quals
+    return _types(quals)
 
 def dashed(quals, isman=False):
     '''
@@ -78,14 +97,16 @@ def dashed(quals, isman=False):
 
     manifests: [<software>-]<compiler>[-<other>][-<build>]
     '''
+    return _dashed(split(quals), isman)
+
+
+@lru_cache(maxsize=cache_size)
+def _dashed(quals, isman):
     if not quals:
         return ''
-    if isinstance(quals, str):
-        quals = quals.split(":")
-    quals = [q for q in quals if q]
     if len(quals) == 1:
         return quals[0]
-    qt = types(quals)
+    qt = _types(quals)
     if isman:
         got = [qt.s, qt.c, qt.o, qt.b]
     else:
@@ -7,75 +7,114 @@ Ensconce various read-only (select) queries
 # This file is part of coups which is free software distributed under
 # the terms of the GNU Affero General Public License.
 
-from sqlalchemy.orm import aliased
-from coups.manifest import cmp as manifest_cmp
+from sqlalchemy.orm import selectinload, joinedload, configure_mappers
+from coups.bulk import chunks
 from coups.store import *
 from coups.util import vunderify, versionify
 
-def subsets(ses, man, diff=0):
+def subset_extras(ses, man, most=None):
     '''
-    Return a list of manifests that provide a subset of man.
+    Return dict mapping each manifest sharing products with man to the
+    trio of cardinalities
 
-    Another manifest, "other" is considered a subset if the
-    cardinality of the set difference of "man" - "other" is "diff" or
-    less.
+        (man-other, man ∩ other, other-man)
 
-    Note, the query is based on sets of products.
+    The last is the number of extra products "other" would supply.  If
+    most is given, candidates with more extras than that are dropped
+    by the query.  The result includes man itself.
+
+    Up to coups.overlap.max_extras, the trios are read from the
+    materialized overlap table with a single parameterized query so
+    one call may serve any number of thresholds.  Otherwise they are
+    counted from the product links of man.  Materializing the overlaps
+    of man may leave the session to be committed by the caller.
     '''
-    diff *= -1
+    from coups import overlap
+    if most is None:
+        trios = overlap.trios(ses, man)
+    else:
+        trios = overlap.subset_extras(ses, man, most)
+    ret = dict()
+    for chunk in chunks(trios):
+        for one in ses.query(Manifest).filter(Manifest.id.in_(chunk)):
+            ret[one] = trios[one.id]
+    return ret
 
-    mids = ses.execute(f'SELECT subset.manifest_id FROM product_manifest AS subset GROUP BY subset.manifest_id HAVING SUM(subset.product_id IN (select product_id FROM product_manifest WHERE manifest_id = {man.id})) - count(*) >= {diff}')
-    mids = [m[0] for m in mids.all()]
-    return ses.query(Manifest).filter(Manifest.id.in_(mids)).all()
 
+def subsets_within(ses, man, number=0, extras=None):
+    '''
+    Return dict mapping subset manifests of man to their trios.
 
-# sqlite> select * from manifest where id IN (
-#     SELECT subset.manifest_id FROM product_manifest as subset GROUP BY subset.manifest_id HAVING SUM(subset.product_id IN (SELECT product_id FROM product_manifest WHERE manifest_id =15786)) - count(*) <= -1);
+    A manifest is kept if it supplies no more than number extra
+    products or, if its name is a key of the extras dict, no more
+    than the associated number, whichever is larger.  All thresholds are served from one
+    call to subset_extras().
+    '''
+    extras = extras or dict()
+    most = max([number] + list(extras.values()))
+    ret = dict()
+    for other, trio in subset_extras(ses, man, most).items():
+        if trio[2] <= max(number, extras.get(other.name, number)):
+            ret[other] = trio
+    return ret
 
 
+def subsets(ses, man, diff=0):
+    '''
+    Return a list of manifests that provide a subset of man.
 
-def find_bundles(man, other_mans):
+    Another manifest, "other" is considered a subset if the
+    cardinality of the set difference of "other" - "man" is "diff" or
+    less and the two share at least one product.
     '''
-    Given a manifest object man, return other manifest objects which
-    provide.
+    return list(subset_extras(ses, man, diff))
+
+
+def loaders(Type, products=False, manifests=False):
     '''
-    # fixme: this is exhaustive and dumb.  We could still be
-    # exhaustive if we did the set calculus in the db....
-    ret = list()
-    # other_mans = ses.query(store.Manifest).all()
-    for other in other_mans:
-        if man.name == other.name:
-            continue
-        mine, both, yours = manifest_cmp(man, other)
-        if mine > 0 and both > 0 and yours == 0:
-            ret.append(other)
-        #print (f'no match: ({mine},{both},{yours}) {other}')
-    return ret
+    Return loader options for a query on Type (Manifest or Product).
 
-def qualified(ses, Type, name, version=None, flavor=None, quals=None):
+    Flavor and quals are always loaded eagerly as rendering needs
+    them.  If products (for Manifest) or manifests (for Product) is
+    true, that collection is also loaded, along with the flavor and
+    quals of its products.  This replaces a lazy load per row with a
+    few selects per query.
+    '''
+    configure_mappers()         # backrefs exist only once configured
+    opts = [joinedload(Type.flavor), selectinload(Type.quals)]
+    if Type is Manifest and products:
+        prods = selectinload(Manifest.products)
+        opts += [prods.joinedload(Product.flavor),
+                 prods.selectinload(Product.quals)]
+    if Type is Product and manifests:
+        opts.append(selectinload(Product.manifests))
+    return tuple(opts)
+
+
+def qualified(ses, Type, name, version=None, flavor=None, quals=None, options=()):
     '''
     Return matching records of Type (manifest or products).
+
+    If quals are given, the record must have exactly that set, "" for
+    none.  Any loader options are applied.
     '''
     p = ses.query(Type)
+    if options:
+        p = p.options(*options)
     p = p.filter(Type.name==name)
     if version:
         p = p.filter(Type.version==version)
     if flavor:
         p = p.filter(Type.flavor.has(Flavor.name==flavor))
-    if quals:
-        if isinstance(quals, str):
-            quals = quals.split(":")
-        for qual in quals:
-            qt = aliased(Qual)
-            p = p.join(Type.quals.of_type(qt))
-            p = p.filter(qt.name == qual)
+    if quals is not None:
+        p = p.filter(Type.qualkey == qualkey(quals))
     return p.all()
 
-def products(ses, name, version=None, flavor=None, quals=None):
+def products(ses, name, version=None, flavor=None, quals=None, options=()):
     '''
     Return matching products.
     '''
-    return qualified(ses, Product, name, version, flavor, quals)
+    return qualified(ses, Product, name, version, flavor, quals, options)
 
 def manifest(ses, mtp):
     '''
@@ -86,11 +125,11 @@ def manifest(ses, mtp):
         return got[0]
     return None
 
-def manifests(ses, name, version=None, flavor=None, quals=None):
+def manifests(ses, name, version=None, flavor=None, quals=None, options=()):
     '''
     Return matching manifests.
     '''
     version = versionify(version)
-    return qualified(ses, Manifest, name, version, flavor, quals)
+    return qualified(ses, Manifest, name, version, flavor, quals, options)
 
 
@@ -8,7 +8,6 @@ Functions to render objects to strings
 # the terms of the GNU Affero General Public License.
 
 from .util import vunderify
-from .quals import types as qual_types
 from .platform import by_flavor
 
 product_string = str
@@ -104,6 +103,7 @@ def dockerfile_manifest(from_image, man,
     if operating_system not in plat.oses:
         raise RuntimeError(f'Image/manifest OS mismatch: {operating_system} != {plat.oses} with flavor: {flavor}')
 
+    from .quals import types as qual_types
     quals = ":".join([str(q) for q in man.quals])
     qt = qual_types(quals)
     build_spec = qt.b
@@ -54,16 +54,125 @@ Identifiers
 # the terms of the GNU Affero General Public License.
 
 import os
-import requests
-from requests.exceptions import *
-from bs4 import BeautifulSoup
+import threading
+from html.parser import HTMLParser
 from coups.util import versionify, vunderify
 from pathlib import Path
 
-base_url = "https://scisoft.fnal.gov/scisoft"
+default_base_url = "https://scisoft.fnal.gov/scisoft"
+base_url = default_base_url
 bundles_url = os.path.join(base_url, "bundles")
 packages_url = os.path.join(base_url, "packages")
 
+def set_base(url=None):
+    '''
+    Set the base URL of the scisoft tree, default is the real one.
+
+    An http(s):// mirror or a file:// directory tree laid out like
+    scisoft (see coups.mirror) may be given.  A plain path is taken as
+    a directory.
+    '''
+    global base_url, bundles_url, packages_url
+    url = url or default_base_url
+    if "://" not in url:
+        url = Path(url).resolve().as_uri()
+    base_url = url.rstrip("/")
+    bundles_url = os.path.join(base_url, "bundles")
+    packages_url = os.path.join(base_url, "packages")
+    return base_url
+
+def __getattr__(name):
+    # requests is imported only when needed but its exceptions, such
+    # as HTTPError, have always been reachable from this module.
+    import requests.exceptions
+    try:
+        return getattr(requests.exceptions, name)
+    except AttributeError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+
+# Settings for the HTTP sessions, see configure().  The timeout is
+# (connect, read) seconds.  Retries back off by backoff*2^n seconds.
+http_config = dict(pool_connections=4, pool_maxsize=16,
+                   retries=3, backoff=0.5,
+                   status_forcelist=(429, 500, 502, 503, 504),
+                   timeout=(10, 60))
+_adapters = None
+_generation = 0
+_lock = threading.Lock()
+_local = threading.local()
+
+# Size of chunks read from a streamed response.
+chunk_size = 64*1024
+
+def configure(**kwds):
+    '''
+    Update http_config.  Sessions are remade on next use.
+    '''
+    global _adapters, _generation
+    unknown = set(kwds).difference(http_config)
+    if unknown:
+        raise ValueError(f'unknown HTTP settings: {", ".join(sorted(unknown))}')
+    with _lock:
+        http_config.update(kwds)
+        if _adapters is not None:
+            for one in set(_adapters.values()):
+                one.close()
+        _adapters = None
+        _generation += 1
+
+def adapters():
+    '''
+    Return dict mapping URL prefix to the shared transport adapter.
+    '''
+    global _adapters
+    with _lock:
+        if _adapters is not None:
+            return _adapters
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+        from coups.mirror import FileAdapter
+        cfg = http_config
+        retry = Retry(total=cfg["retries"], backoff_factor=cfg["backoff"],
+                      status_forcelist=cfg["status_forcelist"],
+                      allowed_methods=("GET", "HEAD"))
+        http = HTTPAdapter(pool_connections=cfg["pool_connections"],
+                           pool_maxsize=cfg["pool_maxsize"],
+                           max_retries=retry)
+        _adapters = {"https://": http, "http://": http, "file://": FileAdapter()}
+        return _adapters
+
+def session():
+    '''
+    Return the requests session of the calling thread.
+
+    requests does not promise that a Session may be shared between
+    threads so each thread (eg, crawl and download workers) has its
+    own.  They all mount the same transport adapters, whose urllib3
+    connection pools are thread safe, so connections to the server
+    are still pooled and kept alive across requests and threads.
+    '''
+    ses = getattr(_local, "session", None)
+    if ses is not None and _local.generation == _generation:
+        return ses
+    import requests
+    ses = requests.Session()
+    ses.headers["User-Agent"] = "coups"
+    for prefix, adapter in adapters().items():
+        ses.mount(prefix, adapter)
+    _local.session = ses
+    _local.generation = _generation
+    return ses
+
+def get(url, **kwds):
+    '''
+    Return response from GET of url using the thread's session.
+
+    Keyword arguments are passed to requests, timeout defaults to that
+    in http_config.
+    '''
+    kwds.setdefault("timeout", http_config["timeout"])
+    return session().get(url, **kwds)
+
 def manifest_url(name, version):
     vunder = vunderify(version)
     return os.path.join(bundles_url, name, vunder, "manifest")
@@ -76,7 +185,27 @@ def get_manifest(mtp):
     Return manifest text given manifest object
     '''
     url = os.path.join(manifest_url(mtp.name, mtp.version), mtp.filename)
-    return requests.get(url).text
+    page = get(url)
+    page.raise_for_status()
+    return page.text
+
+def stream_manifest(mtp):
+    '''
+    Generate chunks of manifest text given manifest object as they
+    arrive from scisoft.
+    '''
+    import codecs
+    url = os.path.join(manifest_url(mtp.name, mtp.version), mtp.filename)
+    with get(url, stream=True) as page:
+        page.raise_for_status()
+        decoder = codecs.getincrementaldecoder(page.encoding or "utf-8")(errors="replace")
+        for data in page.iter_content(chunk_size):
+            text = decoder.decode(data)
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
 
 def manifest_products(filename):
     '''
@@ -87,18 +216,98 @@ def manifest_products(filename):
     text = get_manifest(mtp)
     return coups.manifest.parse_body(text)
 
-def table(url):
+class TableHrefs(HTMLParser):
     '''
-    Yield URLs from rows of scisoft index page main table.
-    
-    Note, the overall URL hierarcy is:
+    Incremental parser of scisoft index pages.
 
-      https://scisoft.fnal.gov/scisoft/bundles/<name>/<version>/manifest/<manifest>
+    Feed it HTML and collect in .hrefs the href of the first <a> in
+    the first <td> of each <tr> of the first <table> in the
+    <div class="inner content-inner">.  Once that table closes the
+    rest of the page is ignored.  If the page does not look like an
+    index page, .recognized is false when done.
+    '''
 
-    Where "manifest" is literal and <...>'s are iterable by this function.
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.hrefs = list()
+        self.state = "page"     # page, inner, table, done
+        self.div_depth = 0
+        self.table_depth = 0
+        self.rows = 0
+        self.row = None         # None, "td", "got"
+        self.odd = False
+
+    @property
+    def recognized(self):
+        return self.state == "done" and self.rows > 0 and not self.odd
+
+    def handle_starttag(self, tag, attrs):
+        state = self.state
+        if state == "done":
+            return
+        if state == "page":
+            if tag == "div" and dict(attrs).get("class") == "inner content-inner":
+                self.state = "inner"
+                self.div_depth = 1
+            return
+        if tag == "div":
+            self.div_depth += 1
+        if state == "inner":
+            if tag == "table":
+                self.state = "table"
+                self.table_depth = 1
+            return
+        # in table
+        if tag == "table":
+            self.table_depth += 1
+        elif tag == "tr":
+            self.end_row()
+            self.rows += 1
+            self.row = "tr"
+        elif tag == "td" and self.row == "tr":
+            self.row = "td"
+        elif tag == "a" and self.row == "td":
+            href = dict(attrs).get("href")
+            if href is None:
+                self.odd = True
+            else:
+                self.hrefs.append(href)
+            self.row = "got"
+
+    def end_row(self):
+        if self.row == "td":
+            # a <td> with no <a> which the tree parser chokes on
+            self.odd = True
+        self.row = None
+
+    def handle_endtag(self, tag):
+        if self.state in ("page", "done"):
+            return
+        if tag == "div":
+            self.div_depth -= 1
+            if self.div_depth == 0:
+                self.end_row()
+                self.state = "done"
+            return
+        if self.state != "table":
+            return
+        if tag == "table":
+            self.table_depth -= 1
+            if self.table_depth == 0:
+                self.end_row()
+                self.state = "done"
+        elif tag == "tr":
+            self.end_row()
+
+
+def soup_table(content, url):
+    '''
+    Return list of URLs from an index page using BeautifulSoup.
+
+    This is the slow, general fallback for parse_table().
     '''
-    page = requests.get(url)
-    soup = BeautifulSoup(page.content, "html.parser")
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(content, "html.parser")
     if not soup:
         raise ValueError(f'failed to get soup from {url}')
     inner = soup.find("div", class_="inner content-inner")
@@ -110,11 +319,115 @@ def table(url):
     rows = table.find_all("tr")
     if not rows:
         raise ValueError(f'failed to get rows from {url}')
+    ret = list()
     for row in rows:
         if not row.td:
             continue
         href = row.td.a["href"]
-        yield os.path.join(page.url, href)
+        ret.append(os.path.join(url, href))
+    return ret
+
+
+def stream_table(chunks, url):
+    '''
+    Yield URLs from rows of an index page as its HTML chunks arrive.
+
+    Chunks may be bytes (decoded as UTF-8) or str.  If the page is not
+    recognized, the whole of it is given to soup_table() instead.
+    '''
+    import codecs
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    parser = TableHrefs()
+    seen = list()
+    sent = 0
+    for chunk in chunks:
+        if isinstance(chunk, bytes):
+            chunk = decoder.decode(chunk)
+        seen.append(chunk)
+        if parser.state == "done":
+            continue
+        parser.feed(chunk)
+        if parser.odd:
+            continue
+        while sent < len(parser.hrefs):
+            yield os.path.join(url, parser.hrefs[sent])
+            sent += 1
+    tail = decoder.decode(b"", final=True)
+    seen.append(tail)
+    parser.feed(tail)
+    parser.close()
+    if parser.recognized:
+        for href in parser.hrefs[sent:]:
+            yield os.path.join(url, href)
+        return
+    got = soup_table("".join(seen), url)
+    if got[:sent] != [os.path.join(url, h) for h in parser.hrefs[:sent]]:
+        raise ValueError(f'inconsistent parse of {url}')
+    yield from got[sent:]
+
+
+def parse_table(content, url):
+    '''
+    Return list of URLs from rows of scisoft index page main table.
+
+    The content is the HTML and url is that of the page.
+    '''
+    return list(stream_table([content], url))
+
+
+def listing(url):
+    '''
+    Return list of URLs from rows of scisoft index page main table.
+
+    See table().
+    '''
+    return list(table(url))
+
+
+def table(url):
+    '''
+    Yield URLs from rows of scisoft index page main table.
+    
+    Note, the overall URL hierarcy is:
+
+      https://scisoft.fnal.gov/scisoft/bundles/<name>/<version>/manifest/<manifest>
+
+    Where "manifest" is literal and <...>'s are iterable by this function.
+
+    Results are kept in coups.webcache.  A fresh entry is used
+    without contacting the server, a stale one is revalidated with a
+    conditional GET.  In offline mode a missing entry is an error.
+    When the page is fetched, URLs are yielded as they are parsed from
+    the response and the cache entry is saved once all are consumed.
+    '''
+    from coups import webcache
+    if not webcache.settings["enabled"] or url.startswith("file:"):
+        page = get(url, stream=True)
+        with page:
+            page.raise_for_status()
+            yield from stream_table(page.iter_content(chunk_size), page.url)
+        return
+
+    entry = webcache.load(url)
+    if webcache.fresh(entry):
+        yield from entry["hrefs"]
+        return
+    if webcache.settings["offline"]:
+        raise ValueError(f'not in cache while offline: {url}')
+
+    page = get(url, headers=webcache.validators(entry), stream=True)
+    with page:
+        if page.status_code == 304 and entry:
+            webcache.touch(url, entry)
+            yield from entry["hrefs"]
+            return
+        page.raise_for_status()
+        hrefs = list()
+        for href in stream_table(page.iter_content(chunk_size), page.url):
+            hrefs.append(href)
+            yield href
+        webcache.save(url, hrefs, page.headers.get("ETag"),
+                      page.headers.get("Last-Modified"))
 
 
 def path_or_directory(paths, index=None, mod=lambda x: x):
@@ -195,22 +508,11 @@ def package_products(package, version, full=True):
 
 def download_product(prod, todir="."):
     '''
-    Download product tar file.
-    '''
-    if isinstance(todir, str):
-        todir = Path(todir)
-
-    if not todir.exists():
-        todir.mkdir(parents=True)
-
-    purl = product_url(prod.name, prod.version)
-    furl = os.path.join(purl, prod.filename)
-    targ = todir / prod.filename
-
-    with requests.get(furl, stream=True) as req:
-        req.raise_for_status()
-        with targ.open('wb') as fp:
-            for chunk in req.iter_content(chunk_size=8192): 
-                fp.write(chunk)
-    return targ
+    Download product tar file, return its path.
 
+    The transfer resumes any partial download, see coups.download.
+    '''
+    from coups.download import fetch, product_transfers
+    transfer = product_transfers([prod], todir, skip_existing=False)[0]
+    fetch(transfer)
+    return Path(transfer.path)
@@ -10,8 +10,11 @@ All versions are versions, not vunders.
 # the terms of the GNU Affero General Public License.
 
 import os
+import hashlib
+from contextlib import contextmanager
 from sqlalchemy import Table, Column, Integer, String, DateTime
-from sqlalchemy import UniqueConstraint, ForeignKey
+from sqlalchemy import UniqueConstraint, ForeignKey, Index
+from sqlalchemy import event, inspect, select, update, text, bindparam
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 from sqlalchemy import create_engine
@@ -22,20 +25,39 @@ from sqlalchemy.orm import aliased
 Base = declarative_base()
 
 
+def qualkey(quals):
+    '''
+    Return the canonical key for a set of qualifiers.
+
+    The quals may be a :-separated string or a sequence of strings or
+    Qual objects.  The key is the sorted, unique, non-empty quals
+    joined by ":" with the empty string for no quals.
+    '''
+    if not quals:
+        return ''
+    if isinstance(quals, str):
+        quals = quals.split(":")
+    return ':'.join(sorted(set([str(q) for q in quals if q and str(q)])))
+
+
 ProductManifest = Table(
     "product_manifest", Base.metadata,
     Column('product_id', ForeignKey('product.id'), primary_key=True),
-    Column('manifest_id', ForeignKey('manifest.id'), primary_key=True))
+    Column('manifest_id', ForeignKey('manifest.id'), primary_key=True),
+    # the PK serves product->manifests, this serves manifest->products
+    Index('ix_product_manifest_manifest_product', 'manifest_id', 'product_id'))
 
 ProductQual = Table(
     "product_qual", Base.metadata,
     Column('product_id', ForeignKey('product.id'), primary_key=True),
-    Column('qual_id', ForeignKey('qual.id'), primary_key=True))
+    Column('qual_id', ForeignKey('qual.id'), primary_key=True),
+    Index('ix_product_qual_qual_product', 'qual_id', 'product_id'))
 
 ManifestQual = Table(
     "manifest_qual", Base.metadata,
     Column('manifest_id', ForeignKey('manifest.id'), primary_key=True),
-    Column('qual_id', ForeignKey('qual.id'), primary_key=True))
+    Column('qual_id', ForeignKey('qual.id'), primary_key=True),
+    Index('ix_manifest_qual_qual_manifest', 'qual_id', 'manifest_id'))
 
 ProductDependency = Table(
     "product_dependency", Base.metadata,
@@ -45,6 +67,7 @@ ProductDependency = Table(
     # "child"
     Column("provide_id", ForeignKey("product.id")),
     UniqueConstraint('require_id', 'provide_id', name='uniquedep'),
+    Index('ix_product_dependency_provide', 'provide_id'),
 )
 
 
@@ -85,14 +108,19 @@ class Product(Base):
     __tablename__ = 'product'
     id = Column(Integer, primary_key=True)
 
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
 
     # must NOT be a vunder
-    version = Column(String)
+    version = Column(String, index=True)
 
     filename = Column(String, unique=True)
 
-    flavor_id = Column(Integer, ForeignKey('flavor.id'), nullable=False)
+    flavor_id = Column(Integer, ForeignKey('flavor.id'), nullable=False, index=True)
+
+    # canonical qualkey() of quals, kept in sync by coups.inserts
+    qualkey = Column(String, index=True)
+
+    __table_args__ = (Index('ix_product_name_qualkey', 'name', 'qualkey'),)
 
     manifests = relationship("Manifest",
                              secondary=lambda: ProductManifest,
@@ -135,14 +163,25 @@ class Manifest(Base):
 
     id = Column(Integer, primary_key=True)
 
-    name = Column(String, nullable=False)
+    name = Column(String, nullable=False, index=True)
 
     # must NOT be a vunder
-    version = Column(String)
+    version = Column(String, index=True)
 
     filename = Column(String, unique=True)
 
-    flavor_id = Column(Integer, ForeignKey('flavor.id'))
+    flavor_id = Column(Integer, ForeignKey('flavor.id'), index=True)
+
+    # canonical qualkey() of quals, kept in sync by coups.inserts
+    qualkey = Column(String, index=True)
+
+    # digest() of the text the products were loaded from, see ManifestBody
+    digest = Column(String, index=True)
+
+    # when the text was last fetched
+    fetched = Column(DateTime)
+
+    __table_args__ = (Index('ix_manifest_name_qualkey', 'name', 'qualkey'),)
 
     def __repr__(self):
         quals = ":".join([str(q) for q in self.quals])
@@ -156,27 +195,328 @@ class Manifest(Base):
         return 'v' + self.vunder.replace(".", "_")
 
 
-def engine(url):
+class ManifestBody(Base):
+    '''
+    Raw manifest text stored by its digest().
+
+    Manifests with identical text share one row.
+    '''
+    __tablename__ = 'manifest_body'
+
+    digest = Column(String, primary_key=True)
+    text = Column(String, nullable=False)
+
+    def __repr__(self):
+        return f'<ManifestBody({self.digest})>'
+
+
+def digest(text):
+    '''
+    Return the content address of manifest text.
+    '''
+    if isinstance(text, str):
+        text = text.encode()
+    return hashlib.sha256(text).hexdigest()
+
+
+class ManifestOverlap(Base):
+    '''
+    Materialized product set overlap of a pair of manifests.
+
+    A pair is kept once, with manifest_a < manifest_b, if either of the
+    two supplies few enough products the other lacks.  A row pairing
+    a manifest with itself marks that its overlaps are materialized.
+    See coups.overlap.
+    '''
+    __tablename__ = 'manifest_overlap'
+
+    manifest_a = Column(Integer, ForeignKey('manifest.id'), primary_key=True)
+    manifest_b = Column(Integer, ForeignKey('manifest.id'), primary_key=True)
+
+    # cardinality of a-b, a∩b and b-a
+    only_a = Column(Integer, nullable=False)
+    both = Column(Integer, nullable=False)
+    only_b = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_manifest_overlap_subset', 'manifest_a', 'only_b'),
+        Index('ix_manifest_overlap_subset_b', 'manifest_b', 'only_a'),
+    )
+
+    def __repr__(self):
+        return f'<ManifestOverlap({self.manifest_a},{self.manifest_b},{self.only_a},{self.both},{self.only_b})>'
+
+
+class CrawlState(Base):
+    '''
+    What the last crawl of one bundle or package saw on scisoft.
+
+    See coups.crawl.Walk.
+    '''
+    __tablename__ = 'crawl_state'
+
+    id = Column(Integer, primary_key=True)
+
+    # "bundle" or "package"
+    kind = Column(String, nullable=False)
+
+    name = Column(String, nullable=False)
+
+    # comma-separated versions whose listings have been fully seen
+    versions = Column(String, default='')
+
+    # digest of the version index
+    fingerprint = Column(String)
+
+    # when the crawl last completed
+    checked = Column(DateTime)
+
+    # when a crawl which has not completed last journaled its progress
+    pending = Column(DateTime)
+
+    __table_args__ = (UniqueConstraint('kind', 'name', name='uniquecrawl'),)
+
+    @property
+    def seen(self):
+        return set([v for v in (self.versions or '').split(",") if v])
+
+    @property
+    def walk_seen(self):
+        '''
+        The seen versions to give a crawl.Walk, None for a classic walk.
+
+        A walk is incremental once a crawl over all versions completed
+        having fully seen some versions, which bound the walk.  It is
+        also incremental to backfill an interrupted first crawl so that
+        what the interrupted crawl committed does not end the walk.
+        '''
+        if self.backfill or (self.checked and self.seen):
+            return self.seen
+        return None
+
+    @property
+    def backfill(self):
+        '''
+        True if a crawl.Walk should go past the oldest seen version.
+
+        This is so when resuming a crawl which never completed.
+        '''
+        return bool(self.pending and not self.checked)
+
+    def __repr__(self):
+        return f'<CrawlState({self.kind},{self.name},{self.fingerprint},{self.checked})>'
+
+
+class ExtraPlatform(Base):
+    '''
+    A platform added to those built in to coups.platform.
+    '''
+    __tablename__ = 'extra_platform'
+
+    id = Column(Integer, primary_key=True)
+
+    flavor = Column(String, nullable=False, unique=True)
+
+    cpu = Column(String, default='')
+
+    # space-separated OS quals, the first is used in file names
+    oses = Column(String, default='')
+
+    @property
+    def platform(self):
+        from coups.platform import Platform
+        return Platform(self.flavor, self.cpu or "", tuple((self.oses or '').split()))
+
+    def __repr__(self):
+        return f'<ExtraPlatform({self.flavor},{self.cpu},{self.oses})>'
+
+
+# Named sets of SQLite pragmas applied to every new connection.
+pragma_profiles = dict(
+    # Good for large on-disk DBs: write-ahead log, fewer fsyncs, a
+    # 64 MiB page cache and 256 MiB of memory mapped I/O.
+    default = dict(journal_mode="WAL", synchronous="NORMAL",
+                   cache_size=-65536, mmap_size=268435456,
+                   temp_store="MEMORY"),
+    # As default but give up durability for speed of large loads.
+    bulk = dict(journal_mode="WAL", synchronous="OFF",
+                cache_size=-262144, mmap_size=1073741824,
+                temp_store="MEMORY"),
+    # SQLite's own conservative defaults.
+    safe = dict(journal_mode="DELETE", synchronous="FULL"),
+    none = dict(),
+)
+
+def pragmas(profile=None):
+    '''
+    Return dict of SQLite pragmas for a profile.
+
+    The profile may be a dict or a string holding a comma-separated
+    list of profile names and key=value pairs applied in order, eg
+    "default,cache_size=-131072".  If None, COUPS_PRAGMAS or "default"
+    is used.
+    '''
+    if isinstance(profile, dict):
+        return dict(profile)
+    if profile is None:
+        profile = os.environ.get("COUPS_PRAGMAS", "default")
+    ret = dict()
+    for one in profile.split(","):
+        one = one.strip()
+        if not one:
+            continue
+        if "=" in one:
+            key, val = [x.strip() for x in one.split("=", 1)]
+            ret[key] = val
+            continue
+        try:
+            ret.update(pragma_profiles[one])
+        except KeyError:
+            raise ValueError(f'unknown pragma profile: {one}')
+    return ret
+
+def engine(url, profile=None):
     'Get db engine'
     if url is None:
         raise ValueError("no db url given")
     if ":" not in url:          # a file
         url = "sqlite:///"+url
-    return create_engine(url, echo=False)    
+    eng = create_engine(url, echo=False)
+    if eng.dialect.name != "sqlite":
+        return eng
+    prags = pragmas(profile)
+
+    @event.listens_for(eng, "connect")
+    def apply_pragmas(dbapi_con, con_record):
+        cur = dbapi_con.cursor()
+        for key, val in prags.items():
+            cur.execute(f'PRAGMA {key}={val}')
+        cur.close()
+
+    return eng
+
+def backfill_qualkeys(con):
+    '''
+    Set the qualkey of any product or manifest lacking one.
+
+    Return number of rows updated.
+    '''
+    count = 0
+    for Type, Link in [(Product, ProductQual), (Manifest, ManifestQual)]:
+        table = Type.__table__
+        fkey = Link.c[f'{table.name}_id']
+        need = [r[0] for r in con.execute(
+            select(table.c.id).where(table.c.qualkey.is_(None)))]
+        if not need:
+            continue
+        quals = {rid:list() for rid in need}
+        got = con.execute(select(fkey, Qual.__table__.c.name)
+                          .join(Qual.__table__, Qual.__table__.c.id == Link.c.qual_id)
+                          .where(table.c.qualkey.is_(None))
+                          .where(fkey == table.c.id))
+        for rid, qname in got:
+            quals[rid].append(qname)
+        con.execute(update(table).where(table.c.id == bindparam('rid')),
+                    [dict(rid=rid, qualkey=qualkey(qs)) for rid, qs in quals.items()])
+        count += len(need)
+    return count
+
+# Stored in the DB as "PRAGMA user_version".  Bump this when the schema
+# changes so that upgrade() runs again on existing DBs.
+schema_version = 3
+
+def get_schema_version(eng):
+    with eng.connect() as con:
+        return con.execute(text("PRAGMA user_version")).scalar()
+
+def set_schema_version(eng, version=schema_version):
+    with eng.begin() as con:
+        con.execute(text(f'PRAGMA user_version={int(version)}'))
+
+def upgrade(eng, force=False):
+    '''
+    Bring an existing DB up to the current schema.
 
-def init(url):
+    Missing tables, columns and indexes are created and derived
+    columns are back filled.  This is skipped if the DB already has
+    the current schema version, unless forced.
+    '''
+    old = get_schema_version(eng)
+    if not force and old >= schema_version:
+        return
+    Base.metadata.create_all(eng)
+    with eng.begin() as con:
+        insp = inspect(con)
+        for table in Base.metadata.sorted_tables:
+            have = set([c['name'] for c in insp.get_columns(table.name)])
+            for col in table.columns:
+                if col.name in have:
+                    continue
+                ctype = col.type.compile(eng.dialect)
+                con.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {col.name} {ctype}'))
+            for index in table.indexes:
+                index.create(con, checkfirst=True)
+        backfill_qualkeys(con)
+        if old < 3:
+            # overlaps were kept for both orders of every sharing pair
+            con.execute(text('DROP INDEX IF EXISTS ix_manifest_overlap_b'))
+            con.execute(text('DELETE FROM manifest_overlap'))
+    set_schema_version(eng)
+
+def init(url, profile=None):
     'Initialize coups db'
-    Base.metadata.create_all(engine(url))
+    eng = engine(url, profile)
+    Base.metadata.create_all(eng)
+    upgrade(eng)
 
-def session(dbname="coups.db", force=False):
+def session(dbname="coups.db", force=False, profile=None):
     '''
     Return a DB session
+
+    The profile selects SQLite pragmas, see pragmas().
     '''
     if not dbname:
         raise ValueError("no db name given");
-    if force or not os.path.exists(dbname):
-        init(dbname)
+    eng = engine(dbname, profile)
+    new = not os.path.exists(dbname)
+    if force or new:
+        Base.metadata.create_all(eng)
+    if new:
+        set_schema_version(eng)
     if os.stat(dbname).st_size == 0:
         raise ValueError("db is not initialized")
-    Session = sessionmaker(bind=engine(dbname))
+    upgrade(eng)
+    Session = sessionmaker(bind=eng)
     return Session()
+
+
+class TooManyStatements(RuntimeError):
+    '''
+    Raised by statements() when a block executes too much SQL.
+    '''
+    pass
+
+
+@contextmanager
+def statements(ses, most=None):
+    '''
+    Context in which the SQL statements executed through the session
+    are collected into the yielded list.
+
+    If most is given, raise TooManyStatements on exit if more than
+    that number were executed.  This guards against lazy loads per
+    row creeping back into listing code.
+    '''
+    eng = ses.get_bind()
+    seen = list()
+
+    def collect(con, cursor, statement, parameters, context, executemany):
+        seen.append(statement)
+
+    event.listen(eng, "before_cursor_execute", collect)
+    try:
+        yield seen
+    finally:
+        event.remove(eng, "before_cursor_execute", collect)
+    if most is not None and len(seen) > most:
+        raise TooManyStatements(f'{len(seen)} SQL statements, expected at most {most}')
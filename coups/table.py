@@ -7,6 +7,7 @@ Handle UPS table (and version) file
 # This file is part of coups which is free software distributed under
 # the terms of the GNU Affero General Public License.
 
+import re
 import json
 from coups.util import vunderify, versionify
 import pyparsing as pp
@@ -118,6 +119,285 @@ ChainFile = FILE + PRODUCT + CHAIN + pp.ZeroOrMore(ChainBlock_).set_results_name
 
 
 
+# A line-oriented parser giving the same as_dict() data as the
+# TableFile, VersionFile and ChainFile grammars above.  It handles the
+# common, well formed files and gives up (returns None) on anything
+# else so the grammar, which stays the reference, may have its say.
+
+_ident = r'[A-Za-z][A-Za-z0-9_]*'
+_quoted = r'"([^"\\\r\n]*)"'
+_tail = r'[ \t\r]*(?:#.*)?'
+_kv_re = re.compile(r'[ \t]*(' + _ident + r')[ \t]*=[ \t\r]*(.*)')
+_value_re = re.compile(r'(?:(' + _ident + r')|' + _quoted + r')' + _tail)
+_vunder_re = re.compile(r'(v[A-Za-z0-9_]*)' + _tail)
+_quals_re = re.compile(r'(?:' + _quoted + r'|([A-Za-z][A-Za-z0-9_:]*))?' + _tail)
+_label_re = re.compile(r'[ \t]*(group|common|end):' + _tail, re.IGNORECASE)
+_command_re = re.compile(r'[ \t]*(?:(' + _ident + r')|' + _quoted + r')[ \t]*\(')
+
+
+class _Miss(Exception):
+    '''
+    Raised internally when the line parser gives up.
+    '''
+    pass
+
+
+class _Lines:
+    '''
+    The significant lines of a file, with a cursor.
+
+    The grammar appends any comment lines which follow a rest-of-line
+    value to that value.  The trailer maps the index of a line to the
+    text through the last of the comment lines following it.
+    '''
+    def __init__(self, text):
+        # as pyparsing does by default
+        text = text.expandtabs()
+        self.lines = list()
+        self.trailer = dict()
+        skipped = list()
+        for line in text.split("\n"):
+            if not line.strip(" \t\r"):
+                skipped.append(line)
+                continue
+            if line.lstrip(" \t\r").startswith("#"):
+                skipped.append(line)
+                if self.lines:
+                    self.trailer[len(self.lines) - 1] = "\n" + "\n".join(skipped)
+                continue
+            skipped = list()
+            self.lines.append(line)
+        self.ind = 0
+
+    def peek(self):
+        if self.ind < len(self.lines):
+            return self.lines[self.ind]
+        return None
+
+    def next(self):
+        line = self.peek()
+        if line is None:
+            raise _Miss()
+        self.ind += 1
+        return line
+
+    def setting(self):
+        '''
+        Return (lower case key, key, rest) of next line, or None if it
+        is not a "key = ..." line.
+        '''
+        line = self.peek()
+        if line is None:
+            return None
+        got = _kv_re.fullmatch(line)
+        if not got:
+            return None
+        return got[1].lower(), got[1], got[2]
+
+    def rest(self, got):
+        '''
+        Consume the setting line giving got, return its rest-of-line
+        value as the grammar gives it.
+        '''
+        val = got[2]
+        if val.startswith("#"):
+            raise _Miss()
+        if val:
+            val += self.trailer.get(self.ind, "")
+        self.next()
+        return val
+
+    def key(self):
+        '''
+        Return lower case key of next line or None if not a setting.
+        '''
+        got = self.setting()
+        return got[0] if got else None
+
+    def label(self):
+        '''
+        Return lower case "group", "common" or "end" if next line is
+        such a label, else None.
+        '''
+        line = self.peek()
+        if line is None:
+            return None
+        got = _label_re.fullmatch(line)
+        return got[1].lower() if got else None
+
+    def field(self, key, pattern=None):
+        '''
+        Consume a "key = ..." line, return the value matched by the
+        pattern or the rest of the line if no pattern.
+        '''
+        got = self.setting()
+        if not got or got[0] != key:
+            raise _Miss()
+        if pattern is None:
+            return self.rest(got)
+        self.next()
+        val = pattern.fullmatch(got[2])
+        if not val:
+            raise _Miss()
+        return next((g for g in val.groups() if g is not None), "")
+
+    def action(self):
+        '''
+        Return the name if next line is an ACTION line, else None.
+        '''
+        got = self.setting()
+        if not got or got[0] != "action":
+            return None
+        val = _value_re.fullmatch(got[2])
+        if not val or val[1] is None:
+            return None
+        return val[1]
+
+    def command(self):
+        '''
+        Return (command, argstr) if next line is a command, else None.
+        '''
+        line = self.peek()
+        if line is None:
+            return None
+        got = _command_re.match(line)
+        if not got:
+            return None
+        rest = line[got.end():].rstrip(" \t\r")
+        if not rest.endswith(")") or "#" in line:
+            raise _Miss()
+        cmd = got[1] if got[1] is not None else got[2]
+        return cmd, rest[:-1].lstrip(" \t\r")
+
+
+def _settings(lines):
+    ret = list()
+    while True:
+        got = lines.setting()
+        if not got or got[0] == "flavor" or lines.action() is not None:
+            return ret
+        ret.append(dict(key=got[1], val=lines.rest(got)))
+
+
+def _actionblocks(lines):
+    ret = list()
+    while True:
+        name = lines.action()
+        if name is None:
+            break
+        lines.next()
+        cmds = list()
+        while True:
+            got = lines.command()
+            if got is None:
+                break
+            lines.next()
+            cmds.append(dict(command=got[0], argstr=got[1]))
+        ret.append(dict(action=name, commands=cmds))
+    if not ret:
+        raise _Miss()
+    return ret
+
+
+def _flavorblock(lines):
+    ret = dict(flavor=lines.field("flavor"),
+               qualifiers=lines.field("qualifiers", _quals_re))
+    settings = _settings(lines)
+    if settings:
+        ret["settings"] = settings
+    if lines.action() is not None:
+        ret["actionblocks"] = _actionblocks(lines)
+    return ret
+
+
+def _header(lines):
+    return dict(file=lines.field("file", _value_re),
+                product=lines.field("product", _value_re))
+
+
+def _table(lines):
+    ret = _header(lines)
+    if lines.key() == "version":
+        ret["vunder"] = lines.field("version", _vunder_re)
+    if lines.label() == "group":
+        lines.next()
+        fbs = list()
+        while lines.key() == "flavor":
+            fbs.append(_flavorblock(lines))
+        ret["flavorblocks"] = fbs
+        if lines.label() != "common":
+            raise _Miss()
+        lines.next()
+        ret["actionblocks"] = _actionblocks(lines)
+        if lines.label() != "end":
+            raise _Miss()
+        lines.next()
+        # as for the grammar, anything past "End:" is ignored
+        lines.ind = len(lines.lines)
+    else:
+        ret["flavorblock"] = _flavorblock(lines)
+    return ret
+
+
+def _blocks(lines, chain):
+    ret = list()
+    while lines.peek() is not None:
+        blk = dict(flavor=lines.field("flavor"))
+        if chain:
+            blk["vunder"] = lines.field("version", _vunder_re)
+        blk["qualifiers"] = lines.field("qualifiers", _quals_re)
+        blk["settings"] = _settings(lines)
+        if not blk["settings"]:
+            raise _Miss()
+        ret.append(blk)
+    return ret
+
+
+def _version(lines):
+    ret = _header(lines)
+    ret["vunder"] = lines.field("version", _vunder_re)
+    ret["versionblocks"] = _blocks(lines, False)
+    return ret
+
+
+def _chain(lines):
+    ret = _header(lines)
+    ret["chain"] = lines.field("chain", _value_re)
+    ret["chainblocks"] = _blocks(lines, True)
+    return ret
+
+
+def fast_parse(text, kind):
+    '''
+    Return as_dict() data of a "table", "version" or "chain" file
+    text or None if the line parser can not handle it.
+    '''
+    if text.lstrip().startswith("#"):
+        return None             # the grammar allows no leading comment
+    lines = _Lines(text)
+    try:
+        ret = dict(table=_table, version=_version, chain=_chain)[kind](lines)
+    except _Miss:
+        return None
+    if lines.peek() is not None:
+        return None
+    return ret
+
+
+_grammars = dict(table=TableFile, version=VersionFile, chain=ChainFile)
+
+def parse_file(text, kind):
+    '''
+    Return as_dict() data of a "table", "version" or "chain" file text.
+
+    The line parser is tried first and the grammar if it gives up.
+    '''
+    ret = fast_parse(text, kind)
+    if ret is None:
+        ret = _grammars[kind].parse_string(text).as_dict()
+    return ret
+
+
 def simplify(tdat, version, flavor, quals):
     '''
     Return a subset of tdat based on version, flavor and quals.
@@ -192,7 +472,7 @@ def parse(text, prod=None):
     If prod is given, a single/old format is returned possibly by
     narrowing if multi/new is found.
     '''
-    tdat = TableFile.parse_string(text).as_dict()
+    tdat = parse_file(text, "table")
     if not prod:
         return tdat
     return simplify(tdat, prod.version, prod.flavor, prod.quals)
@@ -17,6 +17,7 @@ from collections import defaultdict
 from coups.product import make as make_product
 from coups.util import vunderify, versionify
 import coups.table
+import coups.upscache
 
 from coups.quals import dashed as dashed_quals
 import networkx as nx
@@ -53,6 +54,16 @@ def resolve(name, paths=None):
     return ret
 
 
+def parse_file(path, kind):
+    '''
+    Return the parsed data of a UPS "chain", "version" or "table" file.
+
+    Results are kept in coups.upscache.
+    '''
+    return coups.upscache.load(path, kind,
+                               lambda text: coups.table.parse_file(text, kind))
+
+
 def setting(settings, key):
     '''
     Return all values in settings block matching the key
@@ -91,7 +102,7 @@ class ChainFile:
         ret = None
         for one in files:
             print(f'parsing chain file: {one}')
-            cdat = coups.table.ChainFile.parse_string(one.open().read()).as_dict()
+            cdat = parse_file(one, "chain")
             if not ret:
                 ret = cdat
                 continue
@@ -159,7 +170,7 @@ class VersionFile:
 
         ret = None
         for one in files:
-            vdat = coups.table.VersionFile.parse_string(one.open().read()).as_dict()
+            vdat = parse_file(one, "version")
             if not ret:
                 ret = vdat
                 continue
@@ -292,7 +303,7 @@ class TableFileMultiFlavor:
             raise ValueError(f"no table file for {name} version {version}")
 
         try:
-            self.dat = coups.table.TableFile.parse_string(found.open().read()).as_dict()
+            self.dat = parse_file(found, "table")
         except coups.table.ParseException:
             sys.stderr.write(f'failed to parse {found}\n')
             raise
@@ -382,12 +393,13 @@ def _find_product_version(pdir, version):
     for vfile in vfiles:
         if not vfile.exists():
             continue
-        lines = list(vfile.open().readlines())
         try:
-            vobjs = coups.table.read_version(list(lines))
+            vobjs = coups.upscache.load(
+                vfile, "read_version",
+                lambda text: coups.table.read_version(text.splitlines(True)))
         except coups.table.ParseException as err:
             print (vfile)
-            print (''.join(lines))
+            print (vfile.open().read())
             raise
         ret.append((vfile, vobjs))
     return ret
@@ -663,7 +675,7 @@ def table_in_tar(filename):
         sys.stderr.write(f'Warning, multiple version files in {filename}')
     
     for vpath, vtext in version_files.items():
-        vdat = coups.table.VersionFile.parse_string(vtext).as_dict()
+        vdat = coups.table.parse_file(vtext, "version")
         for fb in vdat["versionblocks"]:
             f = fb['flavor']
             if f.endswith("_"):
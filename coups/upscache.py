@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+'''
+Persistent cache of parsed UPS chain, version and table files.
+
+UPS files usually live on slow network file systems (eg /cvmfs).  The
+parsed data of each file is kept as JSON in a sidecar SQLite DB keyed
+by the file's absolute path and the kind of parse.  An entry is used
+only while the file's size, mtime and inode are as they were when it
+was parsed, else the file is parsed again.  All entries are dropped
+when the DB was filled by a different parser_version.  When the cached
+data exceeds max_bytes the least recently used entries are dropped.
+
+The DB is "ups.db" in the coups cache directory (see coups.webcache).
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from pathlib import Path
+
+default_max_bytes = 64*1024*1024
+
+# Bump when coups.table or coups.ups change the data they cache.
+parser_version = 1
+
+settings = dict(path=None, max_bytes=default_max_bytes, enabled=True)
+
+stats = dict(hits=0, misses=0, evicted=0)
+
+_schema = '''
+create table if not exists parsed (
+    path text not null,
+    kind text not null,
+    size integer not null,
+    mtime integer not null,
+    inode integer not null,
+    nbytes integer not null,
+    used real not null,
+    data text not null,
+    primary key (path, kind))
+'''
+
+_lock = threading.Lock()
+_con = None
+_con_path = None
+
+
+def configure(**kwds):
+    '''
+    Update cache settings: path (of the DB), max_bytes, enabled.
+    '''
+    unknown = set(kwds).difference(settings)
+    if unknown:
+        raise ValueError(f'unknown cache settings: {", ".join(sorted(unknown))}')
+    settings.update(kwds)
+
+
+def db_path():
+    '''
+    Return the path of the cache DB.
+    '''
+    if settings["path"]:
+        return Path(settings["path"])
+    from coups.webcache import directory
+    return directory() / "ups.db"
+
+
+def _connect():
+    '''
+    Return connection to the cache DB, making it as needed.
+    '''
+    global _con, _con_path
+    path = db_path()
+    if _con is not None and _con_path == path:
+        return _con
+    if _con is not None:
+        _con.close()
+        _con = None
+    path.parent.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(str(path), timeout=30, check_same_thread=False)
+    con.execute("pragma journal_mode=wal")
+    con.execute("pragma synchronous=normal")
+    con.execute(_schema)
+    con.execute("create index if not exists parsed_used on parsed (used)")
+    if con.execute("pragma user_version").fetchone()[0] != parser_version:
+        con.execute("delete from parsed")
+        con.execute(f"pragma user_version = {parser_version:d}")
+    con.commit()
+    _con, _con_path = con, path
+    return con
+
+
+def _evict(con, max_bytes):
+    total = con.execute("select coalesce(sum(nbytes), 0) from parsed").fetchone()[0]
+    if total <= max_bytes:
+        return
+    drop = list()
+    for rowid, nbytes in con.execute("select rowid, nbytes from parsed order by used"):
+        if total <= max_bytes:
+            break
+        drop.append((rowid,))
+        total -= nbytes
+    con.executemany("delete from parsed where rowid = ?", drop)
+    stats["evicted"] += len(drop)
+
+
+def load(path, kind, parser):
+    '''
+    Return the parsed data of the file at path.
+
+    The parser is called on the file text when the cache has no
+    current entry for the path and kind.  Each call returns a new
+    object so callers may modify it.
+    '''
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (st.st_size, st.st_mtime_ns, st.st_ino)
+    if not settings["enabled"]:
+        return parser(Path(path).read_text())
+
+    with _lock:
+        try:
+            con = _connect()
+            row = con.execute(
+                "select size, mtime, inode, data from parsed where path = ? and kind = ?",
+                (path, kind)).fetchone()
+            if row and tuple(row[:3]) == key:
+                con.execute("update parsed set used = ? where path = ? and kind = ?",
+                            (time.time(), path, kind))
+                con.commit()
+                stats["hits"] += 1
+                return json.loads(row[3])
+        except sqlite3.Error as err:
+            sys.stderr.write(f'warning: UPS cache {db_path()}: {err}\n')
+            return parser(Path(path).read_text())
+
+    stats["misses"] += 1
+    dat = parser(Path(path).read_text())
+    data = json.dumps(dat)
+
+    with _lock:
+        try:
+            con = _connect()
+            con.execute("insert or replace into parsed values (?,?,?,?,?,?,?,?)",
+                        (path, kind) + key + (len(data), time.time(), data))
+            _evict(con, settings["max_bytes"])
+            con.commit()
+        except sqlite3.Error as err:
+            sys.stderr.write(f'warning: UPS cache {db_path()}: {err}\n')
+    return json.loads(data)
+
+
+def info():
+    '''
+    Return (number of entries, bytes of data) in the cache.
+    '''
+    if not db_path().exists():
+        return (0, 0)
+    with _lock:
+        return tuple(_connect().execute(
+            "select count(*), coalesce(sum(nbytes), 0) from parsed").fetchone())
+
+
+def clear():
+    '''
+    Remove all cached entries, return number removed.
+    '''
+    if not db_path().exists():
+        return 0
+    with _lock:
+        con = _connect()
+        count = con.execute("delete from parsed").rowcount
+        con.commit()
+        return count
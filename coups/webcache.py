@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+'''
+On-disk cache of parsed scisoft index pages.
+
+Each entry holds the URLs listed by one index page along with the
+ETag and Last-Modified validators of the response that produced them.
+An entry younger than the TTL is used as-is.  An older one is
+revalidated with a conditional GET so an unchanged page costs a 304
+and no parsing.  In offline mode only the cache is consulted.
+
+The cache directory is taken from COUPS_CACHE, else it is "coups"
+under XDG_CACHE_HOME or ~/.cache.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+
+default_ttl = 3600
+
+settings = dict(directory=None, ttl=default_ttl, offline=False, enabled=True)
+
+
+def configure(**kwds):
+    '''
+    Update cache settings: directory, ttl (seconds), offline, enabled.
+    '''
+    unknown = set(kwds).difference(settings)
+    if unknown:
+        raise ValueError(f'unknown cache settings: {", ".join(sorted(unknown))}')
+    settings.update(kwds)
+
+
+def directory():
+    '''
+    Return the cache directory as a Path.
+    '''
+    if settings["directory"]:
+        return Path(settings["directory"])
+    env = os.environ.get("COUPS_CACHE")
+    if env:
+        return Path(env)
+    xdg = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return Path(xdg) / "coups"
+
+
+def entry_path(url):
+    '''
+    Return path of the cache entry file for url.
+    '''
+    key = hashlib.sha1(url.encode()).hexdigest()
+    return directory() / "listings" / key[:2] / (key + ".json")
+
+
+def load(url):
+    '''
+    Return cache entry dict for url or None.
+    '''
+    path = entry_path(url)
+    try:
+        with path.open() as fp:
+            entry = json.load(fp)
+    except (OSError, ValueError):
+        return None
+    if entry.get("url") != url:
+        return None
+    return entry
+
+
+def save(url, hrefs, etag=None, last_modified=None):
+    '''
+    Store hrefs listed at url along with response validators.
+    '''
+    entry = dict(url=url, hrefs=list(hrefs), etag=etag,
+                 last_modified=last_modified, checked=time.time())
+    path = entry_path(url)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f'.{os.getpid()}.{id(entry)}.tmp')
+    with tmp.open("w") as fp:
+        json.dump(entry, fp)
+    os.replace(tmp, path)
+    return entry
+
+
+def touch(url, entry):
+    '''
+    Mark an entry as revalidated now.
+    '''
+    return save(url, entry["hrefs"], entry.get("etag"), entry.get("last_modified"))
+
+
+def fresh(entry, now=None):
+    '''
+    Return true if entry may be used without revalidation.
+    '''
+    if entry is None:
+        return False
+    if settings["offline"]:
+        return True
+    now = now or time.time()
+    return now - entry.get("checked", 0) < settings["ttl"]
+
+
+def validators(entry):
+    '''
+    Return request headers to revalidate entry.
+    '''
+    headers = dict()
+    if not entry:
+        return headers
+    if entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        headers["If-Modified-Since"] = entry["last_modified"]
+    return headers
+
+
+def clear():
+    '''
+    Remove all cached listings, return number removed.
+    '''
+    count = 0
+    top = directory() / "listings"
+    if not top.exists():
+        return count
+    for path in top.glob("*/*.json"):
+        path.unlink()
+        count += 1
+    return count
@@ -13,7 +13,7 @@ setuptools.setup(
     description="Containers of UPS Products",
     url="https://brettviren.github.io/coups",
     packages=setuptools.find_packages(),
-    python_requires='>=3.5',    # use of typing probably drive this
+    python_requires='>=3.9',    # functools.cache, Executor.shutdown(cancel_futures)
     install_requires=[
         "click",
         "networkx",
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+'''
+Benchmark crawling and downloading against a local scisoft stand-in.
+
+    python test/bench_crawl.py [latency] [bandwidth] [bundles] [versions] [jobs]
+
+A synthetic tree (see scisoft_standin.py) of bundles x versions x 2
+manifests is served with latency seconds per response (default 0.02)
+and bandwidth bytes/second per response (default 0 for no limit).
+Then load-package, load-bundle and get-products are run in turn with
+the given number of jobs (default 4) and for each the rate of
+requests, bytes and new DB rows is reported.  The index page cache is
+in a scratch directory so every run starts cold.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(__file__))
+from click.testing import CliRunner
+from coups.__main__ import cli
+from scisoft_standin import Standin, synthetic_tree
+
+
+def count_rows(db):
+    '''
+    Return the total number of rows over all tables of a DB.
+    '''
+    if not os.path.exists(db):
+        return 0
+    con = sqlite3.connect(db)
+    names = [r[0] for r in con.execute(
+        "select name from sqlite_master where type='table'")]
+    total = sum([con.execute(f'select count(*) from "{n}"').fetchone()[0]
+                 for n in names])
+    con.close()
+    return total
+
+
+def phase(server, db, label, args):
+    server.stats.clear()
+    rows0 = count_rows(db)
+    t0 = time.perf_counter()
+    res = CliRunner().invoke(cli, ["-s", db, "--url", server.url] + args)
+    dt = time.perf_counter() - t0
+    if res.exit_code != 0:
+        sys.stderr.write(res.output)
+        raise SystemExit(f'{label} failed')
+    rows = count_rows(db) - rows0
+    st = server.stats
+    print(f'{label:28s} {dt:7.2f} s  {st.requests:5d} req {st.requests/dt:8.1f} req/s  '
+          f'{st.nbytes/dt/1e6:7.2f} MB/s  {rows:6d} rows {rows/dt:9.1f} rows/s')
+
+
+def main(latency=0.02, bandwidth=0, bundles=3, versions=10, jobs=4):
+    latency, bandwidth = float(latency), float(bandwidth) or None
+    jobs = str(jobs)
+    tmp = tempfile.mkdtemp(prefix="coups-bench-")
+    os.environ["COUPS_CACHE"] = os.path.join(tmp, "cache")
+    top = Path(tmp) / "scisoft"
+    items = synthetic_tree(top, int(bundles), int(versions))
+    print(f'{len(items)} manifests, latency {latency} s, '
+          f'bandwidth {bandwidth or "unlimited"} B/s, {jobs} jobs')
+    db = os.path.join(tmp, "bench.db")
+    with Standin(top, latency, bandwidth) as server:
+        for name in ("pkg000", "pkg001", "pkg002"):
+            phase(server, db, f'load-package {name}', ["load-package", "-j", jobs, name])
+        for name in sorted(set([m.name for m, _ in items])):
+            phase(server, db, f'load-bundle {name}', ["load-bundle", "-j", jobs, name])
+        mtp, ptps = items[-1]
+        ptp = ptps[0]
+        phase(server, db, f'get-products {ptp.name}',
+              ["get-products", "-j", jobs, "-o", os.path.join(tmp, "products"),
+               "-v", ptp.version, ptp.name])
+
+
+if '__main__' == __name__:
+    main(*sys.argv[1:])
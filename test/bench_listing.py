@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+'''
+Benchmark parsing of scisoft index pages.
+
+    python test/bench_listing.py [nrows] [page.html ...]
+
+Times the streaming coups.scisoft.parse_table() against the
+BeautifulSoup soup_table() on the pages in test/listings/ and on a
+packages index of nrows rows (default 20000) made from them.  The
+pages in test/listings/ are hand-made in the layout of scisoft index
+pages, not captures of real ones, so timings on them only estimate
+those on scisoft.  Pages saved from scisoft may be given to check.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import sys
+import time
+from pathlib import Path
+from coups.scisoft import parse_table, soup_table
+
+url = "https://scisoft.fnal.gov/scisoft/packages/"
+
+
+def packages_page(nrows):
+    '''
+    Return HTML text like the packages index with nrows rows.
+    '''
+    head = Path(__file__).parent / "listings" / "bundles.html"
+    text = head.read_text()
+    top, rest = text.split("<tbody>", 1)
+    bot = rest.split("</tbody>", 1)[1]
+    rows = [f'<tr><td class="name"><a href="pkg{n:05d}/">pkg{n:05d}/</a></td>'
+            f'<td>2021-10-05 12:01</td><td>-</td></tr>' for n in range(nrows)]
+    return top + "<tbody>\n" + "\n".join(rows) + "\n</tbody>" + bot
+
+
+def timeit(func, html, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        got = func(html, url)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, got
+
+
+def main(nrows=20000, *paths):
+    pages = [(p.name, p.read_bytes()) for p in
+             sorted((Path(__file__).parent / "listings").glob("*.html"))]
+    pages += [(Path(p).name, Path(p).read_bytes()) for p in paths]
+    pages.append((f'packages x{nrows}', packages_page(int(nrows)).encode()))
+    for name, html in pages:
+        tsoup, want = timeit(soup_table, html)
+        tfast, got = timeit(parse_table, html)
+        assert got == want
+        print(f'{name:24s} {len(got):6d} rows  soup {tsoup*1000:8.2f} ms  '
+              f'stream {tfast*1000:8.2f} ms  x{tsoup/tfast:.1f}')
+
+
+if '__main__' == __name__:
+    main(*sys.argv[1:])
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+'''
+Benchmark parsing of product tar file names.
+
+    python test/bench_product.py [ncopies] [names.txt ...]
+
+The corpus is the real scisoft product file names of test/fodder.py
+plus any given in files of one name per line.  Each name is repeated
+with ncopies (default 200) distinct versions so that the memo cache
+sees mostly new names on the first pass.  Times are reported for the
+pyparsing grammar, the regex fast path and partition_filename() with
+a cold and a warm cache.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+import coups.product
+from coups.product import fast_partition, grammar_partition, partition_filename
+from fodder import product_filenames
+
+
+def corpus(ncopies, paths):
+    names = list(product_filenames)
+    for path in paths:
+        names += [l.strip() for l in open(path) if l.strip()]
+    ret = list()
+    for copy in range(ncopies):
+        for name in names:
+            pkg, rest = name.split("-", 1)
+            ret.append(f'{pkg}-{copy}.{rest}')
+    return ret
+
+
+def timeit(func, names):
+    t0 = time.perf_counter()
+    for name in names:
+        func(name)
+    return time.perf_counter() - t0
+
+
+def main(ncopies=200, *paths):
+    names = corpus(int(ncopies), paths)
+    misses = len([n for n in names if fast_partition(n) is None])
+    print(f'{len(names)} names, {misses} miss the fast path')
+
+    coups.product._partition.cache_clear()
+    slow = timeit(grammar_partition, names)
+    fast = timeit(fast_partition, names)
+    cold = timeit(partition_filename, names)
+    warm = timeit(partition_filename, names)
+    for label, dt in [("grammar", slow), ("fast path", fast),
+                      ("cached, cold", cold), ("cached, warm", warm)]:
+        print(f'{label:14s} {dt*1000:9.1f} ms  {dt/len(names)*1e6:8.2f} us/name  '
+              f'x{slow/dt:.1f}')
+
+
+if '__main__' == __name__:
+    main(*sys.argv[1:])
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+'''
+Benchmark coups CLI startup.
+
+    python test/bench_startup.py [repeat] [limit_seconds]
+
+Each command is run repeat times against a scratch DB and the median
+wall clock time is reported.  Exit status is 1 if any median exceeds
+the limit (default from COUPS_STARTUP_LIMIT or 1.0 seconds) so this
+may serve as a regression check.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import os
+import sys
+import time
+import tempfile
+import statistics
+import subprocess
+
+commands = [
+    ["--help"],
+    ["bundles"],
+    ["products", "boost"],
+]
+
+
+def timeit(args, repeat):
+    times = list()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "coups"] + args,
+                       check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - t0)
+    return statistics.median(times)
+
+
+def main(repeat=5, limit=None):
+    repeat = int(repeat)
+    limit = float(limit or os.environ.get("COUPS_STARTUP_LIMIT", 1.0))
+    bad = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        store = os.path.join(tmp, "startup.db")
+        timeit(["-s", store, "bundles"], 1) # create DB
+        for args in commands:
+            dt = timeit(["-s", store] + args, repeat)
+            flag = ""
+            if dt > limit:
+                flag = " SLOW"
+                bad += 1
+            print(f'{dt*1000:8.1f} ms  coups {" ".join(args)}{flag}')
+    return 1 if bad else 0
+
+
+if '__main__' == __name__:
+    sys.exit(main(*sys.argv[1:]))
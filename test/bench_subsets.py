@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+'''
+Benchmark coups.queries.subset_extras on a synthetic DB.
+
+    python test/bench_subsets.py [nmanifests] [dbfile] [ncommon]
+
+Manifests are random slices of bundles built from a shared product
+pool so that plenty of subset relations exist.  A few products may be
+put in every manifest, as widely used noarch products are, to pair
+them all.  After materializing the overlap table, the single-call
+query is timed against one call per threshold as the CLI used to do.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import os
+import sys
+import time
+import random
+from sqlalchemy import insert
+from coups import store, queries, overlap
+
+
+def make_db(path, nmans=20000, nprods=20000, width=60, seed=42, common=0):
+    '''
+    Fill a fresh DB with nmans synthetic manifests, each also holding
+    the last common products.
+    '''
+    if os.path.exists(path):
+        os.remove(path)
+    ses = store.session(path, profile="bulk")
+    rng = random.Random(seed)
+    ses.execute(insert(store.Flavor.__table__), [dict(id=1, name="Linux64bit+3.10-2.17")])
+    ses.execute(insert(store.Product.__table__),
+                [dict(id=pid, name=f'p{pid}', version="v1_0", flavor_id=1,
+                      filename=f'p{pid}-1.0-x86_64.tar.bz2', qualkey='')
+                 for pid in range(1, nprods+common+1)])
+    mans = list()
+    links = list()
+    for mid in range(1, nmans+1):
+        start = rng.randrange(nprods - width)
+        links += [dict(manifest_id=mid, product_id=pid)
+                  for pid in range(nprods+1, nprods+common+1)]
+        size = rng.randrange(width//4, width)
+        mans.append(dict(id=mid, name=f'b{mid % 50}', version=f'v{mid}', flavor_id=1,
+                         filename=f'b{mid % 50}-{mid}_MANIFEST.txt', qualkey=''))
+        links += [dict(manifest_id=mid, product_id=pid)
+                  for pid in range(start+1, start+size+1)]
+    ses.execute(insert(store.Manifest.__table__), mans)
+    ses.execute(insert(store.ProductManifest), links)
+    ses.commit()
+    return ses
+
+
+def main(nmans=20000, path="bench_subsets.db", common=0):
+    t0 = time.perf_counter()
+    ses = make_db(path, int(nmans), common=int(common))
+    print(f'build {nmans} manifests: {time.perf_counter()-t0:.2f} s')
+    t0 = time.perf_counter()
+    overlap.rebuild(ses)
+    rows = ses.query(store.ManifestOverlap).count()
+    print(f'materialize overlaps: {time.perf_counter()-t0:.2f} s, {rows} rows')
+
+    rng = random.Random(1)
+    sample = [rng.randrange(1, int(nmans)+1) for _ in range(100)]
+    thresholds = (0, 2, 5)
+
+    t0 = time.perf_counter()
+    for mid in sample:
+        for most in thresholds:
+            queries.subset_extras(ses, mid, most)
+    many = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for mid in sample:
+        every = queries.subset_extras(ses, mid, max(thresholds))
+        for most in thresholds:
+            [m for m,t in every.items() if t[2] <= most]
+    one = time.perf_counter() - t0
+
+    n = len(sample)
+    print(f'per-threshold calls: {1000*many/n:.2f} ms/manifest')
+    print(f'single call:         {1000*one/n:.2f} ms/manifest')
+
+
+if '__main__' == __name__:
+    main(*sys.argv[1:])
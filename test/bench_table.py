@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+'''
+Benchmark parsing of UPS table, version and chain files.
+
+    python test/bench_table.py [repeat] [file ...]
+
+The corpus is the test/*.table, *.version and *.chain files plus any
+given, their kind taken from their extension.  Each is parsed repeat
+times (default 50) by the pyparsing grammar and by the line parser
+and the time per file is reported.  Files the line parser leaves to
+the grammar are counted.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import sys
+import time
+from pathlib import Path
+
+from coups.table import TableFile, VersionFile, ChainFile, fast_parse
+
+grammars = dict(table=TableFile, version=VersionFile, chain=ChainFile)
+
+
+def corpus(paths):
+    here = Path(__file__).parent
+    paths = [Path(p) for p in paths]
+    for kind in grammars:
+        paths += sorted(here.glob(f'*.{kind}'))
+    return [(p.suffix[1:], p.open().read()) for p in paths]
+
+
+def timeit(func, texts, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for kind, text in texts:
+            func(text, kind)
+    return time.perf_counter() - t0
+
+
+def main(repeat=50, *paths):
+    repeat = int(repeat)
+    texts = corpus(paths)
+    misses = len([t for t in texts if fast_parse(t[1], t[0]) is None])
+    print(f'{len(texts)} files, {misses} left to the grammar')
+
+    slow = timeit(lambda text, kind: grammars[kind].parse_string(text).as_dict(),
+                  texts, repeat)
+    fast = timeit(fast_parse, texts, repeat)
+    nparse = len(texts) * repeat
+    for label, dt in [("grammar", slow), ("line parser", fast)]:
+        print(f'{label:12s} {dt*1000:9.1f} ms  {dt/nparse*1e6:9.1f} us/file  '
+              f'x{slow/dt:.1f}')
+
+
+if '__main__' == __name__:
+    main(*sys.argv[1:])
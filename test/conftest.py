@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+'''
+Shared test fixtures.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import pytest
+from coups import upscache
+import coups.manifest
+import coups.product
+
+@pytest.fixture(scope="session")
+def fodder_items():
+    '''
+    The (manifest, products) tuples of the fodder manifests.
+    '''
+    from fodder import product_filenames, manifest_filenames
+    ptps = [coups.product.parse_filename(fn) for fn in product_filenames]
+    mtps = [coups.manifest.parse_filename(fn) for fn in manifest_filenames
+            if "source" not in fn]
+    # overlapping slices so products are shared between manifests
+    return [(mtp, ptps[ind:ind+20]) for ind, mtp in enumerate(mtps)]
+
+@pytest.fixture(autouse=True)
+def ups_cache(tmp_path):
+    '''
+    Keep parsed UPS files out of the user's cache directory.
+    '''
+    upscache.configure(path=str(tmp_path / "ups.db"))
+    yield
+    upscache.configure(path=None)
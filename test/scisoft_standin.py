@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+'''
+A local stand-in for scisoft.
+
+Serves a scisoft-like tree (see coups.mirror) over HTTP with index
+pages newest first, ETag and Last-Modified validators, single Range
+requests and a configurable latency and bandwidth per response.
+
+    python test/scisoft_standin.py [-p port] [-l latency] [-b bandwidth] [topdir]
+
+Without a topdir a synthetic tree is made in a temporary directory.
+Give its URL to coups with --url.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import os
+import time
+import hashlib
+import threading
+from pathlib import Path
+from email.utils import formatdate
+from urllib.parse import urlparse, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import coups.product
+import coups.manifest
+from coups import mirror
+from coups.render import product_manifest
+
+default_flavor = "Linux64bit+3.10-2.17"
+
+
+def synthetic_tree(topdir, bundles=2, versions=5, quals=("e20:prof", "e20:debug"),
+                   products=30, tarsize=32*1024, flavor=default_flavor):
+    '''
+    Write a synthetic scisoft tree, return list of (mtp, ptps).
+
+    Each bundle version has a manifest for each of quals listing
+    products from a pool shared by all bundles.  Products change
+    version at different rates so successive manifests overlap.  A
+    tar file of tarsize bytes is written for each product.
+    '''
+    items = list()
+    for bnum in range(bundles):
+        for vnum in range(versions):
+            version = f'{vnum+1:02d}.00.00'
+            for qual in quals:
+                mtp = coups.manifest.make(f'bundle{bnum:02d}', version, flavor, qual)
+                ptps = [coups.product.make(f'pkg{pnum:03d}',
+                                           f'1.{vnum // (1 + pnum % 4):02d}.00',
+                                           flavor, qual)
+                        for pnum in range(products)]
+                text = "\n".join([product_manifest(p) for p in ptps]) + "\n"
+                mirror.write_manifest(topdir, mtp, text)
+                items.append((mtp, ptps))
+    seen = set()
+    for _, ptps in items:
+        for ptp in ptps:
+            if ptp.filename in seen:
+                continue
+            seen.add(ptp.filename)
+            path = mirror.product_path(topdir, ptp)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            block = hashlib.sha256(ptp.filename.encode()).digest()
+            path.write_bytes((block * (tarsize // len(block) + 1))[:tarsize])
+    return items
+
+
+class Stats:
+    '''
+    Counts of what a stand-in has served.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.requests = 0
+        self.nbytes = 0
+        self.status = dict()
+
+    def add(self, status, nbytes):
+        with self.lock:
+            self.requests += 1
+            self.nbytes += nbytes
+            self.status[status] = self.status.get(status, 0) + 1
+
+
+class Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self.serve(False)
+
+    def do_GET(self):
+        self.serve(True)
+
+    def serve(self, body):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        rel = unquote(urlparse(self.path).path).strip("/")
+        if rel in server.failing:
+            return self.empty(503)
+        path = (server.topdir / rel).resolve()
+        if path != server.topdir and server.topdir not in path.parents:
+            return self.empty(404)
+        if path.is_dir():
+            data = mirror.render_index(path)
+            etag = '"' + hashlib.sha1(data).hexdigest() + '"'
+            mtime = path.stat().st_mtime
+        elif path.is_file():
+            data = None
+            st = path.stat()
+            etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+            mtime = st.st_mtime
+        else:
+            return self.empty(404)
+
+        if self.headers.get("If-None-Match") == etag:
+            return self.empty(304, ETag=etag)
+
+        size = len(data) if data is not None else path.stat().st_size
+        start = 0
+        rng = self.headers.get("Range", "")
+        status = 200
+        headers = {"ETag": etag, "Last-Modified": formatdate(mtime, usegmt=True),
+                   "Accept-Ranges": "bytes"}
+        if data is None and rng.startswith("bytes=") and rng.endswith("-"):
+            start = int(rng[6:-1])
+            if start >= size:
+                return self.empty(416, **{"Content-Range": f'bytes */{size}'})
+            status = 206
+            headers["Content-Range"] = f'bytes {start}-{size-1}/{size}'
+        if data is not None:
+            headers["Content-Type"] = "text/html; charset=utf-8"
+
+        self.send_response(status)
+        for key, val in headers.items():
+            self.send_header(key, val)
+        self.send_header("Content-Length", str(size - start))
+        self.end_headers()
+        sent = 0
+        if body:
+            if data is not None:
+                sent = self.send_throttled([data])
+            else:
+                with path.open("rb") as fp:
+                    fp.seek(start)
+                    sent = self.send_throttled(iter(lambda: fp.read(server.block), b""))
+        server.stats.add(status, sent)
+
+    def send_throttled(self, blocks):
+        '''
+        Write blocks no faster than the server bandwidth.
+        '''
+        bandwidth = self.server.bandwidth
+        block = self.server.block
+        t0 = time.perf_counter()
+        sent = 0
+        for data in blocks:
+            for ind in range(0, len(data), block):
+                chunk = data[ind:ind+block]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                if bandwidth:
+                    ahead = sent / bandwidth - (time.perf_counter() - t0)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        return sent
+
+    def empty(self, status, **headers):
+        self.send_response(status)
+        for key, val in headers.items():
+            self.send_header(key, val)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.server.stats.add(status, 0)
+
+    def log_message(self, *args):
+        pass
+
+
+class Standin(ThreadingHTTPServer):
+    '''
+    Serve a scisoft tree on localhost.
+
+    The latency is seconds added to each response and the bandwidth
+    is in bytes per second per response, None for no limit.  Paths,
+    relative to the top, in the failing set are answered with 503.
+    '''
+
+    daemon_threads = True
+    block = 16*1024
+
+    def __init__(self, topdir, latency=0.0, bandwidth=None, port=0):
+        super().__init__(("127.0.0.1", port), Handler)
+        self.topdir = Path(topdir).resolve()
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.stats = Stats()
+        self.failing = set()
+        self.thread = None
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    import argparse
+    import tempfile
+    parser = argparse.ArgumentParser(description="Serve a scisoft stand-in")
+    parser.add_argument("-p", "--port", type=int, default=8080)
+    parser.add_argument("-l", "--latency", type=float, default=0.0,
+                        help="Seconds added to each response")
+    parser.add_argument("-b", "--bandwidth", type=float, default=None,
+                        help="Bytes per second per response")
+    parser.add_argument("topdir", nargs="?", default=None)
+    args = parser.parse_args()
+
+    topdir = args.topdir
+    if topdir is None:
+        topdir = tempfile.mkdtemp(prefix="scisoft-")
+        items = synthetic_tree(topdir)
+        print(f'made {len(items)} manifests in {topdir}')
+    with Standin(topdir, args.latency, args.bandwidth, args.port) as server:
+        print(f'serving {topdir} at {server.url}')
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
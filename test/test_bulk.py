@@ -0,0 +1,153 @@
+#!/usr/bin/env pytest
+'''
+Test coups.bulk
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+from coups import store, inserts, bulk
+import coups.manifest
+
+def contents(ses):
+    prods = {p.filename: (p.name, p.version, str(p.flavor), p.qualset(":"), p.qualkey)
+             for p in ses.query(store.Product).all()}
+    mans = {m.filename: sorted([p.filename for p in m.products])
+            for m in ses.query(store.Manifest).all()}
+    return prods, mans
+
+def test_bulk_matches_inserts(tmp_path, fodder_items):
+    items = fodder_items
+
+    slow = store.session(str(tmp_path / "slow.db"))
+    for mtp, ptps in items:
+        mobj = inserts.manifest(slow, mtp)
+        for ptp in ptps:
+            mobj.products.append(inserts.product(slow, ptp))
+        slow.commit()
+
+    fast = store.session(str(tmp_path / "fast.db"))
+    stats = bulk.load(fast, items)
+    print(stats)
+    assert stats.manifests == len(items)
+    assert stats.links == sum([len(ptps) for _,ptps in items])
+
+    assert contents(slow) == contents(fast)
+
+    # a second load adds nothing
+    again = bulk.load(fast, items)
+    assert again.rows == 0
+
+def test_bulk_refresh(tmp_path, fodder_items):
+    items = fodder_items
+    ses = store.session(str(tmp_path / "refresh.db"))
+    bulk.load(ses, items)
+
+    mtp, ptps = items[0]
+    stats = bulk.load(ses, [(mtp, ptps[:5])], refresh=True)
+    assert stats.manifests == 1
+    assert stats.products == 0
+    mobj = ses.query(store.Manifest).filter_by(filename=mtp.filename).one()
+    assert len(mobj.products) == 5
+
+def test_refresh_digest(tmp_path, fodder_items):
+    from coups.main import Coups
+    from coups.render import product_manifest
+    from coups.__main__ import load_one_manifest
+    items = fodder_items[:3]
+    def text(ptps):
+        return "\n".join([product_manifest(p) for p in ptps]) + "\n"
+    mtp, ptps = items[0]
+
+    for how in ("bulk", "one"):
+        main = Coups(str(tmp_path / f'{how}.db'), None)
+        def load(ptps, refresh=True):
+            if how == "bulk":
+                return main.load_manifests([(mtp, ptps, text(ptps))], refresh).manifests
+            return int(load_one_manifest(main, mtp, refresh, text=text(ptps)))
+        ses = main.session
+
+        assert load(ptps, False) == 1
+        mobj = ses.query(store.Manifest).filter_by(filename=mtp.filename).one()
+        first = (mobj.digest, mobj.fetched)
+        assert first[0] == store.digest(text(ptps))
+        assert ses.get(store.ManifestBody, first[0]).text == text(ptps)
+
+        # unchanged text is not reloaded
+        with store.statements(ses) as seen:
+            assert load(ptps) == 0
+        assert not [s for s in seen if "product_manifest" in s.lower()
+                    and not s.lstrip().lower().startswith("select")]
+        ses.expire_all()
+        assert mobj.digest == first[0] and mobj.fetched > first[1]
+
+        # changed text only touches links which differ
+        pids = {p.filename: p.id for p in mobj.products}
+        assert load(ptps[2:] + items[1][1][-2:]) == 1
+        ses.expire_all()
+        got = {p.filename: p.id for p in mobj.products}
+        assert set(got) == set([p.filename for p in ptps[2:] + items[1][1][-2:]])
+        assert all([got[f] == pids[f] for f in got if f in pids])
+        assert mobj.digest != first[0]
+        assert ses.query(store.ManifestBody).count() == 2
+
+def test_digest_kept(tmp_path, fodder_items):
+    from coups.main import Coups
+    from coups.render import product_manifest
+    from coups.__main__ import load_one_manifest
+    items = fodder_items[:2]
+    def text(ptps):
+        return "\n".join([product_manifest(p) for p in ptps]) + "\n"
+    main = Coups(str(tmp_path / "kept.db"), None)
+    ses = main.session
+    (mtp1, ptps1), (mtp2, ptps2) = items
+
+    # crawler path gives parsed products without text
+    assert load_one_manifest(main, mtp1, False, text=text(ptps1))
+    assert load_one_manifest(main, mtp1, True, ptps=ptps1[1:])
+    mobj = main.has_manifest(mtp1)
+    assert mobj.digest == store.digest(text(ptps1))
+
+    # a body shared by another manifest outlives the first removal
+    assert load_one_manifest(main, mtp2, False, text=text(ptps1))
+    main.remove_manifest(mobj)
+    assert ses.query(store.ManifestBody).count() == 1
+    main.remove_manifest(main.has_manifest(mtp2))
+    assert ses.query(store.ManifestBody).count() == 0
+
+def test_load_stream(tmp_path, monkeypatch, fodder_items):
+    from coups.main import Coups
+    from coups.render import product_manifest
+    items = fodder_items[:4]
+    text = "\n".join(["# a comment", ""] + [product_manifest(p) for p in items[0][1]])
+
+    # chunk boundaries anywhere give the same products and digest
+    chunks = [text[i:i+7] for i in range(0, len(text), 7)]
+    body = coups.manifest.Body(iter(chunks), keep=100)
+    got = list(coups.manifest.parse_lines(coups.manifest.lines(body)))
+    assert got == coups.manifest.parse_body(text)
+    assert body.digest == store.digest(text)
+    assert body.text is None
+
+    bulk.load(store.session(str(tmp_path / "load.db")), items)
+    monkeypatch.chdir(tmp_path)
+    main = Coups(str(tmp_path / "stream.db"), None)
+    monkeypatch.setattr(bulk, "chunk_size", 3)
+    for mtp, ptps in items:
+        (tmp_path / mtp.filename).write_text(
+            "\n".join([product_manifest(p) for p in ptps]) + "\n")
+        stats = main.stream_manifest(mtp)
+        assert stats.manifests == 1 and stats.links == len(ptps)
+    assert contents(main.session) == contents(store.session(str(tmp_path / "load.db")))
+    assert main.stream_manifest(items[0][0]).rows == 0
+
+    mtp, ptps = items[0]
+    (tmp_path / mtp.filename).write_text(
+        "\n".join([product_manifest(p) for p in ptps[:5]]) + "\n")
+    stats = main.stream_manifest(mtp, refresh=True)
+    assert (stats.manifests, stats.products, stats.links) == (1, 0, 0)
+    ses = main.session
+    mobj = ses.query(store.Manifest).filter_by(filename=mtp.filename).one()
+    assert len(mobj.products) == 5
+    assert ses.get(store.ManifestBody, mobj.digest).text == (tmp_path / mtp.filename).read_text()
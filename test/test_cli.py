@@ -0,0 +1,32 @@
+#!/usr/bin/env pytest
+'''
+Test the coups CLI imports only what a command needs.
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import sys
+import subprocess
+
+def imported(code):
+    '''
+    Return set of top level module names imported after running code
+    in a fresh interpreter.
+    '''
+    code += "\nimport sys\nprint(' '.join(sys.modules))"
+    out = subprocess.run([sys.executable, "-c", code], check=True,
+                         capture_output=True, text=True).stdout
+    return set([m.split('.')[0] for m in out.split()])
+
+heavy = {"requests", "bs4", "networkx", "matplotlib", "numpy"}
+
+def test_cli_imports():
+    got = imported("import coups.__main__")
+    assert not got & (heavy | {"sqlalchemy", "pyparsing"})
+
+def test_listing_imports():
+    got = imported("import coups.main, coups.queries, coups.render")
+    assert "sqlalchemy" in got
+    assert not got & heavy
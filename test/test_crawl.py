@@ -0,0 +1,239 @@
+#!/usr/bin/env pytest
+'''
+Test coups.crawl
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import time
+import threading
+from coups.crawl import Crawler, Walk, select_versions
+
+# a fake server: versions in decreasing order, each with files
+server = {
+    "3.0": ["a-3.0-x", "a-3.0-y"],
+    "2.0": ["a-2.0-x", "a-2.0-y"],
+    "1.5": ValueError("no table"),
+    "1.0": ["a-1.0-x", "a-1.0-y"],
+}
+
+def versions_of(name, full=False):
+    return list(server)
+
+def listing_of(name, ver, full=False):
+    got = server[ver]
+    if isinstance(got, Exception):
+        raise got
+    return got
+
+def fetch(fname):
+    return fname.upper()
+
+def walk(**kwds):
+    with Crawler(4, 2) as crawler:
+        return [(f.status, f.version, f.filename, f.data)
+                for f in Walk(crawler, "a", versions_of, listing_of, fetch, **kwds)]
+
+def test_select_versions():
+    vers = list(server)
+    assert select_versions(vers) == (vers, None)
+    assert select_versions(vers, newer="2.0") == (["3.0", "2.0"], "1.5")
+    assert select_versions(vers, wanted={"2.0", "1.0"}) == (["2.0", "1.0"], None)
+    assert select_versions(vers, seen={"2.0", "1.0"}) == (["3.0", "2.0", "1.5"], None)
+    # as a classic walk, stop at the oldest seen unless backfilling
+    assert select_versions(vers, seen={"3.0", "2.0"}) == (["3.0"], None)
+    assert select_versions(vers, seen={"3.0", "2.0"}, backfill=True) == \
+        (["3.0", "1.5", "1.0"], None)
+
+def test_walk_order():
+    got = walk()
+    assert [g[0] for g in got] == ["load"]*4 + ["broken"] + ["load"]*2
+    assert [g[2] for g in got if g[0] == "load"] == \
+        ["a-3.0-x", "a-3.0-y", "a-2.0-x", "a-2.0-y", "a-1.0-x", "a-1.0-y"]
+    assert got[0][3] == "A-3.0-X"
+
+def test_walk_stops():
+    got = walk(known={"a-2.0-y"})
+    assert got[-1] == ("have", "2.0", "a-2.0-y", None)
+    assert len(got) == 4
+
+    got = walk(known={"a-2.0-y"}, refresh=True)
+    assert "have" not in [g[0] for g in got]
+
+    got = walk(newer="2.0")
+    assert got[-1][:2] == ("old", "1.5")
+    assert len(got) == 5
+
+    got = walk(wanted={"1.0"})
+    assert [g[2] for g in got] == ["a-1.0-x", "a-1.0-y"]
+
+def test_walk_seen():
+    # incremental: a known file ends only its version
+    with Crawler(4, 2) as crawler:
+        w = Walk(crawler, "a", versions_of, listing_of, fetch,
+                 known={"a-3.0-y", "a-1.0-x"}, seen={"3.0", "1.0"})
+        got = [(f.status, f.version, f.filename) for f in w]
+    assert got == [("load", "3.0", "a-3.0-x"), ("have", "3.0", "a-3.0-y"),
+                   ("load", "2.0", "a-2.0-x"), ("load", "2.0", "a-2.0-y"),
+                   ("broken", "1.5", None)]
+    assert w.covered() == {"3.0", "2.0"}
+    assert w.fingerprint and w.index == list(server)
+
+    # classic: only fully visited versions are covered
+    with Crawler(4, 2) as crawler:
+        w = Walk(crawler, "a", versions_of, listing_of, fetch, known={"a-2.0-x"})
+        list(w)
+    assert w.covered() == {"3.0"}
+    with Crawler(4, 2) as crawler:
+        w = Walk(crawler, "a", versions_of, listing_of, fetch, known={"a-2.0-y"})
+        list(w)
+    assert w.covered() == {"3.0", "2.0"}
+
+def test_journal(tmp_path):
+    from coups.main import Coups
+    main = Coups(str(tmp_path / "journal.db"), None)
+    with Crawler(4, 2) as crawler:
+        w = Walk(crawler, "a", versions_of, listing_of, fetch, newer="2.0")
+        list(w)
+    # a restricted walk does not bound later crawls
+    assert main.journal("bundle", w) is None
+
+    with Crawler(4, 2) as crawler:
+        w = Walk(crawler, "a", versions_of, listing_of, fetch)
+        list(w)
+    state = main.journal("bundle", w)
+    assert state.seen == {"3.0", "2.0", "1.0"}
+    assert state.fingerprint == w.fingerprint and state.checked
+
+def test_walk_seen_state():
+    from datetime import datetime
+    from coups.store import CrawlState
+    now = datetime.now()
+    # no complete crawl: a classic walk with early stop
+    assert CrawlState(versions="").walk_seen is None
+    assert CrawlState(versions="2.0,1.0").walk_seen is None
+    assert CrawlState(versions="", checked=now).walk_seen is None
+    state = CrawlState(versions="2.0,1.0", checked=now)
+    assert state.walk_seen == {"2.0", "1.0"} and not state.backfill
+    # an interrupted crawl resumes incrementally, backfilling if first
+    state = CrawlState(versions="", pending=now)
+    assert state.walk_seen == set() and state.backfill
+    state = CrawlState(versions="2.0", pending=now, checked=now)
+    assert state.walk_seen == {"2.0"} and not state.backfill
+
+def test_per_host():
+    lock = threading.Lock()
+    state = dict(now=0, most=0)
+
+    def slow(fname):
+        with lock:
+            state["now"] += 1
+            state["most"] = max(state["most"], state["now"])
+        time.sleep(0.01)
+        with lock:
+            state["now"] -= 1
+        return fname
+
+    with Crawler(8, 3) as crawler:
+        futs = [crawler.submit(slow, str(n)) for n in range(20)]
+        assert [f.result() for f in futs] == [str(n) for n in range(20)]
+    assert 1 < state["most"] <= 3
+
+def test_write_bundle(tmp_path, fodder_items):
+    from coups import store
+    from coups.main import Coups
+    from coups.__main__ import write_bundle
+
+    items = {mtp.filename: (mtp, ptps) for mtp, ptps in fodder_items[:6]}
+    fnames = list(items)
+    listing = {"2.0": fnames[:3], "1.0": fnames[3:]}
+
+    for bulk in (False, True):
+        main = Coups(str(tmp_path / f'write{bulk}.db'), None)
+        with Crawler(4, 2) as crawler:
+            write_bundle(main, Walk(crawler, "b", lambda n, full: list(listing),
+                                    lambda n, v, full: listing[v], items.get), bulk=bulk)
+        assert main.filenames(store.Manifest) == set(fnames)
+
+        # a later crawl stops at the first known manifest
+        listing["3.0"] = fnames[:1]
+        with Crawler(4, 2) as crawler:
+            walk = Walk(crawler, "b", lambda n, full: ["3.0"] + list(listing),
+                        lambda n, v, full: listing[v], items.get,
+                        known=main.filenames(store.Manifest))
+            assert [f.status for f in walk] == ["have"]
+        del listing["3.0"]
+
+def test_open_manifest(tmp_path, monkeypatch, fodder_items):
+    import types
+    from coups import store
+    from coups.crawl import open_manifest
+    mtp, ptps = fodder_items[0]
+    text = "".join([f'{p.name} {p.version} {p.filename} -f {p.flavor} -q {p.quals}\n'
+                    for p in ptps])
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / mtp.filename).write_text(text)
+
+    got, gen, body = open_manifest(mtp.filename)
+    assert got == mtp
+    assert isinstance(gen, types.GeneratorType)
+    assert [p.filename for p in gen] == [p.filename for p in ptps]
+    assert body.text == text
+    assert body.digest == store.digest(text)
+
+def test_write_package_skips(tmp_path, capsys):
+    from coups import store
+    from coups.main import Coups
+    from coups.__main__ import write_package
+
+    # an OS qual not in the platform registry is skipped, not fatal
+    good = "art-3.14.03-slf7-x86_64-e26-prof.tar.bz2"
+    listing = {"3.14.03": ["art-3.14.03-u22-x86_64-e26-prof.tar.bz2", good,
+                           "art-3.14.03-d20-x86_64-e26-prof.tar.bz2"]}
+    main = Coups(str(tmp_path / "skips.db"), None)
+    with Crawler(4, 2) as crawler:
+        write_package(main, Walk(crawler, "art", lambda n, full: list(listing),
+                                 lambda n, v, full: listing[v]))
+    assert main.filenames(store.Product) == {good}
+    assert "failed to parse filename: art-3.14.03-u22" in capsys.readouterr().err
+
+def test_update_journal(tmp_path, fodder_items):
+    from click.testing import CliRunner
+    import coups.scisoft
+    from coups.__main__ import cli
+    from coups.main import Coups
+    from test_mirror import make_tree
+
+    # hold back a new version of one bundle and a new manifest in
+    # the newest version of another
+    held = ("larsoft-09.28.03-Linux64bit+3.10-2.17-s110-c7-debug_MANIFEST.txt",
+            "art-3.09.03-Linux64bit+3.10-2.17-e20-prof_MANIFEST.txt")
+    items = fodder_items
+    top = tmp_path / "upstream"
+    make_tree(top, [i for i in items if i[0].filename not in held], 0)
+
+    db = str(tmp_path / "update.db")
+    def run(*args):
+        res = CliRunner().invoke(cli, ["-s", db, "--url", str(top)] + list(args))
+        assert res.exit_code == 0, res.output
+        return res.output
+
+    try:
+        for name in set([m.name for m, _ in items]):
+            run("load-bundle", name)
+        make_tree(top, [i for i in items if i[0].filename in held], 0)
+
+        out = run("update", "--fresh", "0")
+        assert "5 bundles checked, 0 fresh, 1 with new versions, 2 new manifests" in out
+        for fname in held:
+            assert f'new {fname}' in out
+
+        state = Coups(db, None).crawl_state("bundle", "larsoft")
+        assert state.seen == {"09.28.03", "09.28.02.01", "08.38.00"}
+
+        out = run("update")
+        assert "0 bundles checked, 5 fresh" in out
+    finally:
+        coups.scisoft.set_base()
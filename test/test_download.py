@@ -0,0 +1,98 @@
+#!/usr/bin/env pytest
+'''
+Test coups.download
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+from coups import download
+
+blobs = {f'/f{n}.tar.bz2': bytes([n]) * (200000 + n) for n in range(5)}
+
+class Handler(BaseHTTPRequestHandler):
+    ranges = True
+    def do_GET(self):
+        body = blobs.get(self.path)
+        if body is None:
+            self.send_error(404)
+            return
+        start = 0
+        rng = self.headers.get("Range")
+        if rng and self.ranges:
+            start = int(rng.split("=")[1].split("-")[0])
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header("Content-Range", f'bytes */{len(body)}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f'bytes {start}-{len(body)-1}/{len(body)}')
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+        self.wfile.write(body[start:])
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{httpd.server_port}'
+    httpd.shutdown()
+
+def test_fetch(server, tmp_path):
+    name = "/f1.tar.bz2"
+    path = tmp_path / "f1.tar.bz2"
+    part = tmp_path / "f1.tar.bz2.part"
+    part.write_bytes(blobs[name][:1000])
+    digest = "sha256:" + hashlib.sha256(blobs[name]).hexdigest()
+    res = download.fetch(download.Transfer(server + name, path, checksum=digest))
+    assert res.resumed == 1000
+    assert res.nbytes == len(blobs[name]) - 1000
+    assert path.read_bytes() == blobs[name]
+    assert not part.exists()
+
+    # a whole .part gets a 416 and is kept
+    other = tmp_path / "again.tar.bz2"
+    (tmp_path / "again.tar.bz2.part").write_bytes(blobs[name])
+    res = download.fetch(download.Transfer(server + name, other, len(blobs[name])))
+    assert res.nbytes == 0
+    assert other.read_bytes() == blobs[name]
+
+    with pytest.raises(ValueError):
+        download.fetch(download.Transfer(server + name, tmp_path / "bad", checksum="md5:00"))
+    assert not (tmp_path / "bad").exists()
+
+def test_no_ranges(server, tmp_path):
+    name = "/f2.tar.bz2"
+    path = tmp_path / "f2.tar.bz2"
+    (tmp_path / "f2.tar.bz2.part").write_bytes(b"junk")
+    Handler.ranges = False
+    try:
+        res = download.fetch(download.Transfer(server + name, path))
+    finally:
+        Handler.ranges = True
+    assert res.resumed == 0
+    assert path.read_bytes() == blobs[name]
+
+def test_downloader(server, tmp_path):
+    transfers = [download.Transfer(server + name, tmp_path / name[1:]) for name in blobs]
+    transfers.append(download.Transfer(server + "/missing", tmp_path / "missing"))
+    seen = list()
+    results, summary = download.Downloader(3, report=seen.append).run(transfers)
+    assert len(seen) == len(transfers)
+    assert [r.transfer for r in results] == transfers
+    assert summary.files == len(transfers)
+    assert summary.failed == 1
+    assert summary.nbytes == sum([len(b) for b in blobs.values()])
+    for name, body in blobs.items():
+        assert (tmp_path / name[1:]).read_bytes() == body
+    print(summary)
@@ -0,0 +1,124 @@
+#!/usr/bin/env pytest
+'''
+Test coups.mirror and a file:// scisoft base
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import pytest
+from click.testing import CliRunner
+import coups.scisoft
+from coups import mirror, store
+from coups.main import Coups
+from coups.render import product_manifest
+
+def make_tree(topdir, items, tarballs=3):
+    '''
+    Write a scisoft-like tree of manifests and a few product files.
+    '''
+    for mtp, ptps in items:
+        text = "\n".join([product_manifest(p) for p in ptps]) + "\n"
+        mirror.write_manifest(topdir, mtp, text)
+        for ptp in ptps[:tarballs]:
+            path = mirror.product_path(topdir, ptp)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_bytes(ptp.filename.encode() * 1000)
+    return items
+
+@pytest.fixture
+def upstream(tmp_path, fodder_items):
+    top = tmp_path / "upstream"
+    items = make_tree(top, fodder_items)
+    yield top, items
+    coups.scisoft.set_base()
+
+def test_file_base(upstream):
+    top, items = upstream
+    base = coups.scisoft.set_base(str(top))
+    assert base.startswith("file://")
+    got = list(coups.scisoft.bundles(False))
+    assert got == sorted(set([m.name for m,_ in items]), reverse=True)
+    vers = list(coups.scisoft.bundle_versions("larsoft", False))
+    assert vers == sorted(vers, reverse=True)
+
+    mtp, ptps = items[0]
+    text = coups.scisoft.get_manifest(mtp)
+    assert [p.filename for p in coups.manifest.parse_body(text)] == \
+        [p.filename for p in ptps]
+
+    ptp = ptps[0]
+    path = mirror.product_path(top, ptp)
+    ses = coups.scisoft.session()
+    url = path.as_uri()
+    assert ses.get(url, headers={"Range": "bytes=10-"}).content == path.read_bytes()[10:]
+    assert ses.get(url + "nope").status_code == 404
+
+def test_load_and_mirror(upstream, tmp_path):
+    from coups.__main__ import cli, load_one_bundle
+    top, items = upstream
+    coups.scisoft.set_base(str(top))
+
+    main = Coups(str(tmp_path / "mirror.db"), None)
+    for name in set([m.name for m,_ in items]):
+        load_one_bundle(main, name)
+    assert main.filenames(store.Manifest) == set([m.filename for m,_ in items])
+
+    copy = tmp_path / "copy"
+    res = CliRunner().invoke(cli, ["-s", str(tmp_path / "cli.db"), "--url", str(top),
+                                   "mirror", "-o", str(copy), "--products",
+                                   "larsoft", "art"])
+    assert res.exit_code == 0, res.output
+    wanted = dict()
+    for mtp, ptps in items:
+        if mtp.name not in ("larsoft", "art"):
+            continue
+        assert mirror.manifest_path(copy, mtp).read_text() == \
+            mirror.manifest_path(top, mtp).read_text()
+        for ptp in ptps:
+            wanted[ptp.filename] = ptp
+    # upstream only holds some tar files, the rest fail to copy
+    missing = [p for p in wanted.values() if not mirror.product_path(top, p).exists()]
+    for ptp in wanted.values():
+        assert mirror.product_path(copy, ptp).exists() != (ptp in missing)
+    assert f'{len(wanted)} files, {len(missing)} failed' in res.output
+
+    # second pass finds everything already mirrored
+    res = CliRunner().invoke(cli, ["-s", str(tmp_path / "cli.db"), "--url", str(top),
+                                   "mirror", "-o", str(copy), "larsoft"])
+    assert "copy" not in res.output
+    assert "have" in res.output
+
+def test_served_mirror(upstream, tmp_path):
+    import threading
+    from functools import partial
+    from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+    from coups import webcache
+    from coups.__main__ import cli, load_one_bundle
+    top, items = upstream
+    copy = tmp_path / "copy"
+    res = CliRunner().invoke(cli, ["-s", str(tmp_path / "cli.db"), "--url", str(top),
+                                   "mirror", "-o", str(copy), "art"])
+    assert res.exit_code == 0, res.output
+    assert mirror.write_indexes(copy) == 0
+
+    # a plain web server gives the written index pages
+    class Quiet(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+    old = dict(webcache.settings)
+    webcache.configure(directory=str(tmp_path / "cache"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(Quiet, directory=str(copy)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        coups.scisoft.set_base(f'http://127.0.0.1:{server.server_port}')
+        assert list(coups.scisoft.bundles(False)) == ["art"]
+        main = Coups(str(tmp_path / "served.db"), None)
+        load_one_bundle(main, "art")
+    finally:
+        server.shutdown()
+        server.server_close()
+        webcache.configure(**old)
+    assert main.filenames(store.Manifest) == set([m.filename for m, _ in items
+                                                 if m.name == "art"])
@@ -0,0 +1,78 @@
+#!/usr/bin/env pytest
+'''
+Test coups.overlap
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+from sqlalchemy import delete
+from coups import store, bulk, overlap, queries
+from coups.main import Coups
+import coups.manifest
+
+def check_all(ses):
+    mans = ses.query(store.Manifest).all()
+    for one in mans:
+        for two in mans:
+            assert overlap.cmp(ses, one, two) == coups.manifest.cmp(one, two)
+
+def test_overlap(tmp_path, fodder_items):
+    main = Coups(str(tmp_path / "overlap.db"), None)
+    ses = main.session
+    items = fodder_items
+    bulk.load(ses, items)
+    check_all(ses)
+
+    # refresh one manifest with fewer products
+    mtp, ptps = items[3]
+    bulk.load(ses, [(mtp, ptps[:3])], refresh=True)
+    check_all(ses)
+
+    man = main.has_manifest(mtp)
+    subs = queries.subset_extras(ses, man, 0)
+    assert man in subs
+    for sm, (mine, both, yours) in subs.items():
+        assert yours == 0
+        assert both > 0
+
+    main.remove_manifest(man)
+    assert not overlap.materialized(ses, man.id)
+    check_all(ses)
+
+def test_lazy(tmp_path, fodder_items):
+    ses = store.session(str(tmp_path / "lazy.db"))
+    bulk.load(ses, fodder_items)
+    ses.execute(delete(store.ManifestOverlap))
+    ses.commit()
+    check_all(ses)
+    assert overlap.rebuild(ses) == len(fodder_items)
+    check_all(ses)
+
+def test_pairs(tmp_path, fodder_items, monkeypatch):
+    from sqlalchemy import insert, select, func
+    from test_queries import brute_subsets
+    ses = store.session(str(tmp_path / "pairs.db"))
+    bulk.load(ses, fodder_items)
+    # a product in every manifest pairs them all but few are subsets
+    ses.execute(insert(store.Product.__table__),
+                [dict(id=100000, name="common", version="v1", filename="common.tar.bz2",
+                      qualkey="", flavor_id=ses.query(store.Flavor).first().id)])
+    mans = ses.query(store.Manifest).all()
+    ses.execute(insert(store.ProductManifest),
+                [dict(manifest_id=m.id, product_id=100000) for m in mans])
+    ses.commit()
+    monkeypatch.setattr(overlap, "max_extras", 5)
+    overlap.rebuild(ses)
+    O = store.ManifestOverlap
+    rows = ses.execute(select(O.manifest_a, O.manifest_b, O.only_a, O.only_b)).all()
+    assert all([a <= b for a, b, _, _ in rows])
+    assert len(rows) < len(mans) * (len(mans) + 1) // 2
+    assert all([min(oa, ob) <= 5 for _, _, oa, ob in rows])
+    ses.expire_all()
+    for man in mans:
+        for most in (0, 5, 6, None):
+            got = queries.subset_extras(ses, man, most)
+            assert got == brute_subsets(man, mans, 10000 if most is None else most)
+    check_all(ses)
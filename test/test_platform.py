@@ -0,0 +1,106 @@
+#!/usr/bin/env pytest
+'''
+Test coups.platform
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import pytest
+from coups.platform import Platform, Registry, platforms, by_flavor, by_oscpu
+
+@pytest.fixture
+def registry(monkeypatch):
+    '''
+    A fresh platform registry in place of the global one while a test
+    adds to it.
+    '''
+    import coups.platform
+    import coups.parsing
+    import coups.product
+    reg = Registry(platforms)
+    for mod in (coups.platform, coups.parsing, coups.product):
+        monkeypatch.setattr(mod, "registry", reg)
+    monkeypatch.setattr(coups.product, "_product_re", (None, None))
+    yield reg
+    # forget what was parsed with the added platforms
+    coups.product._partition.cache_clear()
+    coups.product._make.cache_clear()
+
+def test_registry():
+    reg = Registry(platforms)
+    assert reg.by_flavor("Linux64bit+3.10-2.17").oses[0] == "slf7"
+    assert reg.by_oscpu("SLF7", "x86_64").flavor == "Linux64bit+3.10-2.17"
+    assert reg.by_oscpu("slf7", "ppc64le").flavor == "Linuxppc64le64bit+3.10-2.17"
+    with pytest.raises(ValueError):
+        reg.by_flavor("Linux128bit")
+    with pytest.raises(ValueError):
+        reg.by_oscpu("slf9", "x86_64")
+
+    gen = reg.generation
+    assert reg.add(platforms[0]) == platforms[0]
+    assert reg.generation == gen
+    with pytest.raises(ValueError):
+        reg.add(Platform("Linux64bit+3.10-2.17", "x86_64", ("al9",)))
+    for bad in [Platform("Linux 64", "", ()),
+                Platform("Foo+1", "x86 64", ("foo1",)),
+                Platform("Foo+1", "x86_64", ("FOO",))]:
+        with pytest.raises(ValueError):
+            reg.add(bad)
+
+def test_load_file(tmp_path):
+    path = tmp_path / "platforms"
+    path.write_text('''
+# EL8 and EL9 builds
+Linux64bit+4.18-2.28 x86_64 almalinux8 al8
+Linux64bit+5.14-2.34 x86_64 al9
+wasm
+''')
+    reg = Registry()
+    got = reg.load_file(path)
+    assert [p.flavor for p in got] == ["Linux64bit+4.18-2.28", "Linux64bit+5.14-2.34", "wasm"]
+    assert reg.by_oscpu("al8", "x86_64").flavor == "Linux64bit+4.18-2.28"
+    assert reg.by_flavor("wasm") == Platform("wasm", "", ())
+
+def test_extend_parsing(registry):
+    '''
+    A platform added at run time is known to the parsers.
+    '''
+    import coups.product
+    import coups.manifest
+    import coups.parsing
+    fname = "art-3.14.03-al9-x86_64-e26-prof.tar.bz2"
+    assert coups.product.fast_partition(fname) is None
+    with pytest.raises(ValueError):
+        coups.product.grammar_partition(fname)
+    with pytest.raises(ValueError):
+        coups.product.parse_filename(fname)
+
+    registry.add(Platform("Linux64bit+5.14-2.34", "x86_64", ("al9",)))
+    want = ("art", "3.14.03", "Linux64bit+5.14-2.34", "e26:prof")
+    assert coups.product.fast_partition(fname) == want
+    assert coups.product.grammar_partition(fname) == want
+    assert coups.product.parse_filename(fname, validate=True).filename == fname
+    assert by_oscpu("al9", "x86_64") == by_flavor(want[2])
+
+    mname = "critic-2.10.00-Linux64bit+5.14-2.34-e26-prof_MANIFEST.txt"
+    pp = coups.parsing.manifest.parse_string(mname)
+    assert pp.manifest.flavor == want[2]
+    assert coups.manifest.parse_filename(mname).flavor == want[2]
+
+def test_db_platforms(tmp_path, registry):
+    from click.testing import CliRunner
+    from coups.__main__ import cli
+    from coups import store
+    db = str(tmp_path / "coups.db")
+    res = CliRunner().invoke(cli, ["-s", db, "add-platform",
+                                   "Linux64bit+4.18-2.28", "x86_64", "al8"])
+    assert res.exit_code == 0, res.output
+    assert by_oscpu("al8", "x86_64").flavor == "Linux64bit+4.18-2.28"
+    ses = store.session(db)
+    rows = ses.query(store.ExtraPlatform).all()
+    assert [r.platform for r in rows] == [Platform("Linux64bit+4.18-2.28", "x86_64", ("al8",))]
+
+    res = CliRunner().invoke(cli, ["-s", db, "platforms"])
+    assert "Linux64bit+4.18-2.28 x86_64 al8" in res.output.split("\n")
@@ -7,3 +7,33 @@ def test_dashes():
         dqs = dashed(give)
         got = dqs.replace("-",":")
         assert got == want
+
+def test_classify_agrees():
+    from coups.parsing import software_qual, compiler_qual, build_qual, other_qual
+    from coups.parsing import ParseException
+    from coups.quals import classify
+    def grammar(q):
+        for name, expr in (("b", build_qual), ("s", software_qual),
+                           ("c", compiler_qual), ("o", other_qual)):
+            try:
+                expr.parse_string(q)
+            except ParseException:
+                continue
+            return name
+        return None
+    for q in ["prof", "debug", "opt", "profx", "opt1", "debug_x", "s12", "ss12", "s",
+              "s12x", "sx1", "e20", "c7", "cc7", "ec1", "e", "e20x", "gcc9", "gcc", "py3",
+              "py", "p392", "p383b", "qt", "cl23_us", "us", "x", "Opt", "_x", "9x", "",
+              " prof", "\te20", " s12", " py3", "-e20", "E20", "g9"]:
+        assert classify(q) == grammar(q), repr(q)
+
+def test_types():
+    from coups.quals import types, no_quals
+    assert types("") is no_quals
+    assert types(None) is no_quals
+    qt = types("e20:p383b:prof")
+    assert qt == ("prof", "e20", "", "p383b")
+    assert types(["e20", "p383b", "prof"]) is qt
+    assert types("s112:e20:prof").s == "s112"
+    assert dashed("prof:s112:e20", True) == "s112-e20-prof"
+    assert dashed("prof:s112:e20") == "e20-s112-prof"
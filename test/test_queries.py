@@ -0,0 +1,74 @@
+#!/usr/bin/env pytest
+'''
+Test coups.queries
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import pytest
+from coups import store, bulk, queries
+
+def brute_subsets(man, mans, most):
+    import coups.manifest
+    ret = dict()
+    for other in mans:
+        trio = coups.manifest.cmp(man, other)
+        if trio[1] and trio[2] <= most:
+            ret[other] = trio
+    return ret
+
+def test_subset_extras(tmp_path, fodder_items):
+    ses = store.session(str(tmp_path / "queries.db"))
+    bulk.load(ses, fodder_items)
+    mans = ses.query(store.Manifest).all()
+    for man in mans:
+        every = queries.subset_extras(ses, man)
+        assert man in every
+        assert every == brute_subsets(man, mans, len(mans) * 20)
+        for most in (0, 1, 5, 30):
+            got = queries.subset_extras(ses, man, most)
+            assert got == brute_subsets(man, mans, most)
+            assert got == {m:t for m,t in every.items() if t[2] <= most}
+
+    man = mans[5]
+    name = mans[6].name
+    got = queries.subsets_within(ses, man, 1, {name: 5})
+    want = brute_subsets(man, mans, 1)
+    want.update({m:t for m,t in brute_subsets(man, mans, 5).items()
+                 if m.name == name})
+    assert got == want
+
+def render_all(mans):
+    from coups.render import product_manifest
+    lines = list()
+    for man in mans:
+        lines.append(man.filename)
+        lines += [product_manifest(p) for p in man.products]
+    return lines
+
+def test_loaders(tmp_path, fodder_items):
+    path = str(tmp_path / "loaders.db")
+    bulk.load(store.session(path), fodder_items)
+
+    lazy = store.session(path)
+    with store.statements(lazy) as seen:
+        want = render_all(lazy.query(store.Manifest).all())
+    assert len(seen) > 20
+
+    eager = store.session(path)
+    opts = queries.loaders(store.Manifest, products=True)
+    with store.statements(eager, most=6):
+        got = render_all(eager.query(store.Manifest).options(*opts).all())
+    assert got == want
+
+    eager = store.session(path)
+    opts = queries.loaders(store.Product, manifests=True)
+    with store.statements(eager, most=4):
+        for prod in queries.products(eager, "boost", options=opts):
+            [m.filename for m in prod.manifests]
+
+    with pytest.raises(store.TooManyStatements):
+        with store.statements(lazy, most=0):
+            lazy.query(store.Manifest).first()
@@ -7,6 +7,7 @@ Test coups.scisoft
 # This file is part of coups which is free software distributed under
 # the terms of the GNU Affero General Public License.
 
+import pytest
 from coups.scisoft import *
 import coups.product
 
@@ -20,3 +21,63 @@ def test_download(tmp_path):
         got = coups.scisoft.download_product(prod, tmp_path)
         print (got)
         assert got.name == filename
+
+def test_session():
+    ses = coups.scisoft.session()
+    assert ses is coups.scisoft.session()
+    adapter = ses.get_adapter("https://scisoft.fnal.gov/")
+    assert adapter.max_retries.total == coups.scisoft.http_config["retries"]
+
+    old = dict(coups.scisoft.http_config)
+    try:
+        coups.scisoft.configure(retries=7, pool_maxsize=2)
+        other = coups.scisoft.session()
+        assert other is not ses
+        adapter = other.get_adapter("http://localhost/")
+        assert adapter.max_retries.total == 7
+        assert adapter._pool_maxsize == 2
+    finally:
+        coups.scisoft.configure(**old)
+
+    with pytest.raises(ValueError):
+        coups.scisoft.configure(nosuch=1)
+
+def test_thread_sessions():
+    import threading
+    ses = coups.scisoft.session()
+    got = list()
+    thread = threading.Thread(target=lambda: got.append(coups.scisoft.session()))
+    thread.start()
+    thread.join()
+    assert got[0] is not ses
+    url = "https://scisoft.fnal.gov/"
+    assert got[0].get_adapter(url) is ses.get_adapter(url)
+
+def listing_pages():
+    from pathlib import Path
+    return sorted(Path(__file__).parent.glob("listings/*.html"))
+
+def test_stream_table():
+    url = "https://scisoft.fnal.gov/scisoft/bundles/"
+    for path in listing_pages():
+        html = path.read_bytes()
+        want = coups.scisoft.soup_table(html, url)
+        assert want
+        assert coups.scisoft.parse_table(html, url) == want
+        for size in (1, 7, 1000):
+            chunks = [html[i:i+size] for i in range(0, len(html), size)]
+            assert list(coups.scisoft.stream_table(chunks, url)) == want
+
+def test_stream_table_fallback():
+    url = "http://localhost/"
+    nested = '''<div class="inner content-inner"><table>
+    <tr><td><table><tr><td><a href="x">x</a></td></tr></table></td></tr>
+    </table></div>'''
+    parser = coups.scisoft.TableHrefs()
+    parser.feed(nested)
+    assert not parser.recognized
+    assert coups.scisoft.parse_table(nested, url) == \
+        coups.scisoft.soup_table(nested, url)
+
+    with pytest.raises(ValueError):
+        coups.scisoft.parse_table("<html><body>Not Found</body></html>", url)
@@ -0,0 +1,174 @@
+#!/usr/bin/env pytest
+'''
+Test crawling and downloading against the scisoft stand-in
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import time
+import pytest
+from click.testing import CliRunner
+import coups.scisoft
+from coups import webcache, store, mirror
+from coups.main import Coups
+from coups.__main__ import cli
+from scisoft_standin import Standin, synthetic_tree
+
+@pytest.fixture
+def standin(tmp_path):
+    top = tmp_path / "scisoft"
+    items = synthetic_tree(top, bundles=2, versions=3, products=10, tarsize=100000)
+    old = dict(webcache.settings)
+    webcache.configure(directory=str(tmp_path / "cache"))
+    with Standin(top) as server:
+        yield server, items
+    webcache.configure(**old)
+    coups.scisoft.set_base()
+
+def run(server, db, *args):
+    res = CliRunner().invoke(cli, ["-s", str(db), "--url", server.url] + list(args))
+    assert res.exit_code == 0, res.output
+    return res.output
+
+def test_crawl(standin, tmp_path):
+    server, items = standin
+    db = tmp_path / "standin.db"
+    run(server, db, "load-bundle", "bundle00")
+    want = set([m.filename for m, _ in items if m.name == "bundle00"])
+    assert Coups(str(db), None).filenames(store.Manifest) == want
+    assert server.stats.status == {200: server.stats.requests}
+
+    # stale listings are revalidated and not sent again
+    server.stats.clear()
+    run(server, db, "--cache-ttl", "0", "load-bundle", "--refresh", "bundle00")
+    assert server.stats.status[304] == 4
+    assert 200 in server.stats.status   # manifests are not cached
+
+    run(server, db, "load-package", "pkg001")
+    ses = Coups(str(db), None).session
+    got = ses.query(store.Product).filter_by(name="pkg001").all()
+    assert len(set([p.filename for p in got])) == len(got) >= 2
+
+def test_get_products(standin, tmp_path):
+    server, items = standin
+    db = tmp_path / "standin.db"
+    run(server, db, "load-bundle", "bundle01")
+    out = tmp_path / "out"
+    ptp = items[-1][1][3]
+    # a partial download is resumed
+    part = out / (ptp.filename + ".part")
+    out.mkdir()
+    part.write_bytes(mirror.product_path(server.topdir, ptp).read_bytes()[:5000])
+    res = CliRunner().invoke(cli, ["-s", str(db), "--url", server.url,
+                                   "get-products", "-o", str(out),
+                                   "-v", ptp.version, ptp.name])
+    assert res.exit_code == 0, res.output
+    assert "2 files, 0 failed" in res.output
+    assert server.stats.status.get(206) == 1
+    for qual in ("e20:prof", "e20:debug"):
+        got = ptp._replace(quals=qual, filename=ptp.filename.replace(
+            ptp.quals.replace(":", "-"), qual.replace(":", "-")))
+        assert (out / got.filename).read_bytes() == \
+            mirror.product_path(server.topdir, got).read_bytes()
+
+def test_throttle(tmp_path):
+    top = tmp_path / "scisoft"
+    items = synthetic_tree(top, bundles=1, versions=1, products=2, tarsize=100000)
+    ptp = items[0][1][0]
+    url = mirror.product_path("", ptp).as_posix()
+    with Standin(top, latency=0.1, bandwidth=500000) as server:
+        t0 = time.perf_counter()
+        got = coups.scisoft.get(f'{server.url}/{url}')
+        dt = time.perf_counter() - t0
+    assert got.content == mirror.product_path(top, ptp).read_bytes()
+    assert dt >= 0.1 + 100000/500000 * 0.9
+
+def test_load_package_resume(standin, tmp_path):
+    from coups import crawl
+    from coups.__main__ import write_package
+    server, items = standin
+    coups.scisoft.set_base(server.url)
+    db = tmp_path / "resume.db"
+    want = set([p.filename for _, ptps in items for p in ptps if p.name == "pkg000"])
+    assert len(want) == 6
+
+    class Crash(Exception):
+        pass
+
+    class Crashing:
+        '''A walk which dies part way through'''
+        def __init__(self, walk, after):
+            self.walk, self.after = walk, after
+        def __getattr__(self, name):
+            return getattr(self.walk, name)
+        def __iter__(self):
+            for count, found in enumerate(self.walk):
+                if count == self.after:
+                    raise Crash()
+                yield found
+
+    main = Coups(str(db), None)
+    with crawl.Crawler(2, 2) as crawler:
+        walk = crawl.package(crawler, "pkg000", known=set())
+        with pytest.raises(Crash):
+            write_package(main, Crashing(walk, 3), batch=2)
+    main.session.rollback()
+    assert len(main.filenames(store.Product)) == 2
+    state = main.crawl_state("package", "pkg000")
+    assert state.seen == set() and state.pending
+    assert state.walk_seen == set() and state.backfill # resumes incrementally
+
+    # the first known product does not end the resumed crawl
+    server.stats.clear()
+    run(server, db, "load-package", "--batch", "4", "pkg000")
+    main = Coups(str(db), None)
+    assert main.filenames(store.Product) == want
+    state = main.crawl_state("package", "pkg000")
+    assert state.seen == {"1.00.00", "1.01.00", "1.02.00"}
+    assert state.pending is None and state.checked
+
+def test_update_after_restricted(standin, tmp_path):
+    server, items = standin
+    db = tmp_path / "restricted.db"
+    mtps = sorted([m for m, _ in items if m.name == "bundle00"],
+                  key=lambda m: m.version)
+    run(server, db, "load-bundle", "--versions", mtps[-1].version, "bundle00")
+    assert Coups(str(db), None).crawl_state("bundle", "bundle00") is None
+
+    # as a classic walk, update stops at the first known manifest
+    out = run(server, db, "update", "--fresh", "0")
+    assert "0 new manifests" in out
+    main = Coups(str(db), None)
+    assert main.filenames(store.Manifest) == set([m.filename for m in mtps
+                                                  if m.version == mtps[-1].version])
+    state = main.crawl_state("bundle", "bundle00")
+    assert state.checked
+
+    # nor does a later update
+    out = run(server, db, "update", "--fresh", "0")
+    assert "0 new manifests" in out
+
+    run(server, db, "load-package", "--versions", "1.02.00", "pkg000")
+    have = Coups(str(db), None).filenames(store.Product)
+    run(server, db, "load-package", "pkg000")
+    assert Coups(str(db), None).filenames(store.Product) == have
+
+def test_broken_version(standin, tmp_path):
+    server, items = standin
+    db = tmp_path / "broken.db"
+    mtps = [m for m, _ in items if m.name == "bundle00"]
+    bad = sorted(set([m.version for m in mtps]))[1]
+    server.failing.add(f'bundles/bundle00/{coups.scisoft.vunderify(bad)}/manifest')
+    old = dict(coups.scisoft.http_config)
+    coups.scisoft.configure(retries=1, backoff=0)
+    try:
+        out = run(server, db, "load-bundle", "bundle00")
+    finally:
+        coups.scisoft.configure(**old)
+    # the walk goes on past a version which keeps failing
+    assert f"broken bundle: bundle00 {bad}" in out
+    assert Coups(str(db), None).filenames(store.Manifest) == \
+        set([m.filename for m in mtps if m.version != bad])
+    assert server.stats.status[503] == 2
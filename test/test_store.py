@@ -0,0 +1,97 @@
+#!/usr/bin/env pytest
+'''
+Test coups.store
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import pytest
+from sqlalchemy import text
+from coups import store
+
+def test_pragmas():
+    assert store.pragmas("none") == {}
+    got = store.pragmas("default,cache_size=-1024")
+    assert got["journal_mode"] == "WAL"
+    assert got["cache_size"] == "-1024"
+    assert store.pragmas("safe")["synchronous"] == "FULL"
+    with pytest.raises(ValueError):
+        store.pragmas("nosuchprofile")
+
+def test_session_pragmas(tmp_path):
+    ses = store.session(str(tmp_path / "prag.db"), profile="default,cache_size=-2048")
+    assert ses.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+    assert ses.execute(text("PRAGMA cache_size")).scalar() == -2048
+
+def test_indexes(tmp_path):
+    ses = store.session(str(tmp_path / "index.db"))
+    sql = "SELECT name FROM sqlite_master WHERE type='index'"
+    have = set([r[0] for r in ses.execute(text(sql))])
+    for want in ["ix_product_name", "ix_product_version", "ix_product_flavor_id",
+                 "ix_manifest_name", "ix_manifest_version", "ix_manifest_flavor_id",
+                 "ix_product_manifest_manifest_product"]:
+        assert want in have
+
+def test_qualkey():
+    assert store.qualkey(None) == ''
+    assert store.qualkey('') == ''
+    assert store.qualkey('prof:e20') == 'e20:prof'
+    assert store.qualkey(['s112', 'e20', 'prof', 'e20']) == 'e20:prof:s112'
+
+def test_exact_quals(tmp_path):
+    from coups import inserts, queries
+    import coups.manifest
+    ses = store.session(str(tmp_path / "quals.db"))
+    for quals in ["e20:prof", "s112:e20:prof"]:
+        mtp = coups.manifest.make("larsoft", "09.28.02", "Linux64bit+3.10-2.17", quals)
+        inserts.manifest(ses, mtp)
+    ses.commit()
+    got = queries.manifests(ses, "larsoft", quals="prof:e20")
+    assert len(got) == 1
+    assert got[0].qualkey == "e20:prof"
+    got = inserts.qall(ses, store.Manifest, name="larsoft", quals="e20:prof:s112")
+    assert len(got) == 1
+
+def test_upgrade_once(tmp_path):
+    dbname = str(tmp_path / "upgrade.db")
+    ses = store.session(dbname)
+    assert ses.execute(text("PRAGMA user_version")).scalar() == store.schema_version
+    ses.execute(text("DROP INDEX ix_product_name"))
+    ses.commit()
+    ses.close()
+
+    def has_index():
+        ses = store.session(dbname)
+        sql = "SELECT name FROM sqlite_master WHERE type='index'"
+        ret = "ix_product_name" in [r[0] for r in ses.execute(text(sql))]
+        ses.close()
+        return ret
+
+    # current schema version, no upgrade
+    assert not has_index()
+
+    # an old DB is upgraded and stamped
+    ses = store.session(dbname)
+    ses.execute(text("PRAGMA user_version=0"))
+    ses.commit()
+    ses.close()
+    assert has_index()
+    ses = store.session(dbname)
+    assert ses.execute(text("PRAGMA user_version")).scalar() == store.schema_version
+
+def test_empty_quals(tmp_path):
+    from coups import inserts, queries
+    import coups.product
+    ses = store.session(str(tmp_path / "noquals.db"))
+    flavor = "Linux64bit+3.10-2.17"
+    inserts.product(ses, coups.product.make("cetlib", "3.13.03", flavor, "e20:prof"))
+    ses.commit()
+    assert queries.products(ses, "cetlib", quals="") == []
+    got = inserts.lookup(ses, store.Product, name="cetlib", version="3.13.03",
+                         flavor=flavor, quals="")
+    assert got.qualkey == ""
+    ses.commit()
+    assert len(queries.products(ses, "cetlib")) == 2
+    assert queries.products(ses, "cetlib", quals="") == [got]
@@ -318,3 +318,41 @@ def test_simp_wirecell() : simp("wirecell")
 def test_chain():
     parse(ChainFile, "cigetcert.chain")
 
+
+
+def same_as_grammar(text, kind, fast=True):
+    got = fast_parse(text, kind)
+    assert (got is not None) == fast
+    want = dict(table=TableFile, version=VersionFile, chain=ChainFile)[kind]
+    want = want.parse_string(text).as_dict()
+    assert parse_file(text, kind) == want
+    if fast:
+        assert got == want
+
+def test_fast_corpus():
+    here = Path(__file__).parent
+    for kind, pat in [("table", "*.table"), ("version", "*.version"), ("chain", "*.chain")]:
+        for path in sorted(here.glob(pat)):
+            same_as_grammar(path.open().read(), kind)
+
+def test_fast_edges():
+    head = 'FILE = Table\nPRODUCT = foo\n'
+    cmds = '\nCommon:\n  Action = setup\n    setupEnv()\n    envSet(FOO, "a b" )  \nEnd:\n'
+    same_as_grammar(head + 'VERSION = v1_0\nFLAVOR = ANY\nQUALIFIERS = ""\n'
+                    '  ACTION = setup\n\tprodDir()\n\tenvSet(FOO,\tbar)\n', "table")
+    same_as_grammar((head + 'Group:\nFlavor = ANY\nQualifiers = "e20:prof"  # c\n'
+                     '  Empty =\n' + cmds).replace("\n", "\r\n"), "table")
+    same_as_grammar(head + 'Group:\nFlavor = ANY\nQualifiers = e20\n'
+                    '  Action = x\n    "quoted"(x)\n' + cmds, "table")
+    same_as_grammar(head + 'Group:\nFlavor=ANY\nQualifiers=""\n' + cmds +
+                    'anything goes here (\n', "table")
+    same_as_grammar(head + 'Group:\nFlavor=ANY\nQualifiers=""\n  Action = x\n'
+                    '    envSet(FOO,\n      bar)\n' + cmds, "table", False)
+    same_as_grammar('# comment first\n' + head + 'Flavor=ANY\nQualifiers=""\n', "table", False)
+    same_as_grammar('FILE = version\nPRODUCT = foo\nVERSION = v1\nFLAVOR = NULL\n'
+                    'QUALIFIERS = ""\n  TABLE_FILE = # not a comment\n', "version", False)
+    # the grammar appends comment lines to a rest-of-line value
+    same_as_grammar(head + 'FLAVOR = ANY\n# c\nQUALIFIERS = ""\n  ACTION = x\n', "table")
+    same_as_grammar((head + 'Group:\nFlavor=ANY\nQualifiers=""\n  FOO = bar \n\n  # c\n#\n\n'
+                     '  Empty =\n  # c\n' + cmds).replace("\n", "\r\n"), "table")
+    same_as_grammar(head + 'FLAVOR = ANY\nQUALIFIERS = ""  # c\n# c\n  ACTION = x\n', "table")
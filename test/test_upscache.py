@@ -0,0 +1,82 @@
+#!/usr/bin/env pytest
+'''
+Test coups.upscache
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import os
+import shutil
+from pathlib import Path
+import pytest
+from coups import ups, upscache
+
+here = Path(__file__).parent
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.delenv("COUPS_PRODUCTS", raising=False)
+    for key in upscache.stats:
+        upscache.stats[key] = 0
+    top = tmp_path / "db"
+    for src, dst in [("cigetcert.chain", "cigetcert/current.chain"),
+                     ("ups.version", "ups/v6_1_0.version"),
+                     ("ups.table", "ups/v6_1_0.table")]:
+        path = top / dst
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(here / src, path)
+    yield top
+    upscache.configure(max_bytes=upscache.default_max_bytes)
+
+def test_readers(db):
+    for _ in range(2):
+        cf = ups.ChainFile("cigetcert", dbs=[str(db)])
+        vf = ups.VersionFile("ups", "6.1.0", dbs=[str(db)])
+        tf = ups.TableFileMultiFlavor("ups", "6.1.0", dbs=[str(db)])
+        vinfos = ups._find_product_version(db / "ups", "6.1.0")
+    assert upscache.stats["misses"] == 4
+    assert upscache.stats["hits"] == 4
+    assert cf.version_quals("Linux64bit+3.10-2.17") == ("1.16.1", "")
+    assert vf.dat["vunder"] == "v6_1_0"
+    assert tf.dat["product"] == "ups"
+    assert vinfos[0][1]["version"] == "6.1.0"
+    assert upscache.info()[0] == 4
+
+    # returned data is a copy
+    cf.dat["chainblocks"].clear()
+    assert ups.ChainFile("cigetcert", dbs=[str(db)]).dat["chainblocks"]
+
+def test_stale(db):
+    path = db / "ups" / "v6_1_0.version"
+    ups.VersionFile("ups", "6.1.0", dbs=[str(db)])
+    path.write_text(path.read_text().replace("v6_1_0", "v6_1_1"))
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1000000000))
+    vf = ups.VersionFile("ups", "6.1.0", dbs=[str(db)])
+    assert vf.dat["vunder"] == "v6_1_1"
+    assert upscache.stats["misses"] == 2
+
+def test_evict(db):
+    upscache.configure(max_bytes=1)
+    ups.VersionFile("ups", "6.1.0", dbs=[str(db)])
+    ups.TableFileMultiFlavor("ups", "6.1.0", dbs=[str(db)])
+    assert upscache.stats["evicted"] == 2
+    assert upscache.info() == (0, 0)
+    upscache.configure(max_bytes=upscache.default_max_bytes)
+    ups.VersionFile("ups", "6.1.0", dbs=[str(db)])
+    ups.VersionFile("ups", "6.1.0", dbs=[str(db)])
+    assert upscache.stats["hits"] == 1
+    assert upscache.clear() == 1
+
+def test_parser_version(db, monkeypatch):
+    ups.VersionFile("ups", "6.1.0", dbs=[str(db)])
+    assert upscache.info()[0] == 1
+
+    # reconnecting with another parser drops what the old one cached
+    monkeypatch.setattr(upscache, "parser_version", upscache.parser_version + 1)
+    monkeypatch.setattr(upscache, "_con_path", None)
+    assert upscache.info()[0] == 0
+    ups.VersionFile("ups", "6.1.0", dbs=[str(db)])
+    assert upscache.stats["misses"] == 2
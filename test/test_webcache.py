@@ -0,0 +1,82 @@
+#!/usr/bin/env pytest
+'''
+Test coups.webcache through coups.scisoft.listing()
+'''
+
+# Copyright Brett Viren 2021.
+# This file is part of coups which is free software distributed under
+# the terms of the GNU Affero General Public License.
+
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+import pytest
+from coups import webcache, scisoft
+
+page = b"""<html><body><div class="inner content-inner"><table>
+<tr><th>Name</th></tr>
+<tr><td><a href="larsoft/">larsoft</a></td></tr>
+<tr><td><a href="art/">art</a></td></tr>
+</table></div></body></html>"""
+
+class Handler(BaseHTTPRequestHandler):
+    hits = list()
+    def do_GET(self):
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.hits.append(304)
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.hits.append(200)
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(page)))
+        self.end_headers()
+        self.wfile.write(page)
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server(tmp_path):
+    httpd = HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    old = dict(webcache.settings)
+    webcache.configure(directory=str(tmp_path / "cache"))
+    Handler.hits.clear()
+    yield f'http://127.0.0.1:{httpd.server_port}/bundles/'
+    webcache.configure(**old)
+    httpd.shutdown()
+
+def test_listing_cache(server):
+    want = [server + "larsoft/", server + "art/"]
+    assert scisoft.listing(server) == want
+    assert Handler.hits == [200]
+
+    # fresh, no request
+    assert list(scisoft.table(server)) == want
+    assert Handler.hits == [200]
+
+    # stale, revalidated
+    webcache.configure(ttl=0)
+    assert scisoft.listing(server) == want
+    assert Handler.hits == [200, 304]
+
+    # offline uses the cache regardless of age
+    webcache.configure(offline=True)
+    assert scisoft.listing(server) == want
+    assert Handler.hits == [200, 304]
+    with pytest.raises(ValueError):
+        scisoft.listing(server + "nope/")
+
+    webcache.configure(offline=False)
+    assert webcache.clear() == 1
+    assert scisoft.listing(server) == want
+    assert Handler.hits == [200, 304, 200]
+
+def test_table_streams(server):
+    want = [server + "larsoft/", server + "art/"]
+    rows = scisoft.table(server)
+    assert next(rows) == want[0]
+    assert webcache.load(server) is None # saved only once all consumed
+    assert list(rows) == want[1:]
+    assert webcache.load(server)["hrefs"] == want